@@ -0,0 +1,123 @@
+'''
+Plans the batches of objects workspace_statistics.py reads per query.
+
+A batch is either a window of object ids in one workspace or a group of
+whole small workspaces read with one $in query. The planner aims every batch
+at a target number of versions (documents) and tunes the target as it goes:
+
+- Throughput (versions per second of query wait plus aggregation) is
+  measured over a few batches at each target. The target is then stepped up
+  or down, continuing in the same direction while throughput improves and
+  turning back when it drops, so it settles near the fastest size for the
+  current server and data.
+- A batch that takes longer than max_seconds halves the target at once.
+- Each workspace's versions per object id is learned from its own windows
+  (and from all windows, for workspaces not seen yet), and turns the target
+  into an id window size for that workspace.
+- Workspaces expected to hold less than SMALL_FRACTION of the target are
+  coalesced until the group reaches the target.
+'''
+
+from collections import namedtuple
+
+import instrument
+
+INITIAL_DOCS_DEFAULT = 10000
+MIN_DOCS = 500
+MAX_DOCS = 500000
+MAX_SECONDS_DEFAULT = 60.0
+STEP = 1.25
+SAMPLES_PER_STEP = 3
+SMALL_FRACTION = 0.5
+MAX_COALESCE = 1000
+DENSITY_WEIGHT = 0.2
+
+# start and end are the object id range (start, end], or None for whole
+# workspaces; objects is the number of object ids covered
+Batch = namedtuple('Batch', ['workspaces', 'start', 'end', 'objects'])
+
+
+class BatchPlanner(object):
+
+    def __init__(self, initial_docs=INITIAL_DOCS_DEFAULT,
+                 max_seconds=MAX_SECONDS_DEFAULT, scale=None):
+        """scale, if given, is applied to every planned size, e.g. a
+        throttle's batch_size."""
+        self.target = float(initial_docs)
+        self.max_seconds = max_seconds
+        self.scale = scale or (lambda size: size)
+        self.density = 1.0
+        self._ws_density = {}
+        self._direction = 1
+        self._rates = []
+        self._last_rate = None
+
+    def _docs(self):
+        return max(1, self.scale(int(self.target)))
+
+    def window(self, ws):
+        """Number of object ids in the next window of workspace ws."""
+        return max(1, int(self._docs() / self._ws_density.get(ws,
+                                                              self.density)))
+
+    def plan(self, workspaces, starts=None):
+        """Takes (workspace id, object count) pairs and yields Batches,
+        planning each from the feedback given to done() so far. starts
+        maps a workspace id to the object id to start its windows after,
+        e.g. to resume part way through it."""
+        starts = starts or {}
+        small = []
+        small_objs = 0
+        for ws, objcount in workspaces:
+            if not objcount:
+                continue
+            if (ws not in starts and
+                    objcount * self.density < self._docs() * SMALL_FRACTION):
+                small.append(ws)
+                small_objs += objcount
+                if (small_objs * self.density >= self._docs() or
+                        len(small) >= MAX_COALESCE):
+                    yield Batch(small, None, None, small_objs)
+                    small = []
+                    small_objs = 0
+                continue
+            start = starts.get(ws, 0)
+            while start < objcount:
+                end = min(objcount, start + self.window(ws))
+                yield Batch([ws], start, end, end - start)
+                start = end
+        if small:
+            yield Batch(small, None, None, small_objs)
+
+    def done(self, batch, docs, seconds):
+        """Records that batch returned docs versions in seconds."""
+        if batch.objects:
+            density = max(float(docs) / batch.objects, 1e-3)
+            if len(batch.workspaces) == 1:
+                self._ws_density[batch.workspaces[0]] = density
+            self.density += DENSITY_WEIGHT * (density - self.density)
+        if seconds > self.max_seconds:
+            self._set_target(self.target / 2)
+        elif seconds > 0 and docs >= self.target / 4:
+            # partial batches at the end of a workspace are too small to
+            # say much about the target
+            self._rates.append(docs / seconds)
+            if len(self._rates) >= SAMPLES_PER_STEP:
+                self._step()
+        instrument.set_state('batch_target_docs', int(self.target))
+        instrument.set_state('versions_per_object', self.density)
+
+    def _step(self):
+        rate = sum(self._rates) / len(self._rates)
+        if self._last_rate is not None and rate < self._last_rate:
+            self._direction = -self._direction
+        self._last_rate = rate
+        self._rates = []
+        self.target = min(MAX_DOCS, max(MIN_DOCS, self.target *
+                                        STEP ** self._direction))
+
+    def _set_target(self, target):
+        self.target = min(MAX_DOCS, max(MIN_DOCS, target))
+        self._rates = []
+        self._last_rate = None
+        self._direction = -1
@@ -0,0 +1,484 @@
+#!/usr/bin/env python
+
+'''
+Benchmarks the workspace, Shock and AWE collectors against synthetic data in
+a local mongod.
+
+    # fill bench_workspace, bench_shock and bench_awe with ~1e6 records each
+    ./scripts/benchmark_collectors.py generate --port 27017 --scale 1e6
+
+    # run every collector mode against them and record the results
+    ./scripts/benchmark_collectors.py run --port 27017 --results bench
+
+    # show how each mode has trended over past runs
+    ./scripts/benchmark_collectors.py report --results bench
+
+Data generation is seeded, so the same scale and seed always give the same
+database. Workspace sizes and user activity are heavy tailed like production:
+most workspaces hold a handful of objects and a few hold most of the data.
+
+For each mode the harness records records/sec, the collector's peak RSS and
+the number of round trips to mongod (from serverStatus opcounters, so use a
+mongod nothing else is talking to). It also checks the JSON output against a
+stored reference for that mode, scale and seed. Results are appended to
+history.jsonl in the results directory, one line per run.
+'''
+
+from __future__ import print_function
+from argparse import ArgumentParser
+import calendar
+import datetime
+import hashlib
+import json
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+from bson.objectid import ObjectId
+from pymongo import MongoClient, ASCENDING, DESCENDING
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+WS_DB = 'bench_workspace'
+SHOCK_DB = 'bench_shock'
+AWE_DB = 'bench_awe'
+
+HISTORY_FILE = 'history.jsonl'
+REFERENCE_DIR = 'reference'
+
+BATCH_SIZE = 10000
+START_TIME = datetime.datetime(2013, 1, 1)
+TIME_SPAN = 4 * 365 * 24 * 3600
+# Pareto shape of the workspace sizes; it must be above 1 for the sizes to
+# have a finite mean
+WS_SIZE_ALPHA = 1.2
+# no workspace holds more than this fraction of the object versions
+WS_SIZE_CAP = 0.01
+
+TYPES = [('KBaseNarrative.Narrative-4.0', 0.2),
+         ('KBaseFBA.FBAModel-7.0', 0.2),
+         ('KBaseGenomes.Genome-8.0', 0.3),
+         ('KBaseGenomes.ContigSet-3.0', 0.2),
+         ('KBaseFBA.FBA-7.0', 0.1)]
+
+EXCLUDED_SHOCK_USER = 'workspaceshockuser'
+
+CFG_TEMPLATE = '''[SourceMongo]
+host={host}
+port={port}
+db={db}
+user=
+pwd=
+{extra}
+[TargetMongo]
+host={host}
+port={port}
+db=bench_target
+user=
+pwd=
+'''
+
+# mode -> (script, extra args, db, config extras, collection scanned, outputs)
+MODES = {
+    'ws_full': ('workspace_statistics.py', [], WS_DB,
+                'types=*\nlist-objects=KBaseNarrative.Narrative\n' +
+                'exclude-ws=-1\n', 'workspaceObjVersions',
+                ['user_data.json', 'ws_data.json', 'ws_object_list.json',
+                 'ws_bymonth.json']),
+    'ws_latest': ('workspace_statistics.py', ['--only-latest-ver'], WS_DB,
+                  'types=*\nlist-objects=KBaseNarrative.Narrative\n' +
+                  'exclude-ws=-1\n', 'workspaceObjVersions',
+                  ['user_data.json', 'ws_data.json', 'ws_object_list.json',
+                   'ws_bymonth.json']),
+    'shock': ('calculate_shock_disk_usage.py', [], SHOCK_DB,
+              'exclude-user=' + EXCLUDED_SHOCK_USER + '\n', 'Nodes',
+              ['shock_data.json']),
+    'awe': ('calculate_awe_usage.py', [], AWE_DB,
+            'exclude-user=' + EXCLUDED_SHOCK_USER + '\n', 'Jobs',
+            ['awe_user_data.json']),
+}
+
+
+def _parseArgs():
+    parser = ArgumentParser(description='Benchmark the metrics collectors ' +
+                            'against synthetic data')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=27017)
+    sub = parser.add_subparsers(dest='command')
+
+    gen = sub.add_parser('generate', help='fill the benchmark databases.')
+    gen.add_argument('-s', '--scale', type=float, default=1e5,
+                     help='approximate number of workspace object versions, ' +
+                     'Shock nodes and (a tenth as many) AWE jobs. ' +
+                     'Default %(default)s')
+    gen.add_argument('--seed', type=int, default=1)
+    gen.add_argument('--only', choices=['ws', 'shock', 'awe'],
+                     action='append', help='only generate these databases.')
+
+    run = sub.add_parser('run', help='run the collectors and record results.')
+    run.add_argument('-r', '--results', default='bench',
+                     help='directory holding the history and reference ' +
+                     'outputs. Default %(default)s')
+    run.add_argument('-m', '--mode', choices=sorted(MODES), action='append',
+                     help='only run these modes.')
+    run.add_argument('--python', default=sys.executable,
+                     help='interpreter to run the collectors with.')
+    run.add_argument('--update-reference', action='store_true',
+                     help='store this run\'s output as the reference.')
+
+    rep = sub.add_parser('report', help='show trends from the history.')
+    rep.add_argument('-r', '--results', default='bench')
+    rep.add_argument('-n', '--last', type=int, default=5,
+                     help='runs to show per mode and scale.')
+    return parser.parse_args()
+
+
+class Generator(object):
+    """Writes seeded synthetic collector inputs."""
+
+    def __init__(self, client, scale, seed):
+        self._client = client
+        self._scale = int(scale)
+        self._seed = seed
+        # each database gets its own stream, seeded by the seed and its name,
+        # so generating one alone gives the same data as generating them all
+        self._rng = None
+        users = random.Random(seed)
+        self._users = ['user{:06d}'.format(i)
+                       for i in range(max(10, self._scale // 1000))]
+        self._uuids = ['{:032x}'.format(users.getrandbits(128))
+                       for _ in self._users]
+
+    def _user(self):
+        # a few users own most of the data
+        i = int(self._rng.paretovariate(1.1)) - 1
+        return min(i, len(self._users) - 1)
+
+    def _time(self, frac=None):
+        if frac is None:
+            frac = self._rng.random()
+        return int(calendar.timegm(START_TIME.timetuple()) +
+                   frac * TIME_SPAN)
+
+    def _oid(self, ts):
+        return ObjectId(struct.pack('>I', ts) + struct.pack(
+            '>Q', self._rng.getrandbits(64)))
+
+    def _type(self):
+        r = self._rng.random()
+        for t, p in TYPES:
+            r -= p
+            if r < 0:
+                return t
+        return TYPES[-1][0]
+
+    def _writer(self, col):
+        buf = []
+
+        def add(doc=None):
+            if doc is not None:
+                buf.append(doc)
+            if buf and (doc is None or len(buf) >= BATCH_SIZE):
+                col.insert_many(buf, ordered=False)
+                del buf[:]
+        return add
+
+    def _reset(self, dbname):
+        key = '{}:{}'.format(self._seed, dbname).encode('utf-8')
+        self._rng = random.Random(int(hashlib.sha1(key).hexdigest(), 16))
+        self._client.drop_database(dbname)
+        return self._client[dbname]
+
+    def workspace(self):
+        db = self._reset(WS_DB)
+        add_ws = self._writer(db.workspaces)
+        add_acl = self._writer(db.workspaceACLs)
+        add_obj = self._writer(db.workspaceObjects)
+        add_ver = self._writer(db.workspaceObjVersions)
+        versions = 0
+        wsid = 0
+        while versions < self._scale:
+            wsid += 1
+            owner = self._users[self._user()]
+            nobj = min(int(self._rng.paretovariate(WS_SIZE_ALPHA)) - 1,
+                       max(1, int(self._scale * WS_SIZE_CAP)),
+                       self._scale - versions)
+            ws = {'ws': wsid, 'numObj': nobj, 'owner': owner,
+                  'del': self._rng.random() < 0.05,
+                  'name': '{}:ws{}'.format(owner, wsid)}
+            if self._rng.random() < 0.3:
+                ws['meta'] = [{'k': 'narrative', 'v': '1'},
+                              {'k': 'narrative_nice_name',
+                               'v': 'Narrative {}'.format(wsid)},
+                              {'k': 'is_temporary', 'v': 'false'}]
+            add_ws(ws)
+            add_acl({'id': wsid, 'user': owner, 'perm': 40})
+            if self._rng.random() < 0.1:
+                add_acl({'id': wsid, 'user': '*', 'perm': 10})
+            for _ in range(int(self._rng.expovariate(1.5))):
+                add_acl({'id': wsid, 'user': self._users[self._user()],
+                         'perm': 20})
+            wsfrac = float(versions) / self._scale
+            for objid in range(1, nobj + 1):
+                numver = 1 + int(self._rng.expovariate(0.7))
+                add_obj({'ws': wsid, 'id': objid, 'numver': numver,
+                         'name': 'obj{}'.format(objid),
+                         'del': self._rng.random() < 0.05})
+                t = self._type()
+                for ver in range(1, numver + 1):
+                    ts = self._time(min(1.0, wsfrac +
+                                        self._rng.random() * 0.01))
+                    v = {'_id': self._oid(ts), 'ws': wsid, 'id': objid,
+                         'ver': ver, 'type': t,
+                         'size': int(self._rng.lognormvariate(9, 2.5)),
+                         'savedby': self._users[self._user()],
+                         'savedate': datetime.datetime.utcfromtimestamp(ts)}
+                    if t.startswith('KBaseNarrative'):
+                        v['meta'] = [{'k': 'methods', 'v': '{}'},
+                                     {'k': 'job_info', 'v': '{}'}]
+                    add_ver(v)
+                    versions += 1
+        for add in (add_ws, add_acl, add_obj, add_ver):
+            add()
+        db.workspaces.create_index([('ws', ASCENDING)], unique=True)
+        db.workspaceACLs.create_index([('id', ASCENDING)])
+        db.workspaceObjects.create_index([('ws', ASCENDING),
+                                          ('id', ASCENDING)], unique=True)
+        db.workspaceObjVersions.create_index([('ws', ASCENDING),
+                                              ('id', ASCENDING),
+                                              ('ver', DESCENDING)],
+                                             unique=True)
+        return versions
+
+    def _add_users(self, db):
+        add = self._writer(db.Users)
+        for name, uuid in zip(self._users, self._uuids):
+            add({'uuid': uuid, 'username': name})
+        add({'uuid': '0' * 32, 'username': EXCLUDED_SHOCK_USER})
+        add()
+        db.Users.create_index([('uuid', ASCENDING)])
+
+    def shock(self):
+        db = self._reset(SHOCK_DB)
+        self._add_users(db)
+        add = self._writer(db.Nodes)
+        for i in range(self._scale):
+            r = self._rng.random()
+            if r < 0.02:
+                owner = ''
+            elif r < 0.3:
+                owner = '0' * 32
+            else:
+                owner = self._uuids[self._user()]
+            read = [] if self._rng.random() < 0.2 else [owner]
+            add({'_id': self._oid(self._time(float(i) / self._scale)),
+                 'acl': {'owner': owner, 'read': read},
+                 'file': {'size': int(self._rng.lognormvariate(12, 3))}})
+        add()
+        db.Nodes.create_index([('acl.owner', ASCENDING)])
+        return self._scale
+
+    def awe(self):
+        db = self._reset(AWE_DB)
+        self._add_users(db)
+        add = self._writer(db.Jobs)
+        njobs = max(1, self._scale // 10)
+        for i in range(njobs):
+            start = START_TIME + datetime.timedelta(
+                seconds=float(i) / njobs * TIME_SPAN)
+            tasks = []
+            for _ in range(1 + int(self._rng.expovariate(0.5))):
+                run = datetime.timedelta(
+                    seconds=self._rng.lognormvariate(5, 2))
+                tasks.append({'startedDate': start,
+                              'completedDate': start + run})
+                start += run
+            job = {'tasks': tasks}
+            if self._rng.random() > 0.05:  # older jobs have no ACLs
+                owner = ('public' if self._rng.random() < 0.1
+                         else self._uuids[self._user()])
+                job['acl'] = {'owner': owner, 'read': []}
+            add(job)
+        add()
+        db.Jobs.create_index([('acl.owner', ASCENDING)])
+        return njobs
+
+
+def round_trips(client):
+    ops = client.admin.command('serverStatus')['opcounters']
+    return ops['query'] + ops['getmore'] + ops['command']
+
+
+def run_collector(python, script, args, workdir):
+    """Runs a collector and returns its wall time and peak RSS in kB."""
+    log = open(os.path.join(workdir, 'collector.log'), 'w')
+    try:
+        start = time.time()
+        p = subprocess.Popen([python, os.path.join(SCRIPT_DIR, script)] +
+                             args, cwd=workdir, stdout=log,
+                             stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(p.pid, 0)
+        elapsed = time.time() - start
+    finally:
+        log.close()
+    if status != 0:
+        with open(os.path.join(workdir, 'collector.log')) as f:
+            print(f.read()[-2000:])
+        raise RuntimeError('{} exited with status {}'.format(script, status))
+    return elapsed, usage.ru_maxrss
+
+
+def load_outputs(outdir, files):
+    out = {}
+    for f in files:
+        with open(os.path.join(outdir, f)) as fh:
+            out[f] = json.load(fh)
+    return out
+
+
+def check_reference(refdir, outdir, files, update):
+    """Compares outputs against the reference, storing them as the reference
+    if there is none. Returns True, False or None for a new reference."""
+    if update or not os.path.isdir(refdir):
+        if os.path.isdir(refdir):
+            shutil.rmtree(refdir)
+        os.makedirs(refdir)
+        for f in files:
+            shutil.copy(os.path.join(outdir, f), refdir)
+        return None
+    return load_outputs(refdir, files) == load_outputs(outdir, files)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=SCRIPT_DIR).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def dataset_info(client, db):
+    """The scale and seed the database db was generated with."""
+    info = client[db].bench_info.find_one() or {}
+    return info.get('scale'), info.get('seed')
+
+
+def run_modes(args, client):
+    modes = []
+    for mode in args.mode or sorted(MODES):
+        scale, seed = dataset_info(client, MODES[mode][2])
+        if scale is None:
+            print('No benchmark data for {} in {}, skipping'.format(
+                mode, MODES[mode][2]))
+        else:
+            modes.append((mode, scale, seed))
+    if not modes:
+        print('No benchmark data found, run generate first')
+        sys.exit(1)
+    if not os.path.isdir(args.results):
+        os.makedirs(args.results)
+    commit = git_commit()
+    for mode, scale, seed in modes:
+        script, extra_args, db, cfg_extra, col, files = MODES[mode]
+        records = client[db][col].count_documents({})
+        workdir = tempfile.mkdtemp(prefix='bench-' + mode + '-')
+        try:
+            cfg = os.path.join(workdir, 'bench.cfg')
+            with open(cfg, 'w') as f:
+                f.write(CFG_TEMPLATE.format(host=args.host, port=args.port,
+                                            db=db, extra=cfg_extra))
+            outdir = os.path.join(workdir, 'out')
+            trips = round_trips(client)
+            elapsed, rss = run_collector(
+                args.python, script,
+                ['--config', cfg, '--output', outdir] + extra_args, workdir)
+            # less the serverStatus call above
+            trips = round_trips(client) - trips - 1
+            refdir = os.path.join(args.results, REFERENCE_DIR,
+                                  '{}-{}-{}'.format(mode, scale, seed))
+            match = check_reference(refdir, outdir, files,
+                                    args.update_reference)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        result = {'mode': mode, 'scale': scale, 'seed': seed,
+                  'commit': commit,
+                  'date': datetime.datetime.utcnow().isoformat(),
+                  'records': records, 'seconds': elapsed,
+                  'records_per_sec': records / elapsed if elapsed else None,
+                  'peak_rss_kb': rss, 'round_trips': trips,
+                  'output_matches_reference': match}
+        with open(os.path.join(args.results, HISTORY_FILE), 'a') as f:
+            f.write(json.dumps(result, sort_keys=True) + '\n')
+        print(('{mode}: {records} records in {seconds:.1f} s, ' +
+               '{records_per_sec:.0f} rec/s, peak RSS {peak_rss_kb} kB, ' +
+               '{round_trips} round trips, reference match: ' +
+               '{output_matches_reference}').format(**result))
+        if match is False:
+            print('WARNING: {} output differs from the reference'.format(
+                mode))
+
+
+def print_table(rows):
+    widths = [len(max(columns, key=len)) for columns in zip(*rows)]
+    for i, row in enumerate(rows):
+        print(' | '.join(format(c, '%ds' % w) for w, c in zip(widths, row)))
+        if i == 0:
+            print('-+-'.join('-' * w for w in widths))
+
+
+def report(args):
+    path = os.path.join(args.results, HISTORY_FILE)
+    if not os.path.isfile(path):
+        print('No history at ' + path)
+        sys.exit(1)
+    runs = {}
+    with open(path) as f:
+        for line in f:
+            r = json.loads(line)
+            runs.setdefault((r['mode'], r['scale']), []).append(r)
+    rows = [('mode', 'scale', 'date', 'commit', 'rec/s', 'change',
+             'RSS kB', 'trips', 'ref')]
+    for key in sorted(runs):
+        prev = None
+        for r in runs[key][-args.last:]:
+            rate = r['records_per_sec'] or 0
+            change = ''
+            if prev:
+                change = '{:+.1f}%'.format(100.0 * (rate - prev) / prev)
+            prev = rate
+            rows.append((r['mode'], str(r['scale']), r['date'][0:16],
+                         str(r['commit']), '{:.0f}'.format(rate), change,
+                         str(r['peak_rss_kb']), str(r['round_trips']),
+                         str(r['output_matches_reference'])))
+    print_table(rows)
+
+
+def main():
+    args = _parseArgs()
+    if args.command == 'report':
+        report(args)
+        return
+    client = MongoClient(args.host, args.port)
+    if args.command == 'generate':
+        gen = Generator(client, args.scale, args.seed)
+        only = args.only or ['ws', 'shock', 'awe']
+        dbs = {'ws': WS_DB, 'shock': SHOCK_DB, 'awe': AWE_DB}
+        for name in only:
+            t = time.time()
+            n = getattr(gen, {'ws': 'workspace'}.get(name, name))()
+            print('Generated {} {} records in {} s'.format(
+                n, name, time.time() - t))
+            client[dbs[name]].bench_info.insert_one(
+                {'scale': int(args.scale), 'seed': args.seed})
+    elif args.command == 'run':
+        run_modes(args, client)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,8 +7,15 @@ Created on Oct 29, 2014
 Calculate awe disk job counts and time usage by user, separated into
 public vs. private jobs.
 
-Don't run this during high loads - runs through every object in the DB
+Don't run this during high loads - runs through every object in the DB,
+unless run with --throttle to pace the scan to the load on the server.
 Hasn't been optimized much either.
+
+Job owners missing from the Users collection are counted under their uuid,
+with a warning.
+
+With --publish, the per user summaries are also written to the TargetMongo
+database (see publish.py).
 '''
 
 # TODO: checks to see this is accurate
@@ -26,6 +33,10 @@ import datetime
 from _collections import defaultdict
 import json
 
+import instrument
+import publish
+import throttle
+
 # where to get credentials (don't check these into git, idiot)
 CFG_FILE_DEFAULT = 'awe_usage.cfg'
 CFG_SECTION_SOURCE = 'SourceMongo'
@@ -60,6 +71,8 @@ TIME = 'seconds'
 
 NO_OWNER = '__NONE__'
 
+unknownOwners = set()
+
 def _parseArgs():
     parser = ArgumentParser(description='Calculate awe job and time usage by ' +
                                         'user')
@@ -71,6 +84,9 @@ def _parseArgs():
     parser.add_argument('-o', '--output',
                         help='write json output to this directory. If it ' +
                         'does not exist it will be created.')
+    instrument.add_arguments(parser)
+    throttle.add_arguments(parser)
+    publish.add_arguments(parser)
     return parser.parse_args()
 
 
@@ -152,7 +168,9 @@ def processNames(srcdb, excluded_names):
     excluded = []
     uuid2name = {}
     # may need to batch this a long time from now
-    for u in srcdb[COL_USER].find({}, [USER_UUID, USER_NAME, 'name']):
+    for u in instrument.timed_iter(
+            srcdb[COL_USER].find({}, [USER_UUID, USER_NAME, 'name']),
+            'query_wait'):
         if not u.get(USER_NAME):
             continue
         uuid2name[u[USER_UUID]] = u[USER_NAME]
@@ -161,29 +179,44 @@ def processNames(srcdb, excluded_names):
     return uuid2name, excluded
 
 
-def processJobRecs(userdata, recs, uuid2name, excludedUUIDs):
+def ownerName(uuid2name, uuid):
+    """The user name of owner uuid, or the uuid for an owner missing from
+    the Users collection."""
+    name = uuid2name.get(uuid)
+    if name is None:
+        if uuid not in unknownOwners:
+            unknownOwners.add(uuid)
+            instrument.count('unknown_owners')
+            print('Warning: no user name for owner {}, counting the uuid'
+                  .format(uuid))
+        return uuid
+    return name
+
+
+def processJobRecs(userdata, recs, uuid2name, excludedUUIDs, pacer):
     acl = 'acl'
     read = 'read'
     owner = 'owner'
     count = 0
     ttl = 0
     t = time.time()
-    for rec in recs:
+    for rec in pacer.paced(instrument.timed_iter(recs, 'query_wait')):
         if ttl % 10000 == 0:
             print("Processed {} records, kept {} in {} s".format(
                 ttl, count, time.time() - t))
             sys.stdout.flush()
         ttl += 1
+        instrument.count('records_read')
 
         # previous versions of AWE did not have job ACL's, so we need to check for them
-	if acl in rec:
+        if acl in rec:
             o = rec[acl].get(owner)
             if o in excludedUUIDs:
                 continue
             if o == "public":
                 o = NO_OWNER
             else:
-                o = uuid2name[o]
+                o = ownerName(uuid2name, o)
             r = rec[acl][read]
             pub = PUBLIC if len(r) == 0 else PRIVATE
 
@@ -196,9 +229,10 @@ def processJobRecs(userdata, recs, uuid2name, excludedUUIDs):
             userdata[o][pub][OBJ_CNT] += 1
             userdata[o][pub][TIME] += total_runtime
             count += 1
+            instrument.count('records_kept')
 
 
-def processJobs(srcdb, uuid2name, excludedUUIDs):
+def processJobs(srcdb, uuid2name, excludedUUIDs, pacer):
     d = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
 
     # turns out the stupid query is the fastest, trying to page via UUID
@@ -213,7 +247,9 @@ def processJobs(srcdb, uuid2name, excludedUUIDs):
 
     recs = srcdb[COL_JOBS].find({JOB_OWNER: {'$nin': excludedUUIDs}},
                                 [JOB_OWNER, JOB_READ, TASKS])
-    processJobRecs(d, recs, uuid2name, excludedUUIDs)
+    with instrument.timer('aggregation',
+                          excluding=('query_wait', 'throttle')):
+        processJobRecs(d, recs, uuid2name, excludedUUIDs, pacer)
     return d
 
 
@@ -221,7 +257,9 @@ def main():
     args = _parseArgs()
     outdir = args.output
     make_and_check_output_dir(outdir)
-    sourcecfg, targetcfg = get_config(args.config)  # @UnusedVariable
+    sourcecfg, targetcfg = get_config(args.config)
+    instrument.init('calculate_awe_usage')
+    instrument.start_from_args(args)
     starttime = time.time()
     srcmongo = MongoClient(sourcecfg[CFG_HOST], sourcecfg[CFG_PORT],
                            slaveOk=True)
@@ -229,14 +267,25 @@ def main():
     if sourcecfg[CFG_USER]:
         srcdb.authenticate(sourcecfg[CFG_USER], sourcecfg[CFG_PWD])
     print('Processing user names... ', end='')
+    instrument.set_state('phase', 'names')
     uuid2name, excludedUUIDs = processNames(srcdb, sourcecfg[CFG_EXCLUDE_USER])
     print('done.')
 
-    userdata = processJobs(srcdb, uuid2name, excludedUUIDs)
+    instrument.set_state('phase', 'records')
+    userdata = processJobs(srcdb, uuid2name, excludedUUIDs,
+                           throttle.from_args(args, srcdb))
 
     if outdir:
-        with open(os.path.join(outdir, USER_FILE), 'w') as f:
+        with instrument.timer('output'), \
+                open(os.path.join(outdir, USER_FILE), 'w') as f:
             f.write(json.dumps(userdata))
+    if args.publish:
+        instrument.set_state('phase', 'publish')
+        print('Publishing summaries')
+        publisher = publish.from_config(targetcfg, 'awe')
+        publisher.users(userdata.items())
+        publisher.finish({'description': 'Summary of AWE jobs and run ' +
+                          'time by user'})
 
     print('\nElapsed time: ' + str(time.time() - starttime))
 
@@ -12,7 +12,41 @@ These figures may not be actually related to the physical disk space since
 shock has the ability to copy a node, which I believe makes the equivalent
 of a hard link.
 
-Don't run this during high loads - runs through every object in the DB
+With --sample, only a random sample of days of nodes is scanned, stratified
+by month, and the figures are estimated from it (see sampling.py). The
+estimates are written to shock_data_sample.json.
+
+With --since and --until, only nodes created in that date window are scanned,
+selected by _id range (see timeseries.py). --granularity sets the size of the
+by_month buckets.
+
+If the source host setting lists several replica set members, e.g.
+host=mongo1,mongo2,mongo3, the nodes are split into _id ranges that are read
+from all of the members at once (see replicas.py). --sample reads from a
+single member.
+
+With --publish, the per user and time bucket summaries are also written to
+the TargetMongo database (see publish.py).
+
+Each by_month bucket also has the number of distinct owners of the nodes
+made in it, under owners, and in it or any earlier bucket, under
+cumulative_owners, estimated from a HyperLogLog sketch per day (see hll.py).
+The day sketches are written to shock_owners_sketches.json.
+
+With --shard-dir DIR, the output is also written as gzipped JSON shards under
+DIR/shock_data with a manifest (see shards.py): by_user split by the first
+letters of the user names, and by_month as a single shard. Only the shards
+whose content changed since the last run are written.
+
+Nodes are read in windows of NODE_WINDOW_DAYS of _ids. With --checkpoint FILE,
+the last window read and the totals so far are saved every
+--checkpoint-interval seconds, and a run with --resume carries on from there
+after a crash (see checkpoint.py). A window that fails with a lost connection
+or a timed out cursor is read again. Owners missing from the Users collection
+are counted under their uuid, with a warning.
+
+Don't run this during high loads - runs through every object in the DB,
+unless run with --throttle to pace the scan to the load on the server.
 Hasn't been optimized much either.
 '''
 
@@ -30,7 +64,18 @@ from pymongo.mongo_client import MongoClient
 import time
 from _collections import defaultdict
 import json
-from datetime import date
+from datetime import date, datetime, timedelta
+from bson.objectid import ObjectId
+
+import checkpoint
+import hll
+import instrument
+import publish
+import replicas
+import sampling
+import shards
+import throttle
+import timeseries
 
 
 # where to get credentials (don't check these into git, idiot)
@@ -49,6 +94,7 @@ CFG_STAFF_FILE = 'staff-file'
 
 # output file names
 USER_FILE = 'shock_data.json'
+OWNERS_FILE = 'shock_owners_sketches.json'
 
 # collection names
 COL_USER = 'Users'
@@ -67,12 +113,15 @@ STAFF = ':staff'
 USER = ':user'
 OBJ_CNT = 'cnt'
 BYTES = 'byte'
+OWNERS = 'owners'
 
 NO_OWNER = '__NONE__'
 
 MAX_NODES_PER_CALL = 10000
+NODE_WINDOW_DAYS = 30
 
 staff = {}
+unknownOwners = set()
 
 def _parseArgs():
     parser = ArgumentParser(description='Calculate shock disk usage by ' +
@@ -85,6 +134,14 @@ def _parseArgs():
     parser.add_argument('-o', '--output',
                         help='write json output to this directory. If it ' +
                         'does not exist it will be created.')
+    instrument.add_arguments(parser)
+    throttle.add_arguments(parser)
+    replicas.add_arguments(parser)
+    timeseries.add_arguments(parser)
+    publish.add_arguments(parser)
+    shards.add_arguments(parser)
+    checkpoint.add_arguments(parser)
+    sampling.add_arguments(parser, 'days of nodes')
     return parser.parse_args()
 
 
@@ -166,7 +223,9 @@ def processNames(srcdb, excluded_names):
     excluded = []
     uuid2name = {}
     # may need to batch this a long time from now
-    for u in srcdb[COL_USER].find({}, [USER_UUID, USER_NAME, 'name']):
+    for u in instrument.timed_iter(
+            srcdb[COL_USER].find({}, [USER_UUID, USER_NAME, 'name']),
+            'query_wait'):
         if not u.get(USER_NAME):
             continue
         uuid2name[u[USER_UUID]] = u[USER_NAME]
@@ -175,7 +234,8 @@ def processNames(srcdb, excluded_names):
     return uuid2name, excluded
 
 
-def processNodeRecs(userdata, recs, uuid2name, excludedUUIDs):
+def processNodeRecs(userdata, recs, uuid2name, excludedUUIDs, pacer,
+                    granularity):
     acl = 'acl'
     read = 'read'
     owner = 'owner'
@@ -184,30 +244,34 @@ def processNodeRecs(userdata, recs, uuid2name, excludedUUIDs):
     count = 0
     ttl = 0
     t = time.time()
-    for rec in recs:
+    for rec in pacer.paced(instrument.timed_iter(recs, 'query_wait')):
         if ttl % 10000 == 0:
             print("Processed {} records, kept {} in {} s".format(
                 ttl, count, time.time() - t))
             sys.stdout.flush()
         ttl += 1
+        instrument.count('records_read')
         s = rec[file_][size]
         o = rec[acl].get(owner)
-        o_str = str(rec['_id']) 
-        id_time = int(o_str[0:8], 16)
-        month=date.fromtimestamp(id_time).strftime('%Y%m')
+        month = timeseries.id_label(rec['_id'], granularity)
 
         if o in excludedUUIDs:
             continue
         if not o:
             o = NO_OWNER
         else:
-            o = uuid2name[o]
+            o = ownerName(uuid2name, o)
         r = rec[acl][read]
         pub = PUBLIC if len(r) == 0 else PRIVATE
         userdata['by_user'][o][pub][OBJ_CNT] += 1
         userdata['by_user'][o][pub][BYTES] += s
         userdata['by_month'][month][pub][OBJ_CNT] += 1
         userdata['by_month'][month][pub][BYTES] += s
+        if o != NO_OWNER:
+            day = timeseries.id_label(rec['_id'], 'day')
+            if day not in userdata[OWNERS]:
+                userdata[OWNERS][day] = hll.HyperLogLog()
+            userdata[OWNERS][day].add(o)
         if o in staff:
             pub=pub+STAFF
         else:
@@ -216,10 +280,58 @@ def processNodeRecs(userdata, recs, uuid2name, excludedUUIDs):
         userdata['by_month'][month][pub][OBJ_CNT] += 1
         userdata['by_month'][month][pub][BYTES] += s
         count += 1
-
-
-def processNodes(srcdb, uuid2name, excludedUUIDs):
-    d = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: defaultdict(int))))
+        instrument.count('records_kept')
+
+
+def ownerName(uuid2name, uuid):
+    """The user name of owner uuid, or the uuid for an owner missing from
+    the Users collection, e.g. a user deleted since the node was made."""
+    name = uuid2name.get(uuid)
+    if name is None:
+        if uuid not in unknownOwners:
+            unknownOwners.add(uuid)
+            instrument.count('unknown_owners')
+            print('Warning: no user name for owner {}, counting the uuid'
+                  .format(uuid))
+        return uuid
+    return name
+
+
+def nodeQuery(excludedUUIDs, id_range=None):
+    query = {NODE_OWNER: {'$nin': excludedUUIDs}}
+    if id_range:
+        query['_id'] = id_range
+    return query
+
+
+def newUserData():
+    return defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: defaultdict(int))))
+
+
+def readNodes(db, id_range, uuid2name, excludedUUIDs, pacer, granularity):
+    """Aggregates the nodes in _id range id_range into new user data.
+    Returns the data and the highest _id read, or None if there were no
+    nodes."""
+    d = newUserData()
+    recs = db[COL_NODE].find(nodeQuery(excludedUUIDs, id_range),
+                             [NODE_OWNER, NODE_READ, NODE_SIZE])
+    last = []
+
+    def tracked(recs):
+        for rec in recs:
+            if not last or rec['_id'] > last[0]:
+                last[:] = [rec['_id']]
+            yield rec
+    with instrument.timer('aggregation',
+                          excluding=('query_wait', 'throttle')):
+        processNodeRecs(d, tracked(recs), uuid2name, excludedUUIDs, pacer,
+                        granularity)
+    return d, last[0] if last else None
+
+
+def processNodes(srcdb, uuid2name, excludedUUIDs, pacer, granularity,
+                 since=None, until=None, ckpt=None, resume=None):
+    d = newUserData()
 
     # turns out the stupid query is the fastest, trying to page via UUID
     # prefixes is way slower (confirmed was only scanning ~2k records via
@@ -230,21 +342,214 @@ def processNodes(srcdb, uuid2name, excludedUUIDs):
     # http://docs.mongodb.org/manual/reference/method/cursor.skip/
     # this approach won't work for most cases - only useful if you want
     # to scan the whole collection and can let mongo do the batching for you.\
+    # The query is still one cursor per window of NODE_WINDOW_DAYS of _ids,
+    # which walks the _id index in order, so a window that fails with a
+    # timed out cursor can be read again and a checkpoint can record the
+    # highest _id read so far, also for an open ended last window.
+
+    windows = nodeWindows(srcdb, since, until)
+    position = None
+    if resume:
+        replicas.merge_counts(d, resume['state'])
+        position = resume['position']
+        windows = resumeWindows(windows, position)
+    for i, id_range in enumerate(windows):
+        instrument.set_state('windows_done', i)
+        part, last = checkpoint.retry(
+            lambda: readNodes(srcdb, id_range, uuid2name, excludedUUIDs,
+                              pacer, granularity),
+            'Nodes {}'.format(id_range))
+        replicas.merge_counts(d, part)
+        if last is not None:
+            position = max(position, last) if position else last
+        if ckpt and ckpt.due():
+            ckpt.save({'position': position, 'state': checkpoint.plain(d)})
+    instrument.set_state('windows_done', len(windows))
+    addCumulative(d, granularity, since, until)
+    return d
 
-    recs = srcdb[COL_NODE].find({NODE_OWNER: {'$nin': excludedUUIDs}},
-                                [NODE_OWNER, NODE_READ, NODE_SIZE])
-    processNodeRecs(d, recs, uuid2name, excludedUUIDs)
+
+def addCumulative(d, granularity, since=None, until=None):
     cum=defaultdict(lambda: defaultdict(int))
-    for month in sorted(d['by_month']):
+    for month in timeseries.labels(list(d['by_month']), granularity, since,
+                                   until):
         types=d['by_month'][month].keys();
         for type in (PUBLIC,PRIVATE,PUBLIC+STAFF,PRIVATE+STAFF,PUBLIC+USER,PRIVATE+USER) :
             for acc in ("byte","cnt"):
                cum[type][acc]+=d['by_month'][month][type][acc]
                d['by_month'][month]['cumulative_'+type][acc]=cum[type][acc]
-               
-        
+
+
+def nodeSpan(srcdb, since=None, until=None):
+    """The times of the first node, or since, and now, or until, or None if
+    there are no nodes."""
+    first = list(srcdb[COL_NODE].find({}, ['_id']).sort('_id', 1).limit(1))
+    if not first:
+        return None
+    start = first[0]['_id'].generation_time.replace(tzinfo=None)
+    if since:
+        start = max(start, datetime.combine(since, datetime.min.time()))
+    end = datetime.utcnow()
+    if until:
+        end = min(end, datetime.combine(until, datetime.min.time()))
+    return start, end
+
+
+def idRanges(bounds, since=None, until=None):
+    """The _id ranges between the ObjectIds bounds. The first and last
+    ranges are open ended unless since or until is given."""
+    lows = [None] + bounds
+    highs = bounds + [None]
+    id_range = timeseries.id_range(since, until) or {}
+    ranges = []
+    for low, high in zip(lows, highs):
+        r = dict(id_range)
+        if low:
+            r['$gte'] = low
+        if high:
+            r['$lt'] = high
+        ranges.append(r or None)
+    return ranges
+
+
+def nodeWindows(srcdb, since=None, until=None):
+    """Splits the nodes created from since, or the first node, to until,
+    or now, into _id ranges of NODE_WINDOW_DAYS."""
+    span = nodeSpan(srcdb, since, until)
+    if not span:
+        return []
+    start, end = span
+    step = timedelta(days=NODE_WINDOW_DAYS)
+    bounds = []
+    while start + step * (len(bounds) + 1) < end:
+        bounds.append(ObjectId.from_datetime(start + step * (len(bounds) + 1)))
+    return idRanges(bounds, since, until)
+
+
+def resumeWindows(windows, position):
+    """The part of windows after ObjectId position, the highest _id read
+    before the checkpoint, or all of them if position is None."""
+    if position is None:
+        return windows
+    windows = [w for w in windows if not w or '$lt' not in w or
+               w['$lt'] > position]
+    if windows:
+        first = dict(windows[0] or {})
+        if first.get('$gte', position) <= position:
+            first.pop('$gte', None)
+            first['$gt'] = position
+        windows[0] = first
+    return windows
+
+
+def nodePartitions(srcdb, n, since=None, until=None):
+    """Splits the nodes created from since, or the first node, to until,
+    or now, into n _id ranges of equal time spans. The first and last
+    ranges are open ended unless since or until is given."""
+    span = nodeSpan(srcdb, since, until)
+    if not span:
+        return []
+    start, end = span
+    step = max(end - start, timedelta(seconds=n)) // n
+    return idRanges([ObjectId.from_datetime(start + step * i)
+                     for i in range(1, n)], since, until)
+
+
+def processNodesPartitioned(pool, uuid2name, excludedUUIDs, args, ckpt=None,
+                            resume=None):
+    """Like processNodes, but reads the nodes from every member in the
+    replicas.MemberPool pool, a range of _ids at a time. The checkpoint
+    holds the ranges and which of them are done."""
+    d = newUserData()
+    done = set()
+    if resume:
+        replicas.merge_counts(d, resume['state'])
+        parts = resume['partitions']
+        done = set(resume['done'])
+    else:
+        parts = nodePartitions(pool.db(), pool.partitions(), args.since,
+                               args.until)
+    todo = [(i, r) for i, r in enumerate(parts) if i not in done]
+    print('Reading {} partitions from {} members'.format(
+        len(todo), len(pool.members)))
+
+    def context(member):
+        return throttle.from_args(args, None)
+
+    def work(db, pacer, part):
+        pacer.db = db
+        return readNodes(db, part[1], uuid2name, excludedUUIDs, pacer,
+                         args.granularity)[0]
+
+    for (i, _), part in pool.run(todo, work, context,
+                                 checkpoint.is_transient):
+        replicas.merge_counts(d, part)
+        done.add(i)
+        if ckpt and ckpt.due():
+            ckpt.save({'partitions': parts, 'done': sorted(done),
+                       'state': checkpoint.plain(d)})
+    addCumulative(d, args.granularity, args.since, args.until)
     return d
 
+def drawSample(srcdb, sample, since=None, until=None):
+    """Returns the sampled (month, day) units, covering every day from the
+    first node, or since, to today, or the day before until. Days are local
+    dates, like the buckets of the full run."""
+    first = list(srcdb[COL_NODE].find({}, ['_id']).sort('_id', 1).limit(1))
+    if not first:
+        return []
+    day = max(timeseries.id_date(first[0]['_id']), since or date.min)
+    last = date.today()
+    if until:
+        last = min(last, until - timedelta(days=1))
+    strata = defaultdict(list)
+    while day <= last:
+        strata[day.strftime('%Y%m')].append(day)
+        day += timedelta(days=1)
+    return sample.draw(strata)
+
+
+def sampleNodes(srcdb, sample, units, uuid2name, excludedUUIDs, pacer,
+                granularity):
+    for i, (month, day) in enumerate(units):
+        instrument.set_state('days_done', i)
+        print('Sample {}/{}: nodes created on {}'.format(i + 1, len(units),
+                                                         day))
+        query = {NODE_OWNER: {'$nin': excludedUUIDs},
+                 '_id': timeseries.id_range(day, day + timedelta(days=1))}
+        recs = srcdb[COL_NODE].find(query, [NODE_OWNER, NODE_READ, NODE_SIZE])
+        d = newUserData()
+        with instrument.timer('aggregation',
+                              excluding=('query_wait', 'throttle')):
+            processNodeRecs(d, recs, uuid2name, excludedUUIDs, pacer,
+                            granularity)
+            sample.add(month, d)
+    instrument.set_state('days_done', len(units))
+
+
+def sampleUserData(sample, granularity, since=None, until=None):
+    """Returns the estimates in the shape of the full output. Months are
+    sampled independently so the variance of a cumulative figure is the sum
+    of the monthly variances."""
+    est = sample.estimates()
+    cum = defaultdict(lambda: [0.0, 0.0])
+    for month in timeseries.labels(
+            set(k[1] for k in est if k[0] == 'by_month'), granularity, since,
+            until):
+        for type in (PUBLIC,PRIVATE,PUBLIC+STAFF,PRIVATE+STAFF,PUBLIC+USER,PRIVATE+USER) :
+            for acc in (BYTES, OBJ_CNT):
+                e = est.get(('by_month', month, type, acc), (0.0, 0.0))
+                c = cum[type, acc]
+                c[0] += e[0]
+                c[1] += e[1]
+                est[('by_month', month, 'cumulative_' + type, acc)] = tuple(c)
+    d = sampling.nest(est)
+    d['meta'] = sample.meta()
+    d['meta']['author'] = 'Gavin Price, Jared Bischof, Shane Canon'
+    d['meta']['description'] = 'Estimate of the amount of data stored in shock both by user and by month'
+    return d
+
+
 def processStaff(file):
     f=open(file)
     for name in f:
@@ -254,28 +559,108 @@ def main():
     args = _parseArgs()
     outdir = args.output
     make_and_check_output_dir(outdir)
-    sourcecfg, targetcfg = get_config(args.config)  # @UnusedVariable
+    sourcecfg, targetcfg = get_config(args.config)
+    if args.publish and (args.sample or args.since or args.until):
+        print('--publish needs a full run, without --sample, --since or ' +
+              '--until')
+        sys.exit(1)
+    if args.checkpoint and args.sample:
+        print('--checkpoint can not be combined with --sample')
+        sys.exit(1)
+    if args.shard_dir and args.sample:
+        print('--shard-dir can not be combined with --sample')
+        sys.exit(1)
+    instrument.init('calculate_shock_disk_usage')
+    instrument.start_from_args(args)
     starttime = time.time()
-    srcmongo = MongoClient(sourcecfg[CFG_HOST], sourcecfg[CFG_PORT],
-                           slaveOk=True)
-    srcdb = srcmongo[sourcecfg[CFG_DB]]
-    if sourcecfg[CFG_USER]:
-        srcdb.authenticate(sourcecfg[CFG_USER], sourcecfg[CFG_PWD])
+    pool = None
+    if len(replicas.members(sourcecfg[CFG_HOST], sourcecfg[CFG_PORT])) > 1:
+        pool = replicas.MemberPool(
+            sourcecfg[CFG_HOST], sourcecfg[CFG_PORT], sourcecfg[CFG_DB],
+            sourcecfg[CFG_USER], sourcecfg[CFG_PWD], args.max_lag,
+            args.workers_per_member)
+        srcdb = pool.db()
+    else:
+        srcmongo = MongoClient(sourcecfg[CFG_HOST], sourcecfg[CFG_PORT],
+                               slaveOk=True)
+        srcdb = srcmongo[sourcecfg[CFG_DB]]
+        if sourcecfg[CFG_USER]:
+            srcdb.authenticate(sourcecfg[CFG_USER], sourcecfg[CFG_PWD])
     print('Processing user names... ', end='')
+    instrument.set_state('phase', 'names')
     uuid2name, excludedUUIDs = processNames(srcdb, sourcecfg[CFG_EXCLUDE_USER])
     print('done.')
     if CFG_STAFF_FILE in sourcecfg:
       print('Processing staff file ',sourcecfg[CFG_STAFF_FILE])
       processStaff(sourcecfg[CFG_STAFF_FILE])
 
-    userdata = processNodes(srcdb, uuid2name, excludedUUIDs)
+    pacer = throttle.from_args(args, srcdb)
+    ckpt, resume = checkpoint.from_args(args, {
+        'granularity': args.granularity,
+        'since': args.since,
+        'until': args.until,
+        'exclude_user': sourcecfg[CFG_EXCLUDE_USER],
+        'staff_file': sourcecfg.get(CFG_STAFF_FILE),
+        'partitioned': pool is not None})
+    if args.sample:
+        instrument.set_state('phase', 'sample')
+        sample = sampling.StratifiedSample(args.sample, seed=args.seed)
+        units = drawSample(srcdb, sample, args.since, args.until)
+        print('Sampled {} of {} days'.format(len(units), sample.units()[0]))
+        instrument.set_state('phase', 'records')
+        sampleNodes(srcdb, sample, units, uuid2name, excludedUUIDs, pacer,
+                    args.granularity)
+        if outdir:
+            with instrument.timer('output'), \
+                    open(os.path.join(outdir, sampling.sample_file(USER_FILE)),
+                         'w') as f:
+                data = sampleUserData(sample, args.granularity, args.since,
+                                      args.until)
+                data['meta'].update(timeseries.meta(args))
+                f.write(json.dumps(data, indent=2, sort_keys=True))
+        print('\nElapsed time: ' + str(time.time() - starttime))
+        return
+
+    instrument.set_state('phase', 'records')
+    if pool:
+        userdata = processNodesPartitioned(pool, uuid2name, excludedUUIDs,
+                                           args, ckpt, resume)
+    else:
+        userdata = processNodes(srcdb, uuid2name, excludedUUIDs, pacer,
+                                args.granularity, args.since, args.until,
+                                ckpt, resume)
     userdata['meta']['comments']='This data comes from shock and filters out the workspace objects'
     userdata['meta']['author']='Gavin Price, Jared Bischof, Shane Canon'
-    userdata['meta']['description']='Summary of amount of data stored in shock both by user and by month'
+    userdata['meta']['description']='Summary of amount of data stored in shock both by user and by ' + args.granularity
+    userdata['meta'].update(timeseries.meta(args))
+    owners = userdata.pop(OWNERS, {})
+    hll.add_distinct(userdata['by_month'], owners, OWNERS, args.granularity,
+                     timeseries.labels(list(userdata['by_month']),
+                                       args.granularity, args.since,
+                                       args.until))
 
     if outdir:
-        with open(os.path.join(outdir, USER_FILE), 'w') as f:
+        with instrument.timer('output'), \
+                open(os.path.join(outdir, USER_FILE), 'w') as f:
             f.write(json.dumps(userdata,indent=2,sort_keys=True))
+        with open(os.path.join(outdir, OWNERS_FILE), 'w') as f:
+            hll.dump(owners, f)
+    if args.shard_dir:
+        instrument.set_state('phase', 'shards')
+        w = shards.ShardWriter(args.shard_dir, os.path.splitext(USER_FILE)[0])
+        w.add_all(lambda user, _: shards.user_shard(user, 'by_user'),
+                  userdata['by_user'].items())
+        w.add_all(lambda *_: 'by_month', userdata['by_month'].items())
+        w.close(userdata['meta'])
+    if args.publish:
+        instrument.set_state('phase', 'publish')
+        print('Publishing summaries')
+        publisher = publish.from_config(targetcfg, 'shock')
+        publisher.users(userdata['by_user'].items())
+        publisher.periods(userdata['by_month'].items(), args.granularity)
+        publisher.finish(userdata['meta'])
+    if ckpt:
+        ckpt.remove()
 
     print('\nElapsed time: ' + str(time.time() - starttime))
 
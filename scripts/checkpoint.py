@@ -0,0 +1,161 @@
+'''
+Checkpoints for resuming a long collector scan after a crash, and retries of
+reads that failed for a transient reason.
+
+A scan is a series of windows (a batch of workspace objects, a range of
+Shock node _ids). Each window is aggregated into state of its own and only
+merged into the totals once it has been read completely, so a window that
+fails part way through with a transient error (a lost connection, a replica
+set election, a cursor the server timed out) is simply read again, up to
+RETRIES times.
+
+Every interval seconds the collector saves its position and its totals so
+far. The checkpoint is a pickle of plain dicts and lists, written to a
+temporary file and renamed over the last one, so a crash while saving leaves
+the previous checkpoint intact. With --resume the collector loads the
+checkpoint, skips the windows it covers and carries on; the output is the
+same as that of an uninterrupted run over the same data. The checkpoint
+records the settings that shape the output (granularity, types, ...) and is
+refused if they differ. It is removed once the output has been written.
+'''
+
+from __future__ import print_function
+import os
+import pickle
+import sys
+import time
+
+from pymongo.errors import ConnectionFailure, OperationFailure
+
+import instrument
+
+INTERVAL_DEFAULT = 300
+RETRIES = 3
+RETRY_WAIT = 10.0
+CURSOR_NOT_FOUND = 43
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def is_transient(error):
+    """True for errors a read can be retried after: lost connections (which
+    include elections, as AutoReconnect) and timed out cursors."""
+    if isinstance(error, ConnectionFailure):
+        return True
+    if isinstance(error, OperationFailure):
+        # pymongo 2 reports a timed out cursor without an error code
+        return (getattr(error, 'code', None) == CURSOR_NOT_FOUND or
+                'cursor id' in str(error).lower())
+    return False
+
+
+def retry(read, what, retries=RETRIES, wait=RETRY_WAIT):
+    """Returns read(), calling it again after a transient error."""
+    attempt = 0
+    while True:
+        try:
+            return read()
+        except Exception as e:
+            if attempt >= retries or not is_transient(e):
+                raise
+            attempt += 1
+            print('{} failed: {}. Retry {} of {} in {} s'.format(
+                what, e, attempt, retries, wait * attempt))
+            sys.stdout.flush()
+            instrument.count('retries')
+            time.sleep(wait * attempt)
+
+
+def plain(value):
+    """Copies nested dicts (e.g. defaultdicts, which don't pickle) as plain
+    dicts, and tuples as lists."""
+    if isinstance(value, dict):
+        return dict((k, plain(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [plain(v) for v in value]
+    return value
+
+
+class Checkpoint(object):
+    """The checkpoint file at path, saved at most every interval seconds.
+    settings is anything picklable and comparable that must match between
+    the run that saved the checkpoint and the run resuming from it."""
+
+    def __init__(self, path, interval=INTERVAL_DEFAULT, settings=None):
+        self.path = path
+        self.interval = interval
+        self.settings = settings
+        self._saved = time.time()
+
+    def load(self):
+        """Returns the saved state, or None if there is no checkpoint."""
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            data = pickle.load(f)
+        if data['settings'] != self.settings:
+            raise CheckpointError(
+                'Checkpoint {} was saved with different settings: {}'.format(
+                    self.path, data['settings']))
+        print('Resuming from the checkpoint saved at {}'.format(
+            time.ctime(data['time'])))
+        return data['state']
+
+    def due(self):
+        return time.time() - self._saved >= self.interval
+
+    def save(self, state):
+        with instrument.timer('checkpoint'):
+            tmp = self.path + '.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump({'settings': self.settings, 'state': state,
+                             'time': time.time()}, f,
+                            pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self.path)
+        self._saved = time.time()
+        instrument.count('checkpoints')
+        print('Saved checkpoint ' + self.path)
+        sys.stdout.flush()
+
+    def remove(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+def add_arguments(parser):
+    parser.add_argument('--checkpoint', metavar='FILE',
+                        help='save the scan position and the totals so far ' +
+                        'to this file every --checkpoint-interval seconds.')
+    parser.add_argument('--checkpoint-interval', type=float,
+                        default=INTERVAL_DEFAULT,
+                        help='seconds between checkpoints. Default ' +
+                        '%(default)s.')
+    parser.add_argument('--resume', action='store_true',
+                        help='carry on from the --checkpoint file, if there ' +
+                        'is one.')
+
+
+def from_args(args, settings):
+    """Returns the Checkpoint and the state to resume from, or None for
+    either."""
+    if not args.checkpoint:
+        if args.resume:
+            print('--resume needs --checkpoint')
+            sys.exit(1)
+        return None, None
+    ckpt = Checkpoint(args.checkpoint, args.checkpoint_interval, settings)
+    resume = None
+    if args.resume:
+        try:
+            resume = ckpt.load()
+        except CheckpointError as e:
+            print(e)
+            sys.exit(1)
+        if resume is None:
+            print('No checkpoint at {}, starting from the beginning'.format(
+                args.checkpoint))
+    return ckpt, resume
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+
+'''
+A stand in for the parts of the Splunk REST API used by splunk_client.py:
+login, search job creation, job status and paged results. Results are served
+from local CSV files so exports can be exercised offline, e.g.
+
+    ./scripts/fake_splunk_server.py --port 8089 \\
+        users-by-day=/tmp/visit.csv methods-by-day=/tmp/methods.csv &
+    SPLUNKPW=secret ./scripts/splunk_client.py --url http://localhost:8089 \\
+        --poll 0.1 --page-size 100 users-by-day=visit.csv
+
+A job reports itself done after a configurable number of status polls.
+Every request is recorded, along with the highest number of result pages
+served at the same time, so paging and concurrency can be checked.
+'''
+
+from __future__ import print_function
+from argparse import ArgumentParser
+import csv
+import io
+import itertools
+import json
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:  # python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+from splunk_client import SEARCHES
+
+PASSWORD_DEFAULT = 'secret'
+SESSION_KEY = 'fakesessionkey'
+
+LOGIN = '<response><sessionKey>{}</sessionKey></response>'
+JOB = '<response><sid>{}</sid></response>'
+STATUS = ('<entry xmlns:s="http://dev.splunk.com/ns/rest"><content><s:dict>' +
+          '<s:key name="doneProgress">{progress}</s:key>' +
+          '<s:key name="isDone">{done}</s:key>' +
+          '<s:key name="isFailed">0</s:key>' +
+          '<s:key name="resultCount">{count}</s:key>' +
+          '</s:dict></content></entry>')
+
+
+class FakeSplunk(ThreadingMixIn, HTTPServer):
+    """Serves the rows of each CSV in results (search string -> path) as the
+    results of that search."""
+
+    daemon_threads = True
+
+    def __init__(self, address, results, password=PASSWORD_DEFAULT,
+                 polls_until_done=2, page_delay=0):
+        HTTPServer.__init__(self, address, _Handler)
+        self.password = password
+        self.polls_until_done = polls_until_done
+        self.page_delay = page_delay
+        self.results = {}
+        for search, path in results.items():
+            with open(path) as f:
+                rows = list(csv.reader(f))
+            self.results[search] = (rows[0], rows[1:]) if rows else ([], [])
+        self.jobs = {}
+        self.requests = []
+        self.logins = 0
+        self.active_pages = 0
+        self.max_active_pages = 0
+        self._ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def new_job(self, search):
+        with self.lock:
+            sid = 'fake.{}'.format(next(self._ids))
+            self.jobs[sid] = {'search': search, 'polls': 0}
+        return sid
+
+    def start(self):
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+        return t
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body, ctype='text/xml'):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _form(self):
+        n = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(n).decode('utf-8')
+        return dict((k, v[0]) for k, v in parse_qs(body).items())
+
+    def _authorized(self):
+        if self.headers.get('Authorization') != 'Splunk ' + SESSION_KEY:
+            self._send(401, '<response><messages><msg type="WARN">' +
+                       'call not properly authenticated</msg></messages>' +
+                       '</response>')
+            return False
+        return True
+
+    def _record(self):
+        with self.server.lock:
+            self.server.requests.append((self.command, self.path))
+
+    def do_POST(self):
+        self._record()
+        path = urlparse(self.path).path.rstrip('/')
+        form = self._form()
+        if path.endswith('/auth/login'):
+            if form.get('password') != self.server.password:
+                return self._send(401, '<response><messages><msg ' +
+                                  'type="WARN">Login failed</msg>' +
+                                  '</messages></response>')
+            with self.server.lock:
+                self.server.logins += 1
+            return self._send(200, LOGIN.format(SESSION_KEY))
+        if not self._authorized():
+            return
+        if path.endswith('/search/jobs'):
+            search = form.get('search', '')
+            if search.strip() not in self.server.results:
+                return self._send(400, '<response><messages><msg ' +
+                                  'type="FATAL">Unknown search</msg>' +
+                                  '</messages></response>')
+            return self._send(201, JOB.format(
+                self.server.new_job(search.strip())))
+        self._send(404, '<response/>')
+
+    def do_GET(self):
+        self._record()
+        url = urlparse(self.path)
+        parts = url.path.rstrip('/').split('/')
+        if not self._authorized():
+            return
+        if 'jobs' not in parts:
+            return self._send(404, '<response/>')
+        i = parts.index('jobs')
+        job = self.server.jobs.get(parts[i + 1] if len(parts) > i + 1
+                                   else None)
+        if job is None:
+            return self._send(404, '<response/>')
+        header, rows = self.server.results[job['search']]
+        if len(parts) == i + 2:
+            with self.server.lock:
+                job['polls'] += 1
+                done = job['polls'] >= self.server.polls_until_done
+            return self._send(200, STATUS.format(
+                progress=1.0 if done else 0.5, done=1 if done else 0,
+                count=len(rows) if done else 0))
+        if parts[i + 2] == 'results':
+            return self._results(parse_qs(url.query), header, rows)
+        self._send(404, '<response/>')
+
+    def _results(self, query, header, rows):
+        offset = int(query.get('offset', ['0'])[0])
+        count = int(query.get('count', ['100'])[0])
+        mode = query.get('output_mode', ['xml'])[0]
+        with self.server.lock:
+            self.server.active_pages += 1
+            self.server.max_active_pages = max(self.server.max_active_pages,
+                                               self.server.active_pages)
+        try:
+            if self.server.page_delay:
+                time.sleep(self.server.page_delay)
+            page = rows[offset:offset + count] if count else rows[offset:]
+            if mode == 'json':
+                body = json.dumps({'init_offset': offset, 'results': [
+                    dict(zip(header, r)) for r in page]})
+                return self._send(200, body, 'application/json')
+            out = io.BytesIO() if sys.version_info[0] < 3 else io.StringIO()
+            w = csv.writer(out, lineterminator='\n')
+            w.writerow(header)
+            w.writerows(page)
+            self._send(200, out.getvalue(), 'text/csv')
+        finally:
+            with self.server.lock:
+                self.server.active_pages -= 1
+
+
+def _parseArgs():
+    parser = ArgumentParser(description='Serve CSV files through a fake ' +
+                            'Splunk REST API')
+    parser.add_argument('results', nargs='+', metavar='NAME=FILE',
+                        help='serve the rows of FILE as the results of the ' +
+                        'search NAME, one of ' + ', '.join(sorted(SEARCHES)) +
+                        ', or of any other search string.')
+    parser.add_argument('-p', '--port', type=int, default=8089)
+    parser.add_argument('--password', default=PASSWORD_DEFAULT)
+    parser.add_argument('--polls', type=int, default=2,
+                        help='status polls before a job is done.')
+    parser.add_argument('--page-delay', type=float, default=0,
+                        help='seconds to wait before serving a page.')
+    return parser.parse_args()
+
+
+def main():
+    args = _parseArgs()
+    results = {}
+    for r in args.results:
+        name, _, path = r.partition('=')
+        results[SEARCHES.get(name, name).strip()] = path
+    server = FakeSplunk(('localhost', args.port), results, args.password,
+                        args.polls, args.page_delay)
+    print('Fake Splunk listening on ' + server.url)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+'''
+HyperLogLog sketches for counting distinct users per time bucket in bounded
+memory.
+
+A sketch of 2 ** precision one byte registers estimates the number of
+distinct values added to it with a standard error of about
+1.04 / sqrt(2 ** precision), 1.6% at the default precision of 12, however
+many values that is. Two sketches of the same precision are merged by taking
+the larger of each pair of registers, and the result is the sketch of the
+union, so the collectors keep one sketch per day, merge the sketches of
+parallel workers, and union the days into weeks or months (or any other
+range of days) afterwards without scanning the records again.
+
+Sketch files are JSON:
+
+    {"precision": 12, "sketches": {"20150301": "<sketch>", ...}}
+
+where each sketch is its registers, compressed with zlib and base64 encoded,
+so days with few users take a few dozen bytes. This script unions sketch
+files, e.g. from several runs or collectors, and prints the distinct counts
+per bucket:
+
+    hll.py --granularity week ws_savers_sketches.json
+'''
+
+from __future__ import print_function
+from argparse import ArgumentParser
+from collections import defaultdict
+import base64
+import datetime
+import hashlib
+import json
+import math
+import struct
+import zlib
+
+import timeseries
+
+PRECISION_DEFAULT = 12
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+CACHE_SIZE = 100000
+
+# value -> (register, rank), as the same few thousand user names are added
+# millions of times
+_slots = {}
+
+
+def _slot(value, precision):
+    key = (value, precision)
+    slot = _slots.get(key)
+    if slot is None:
+        if not isinstance(value, bytes):
+            value = u'{}'.format(value).encode('utf-8')
+        h = struct.unpack('>Q', hashlib.sha1(value).digest()[:8])[0]
+        bits = 64 - precision
+        rest = h & ((1 << bits) - 1)
+        slot = (h >> bits, bits - rest.bit_length() + 1)
+        if len(_slots) >= CACHE_SIZE:
+            _slots.clear()
+        _slots[key] = slot
+    return slot
+
+
+class HyperLogLog(object):
+    """A sketch of the distinct values added to it."""
+
+    def __init__(self, precision=PRECISION_DEFAULT, registers=None):
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError('Precision must be from {} to {}: {}'.format(
+                MIN_PRECISION, MAX_PRECISION, precision))
+        self.precision = precision
+        m = 1 << precision
+        if registers is None:
+            registers = bytearray(m)
+        elif len(registers) != m:
+            raise ValueError('Expected {} registers, got {}'.format(
+                m, len(registers)))
+        self.registers = bytearray(registers)
+
+    def add(self, value):
+        register, rank = _slot(value, self.precision)
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def merge(self, other):
+        """Adds the values of sketch other to this one. Returns self."""
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge sketches of precision {} and {}'
+                             .format(self.precision, other.precision))
+        self.registers = bytearray(max(a, b) for a, b in
+                                   zip(self.registers, other.registers))
+        return self
+
+    def copy(self):
+        return HyperLogLog(self.precision, self.registers)
+
+    def count(self):
+        """The estimated number of distinct values added."""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        if m == 16:
+            alpha = 0.673
+        elif m == 32:
+            alpha = 0.697
+        elif m == 64:
+            alpha = 0.709
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(b'\0')
+        # small cardinalities: linear counting of the empty registers. The
+        # 64 bit hash makes the large range correction unnecessary.
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+    def to_string(self):
+        return base64.b64encode(zlib.compress(bytes(self.registers))).decode(
+            'ascii')
+
+    @classmethod
+    def from_string(cls, text, precision=PRECISION_DEFAULT):
+        return cls(precision, zlib.decompress(base64.b64decode(text)))
+
+
+def merge_all(into, sketches):
+    """Merges the label -> sketch dict sketches into into."""
+    for label, sketch in sketches.items():
+        if label in into:
+            into[label].merge(sketch)
+        else:
+            into[label] = sketch.copy()
+
+
+def union_by(sketches, granularity):
+    """Unions day label -> sketch into bucket label -> sketch."""
+    buckets = {}
+    for day, sketch in sketches.items():
+        d = datetime.datetime.strptime(day, '%Y%m%d').date()
+        merge_all(buckets, {timeseries.label(d, granularity): sketch})
+    return buckets
+
+
+def add_distinct(series, sketches, key, granularity, lbls):
+    """Sets key in each bucket of series (label -> key -> figures) to the
+    number of distinct values in the day sketches of the bucket, and
+    cumulative_<key> to the number in all the buckets in lbls up to it."""
+    buckets = union_by(sketches, granularity)
+    running = None
+    for lbl in lbls:
+        sketch = buckets.get(lbl)
+        if sketch is not None:
+            running = sketch.copy() if running is None else running.merge(
+                sketch)
+        series[lbl][key] = sketch.count() if sketch else 0
+        series[lbl][timeseries.CUMULATIVE + key] = (running.count()
+                                                    if running else 0)
+
+
+def dump(sketches, f):
+    """Writes day label -> sketch to the open file f."""
+    precision = set(s.precision for s in sketches.values())
+    f.write(json.dumps({'precision': precision.pop() if precision else
+                        PRECISION_DEFAULT,
+                        'sketches': dict((label, s.to_string()) for
+                                         label, s in sketches.items())},
+                       sort_keys=True))
+
+
+def load(f):
+    """Reads the day label -> sketch dict written by dump()."""
+    data = json.load(f)
+    return dict((label, HyperLogLog.from_string(text, data['precision']))
+                for label, text in data['sketches'].items())
+
+
+def _parseArgs():
+    parser = ArgumentParser(description='Union distinct user sketch files ' +
+                            'and print the distinct counts per bucket')
+    parser.add_argument('files', nargs='+', help='sketch files.')
+    parser.add_argument('-g', '--granularity',
+                        choices=timeseries.GRANULARITIES,
+                        default=timeseries.GRANULARITY_DEFAULT,
+                        help='bucket size. Default %(default)s.')
+    return parser.parse_args()
+
+
+def main():
+    args = _parseArgs()
+    sketches = {}
+    for path in args.files:
+        with open(path) as f:
+            merge_all(sketches, load(f))
+    series = defaultdict(dict)
+    add_distinct(series, sketches, 'distinct', args.granularity,
+                 sorted(union_by(sketches, args.granularity)))
+    print(json.dumps(series, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
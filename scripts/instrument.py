@@ -0,0 +1,235 @@
+'''
+Timers, counters and a state snapshot for the collectors, written out as
+JSON and Prometheus text files.
+
+The collectors report into the module level registry:
+
+    instrument.count('versions')
+    for v in instrument.timed_iter(cursor, 'query_wait'):
+        ...
+    with instrument.timer('aggregation', excluding='query_wait'):
+        ...
+    instrument.set_state('workspace', ws)
+
+and call instrument.start(prefix, interval) to have <prefix>.json and
+<prefix>.prom rewritten every interval seconds, on SIGUSR1 and at exit.
+
+Time blocked in a cursor's next() is network wait plus the driver decoding
+the BSON batch it just received; the driver decodes whole batches as they
+arrive, so the two can't be told apart from here and are both counted as
+query wait.
+'''
+
+from __future__ import print_function
+from collections import defaultdict
+from contextlib import contextmanager
+import atexit
+import json
+import os
+import re
+import signal
+import socket
+import threading
+import time
+
+METRICS_INTERVAL_DEFAULT = 60
+
+
+class Registry(object):
+
+    def __init__(self, collector=None):
+        self.collector = collector
+        self.started = time.time()
+        self.counters = defaultdict(int)
+        # name -> [calls, total seconds, max seconds]
+        self.timers = defaultdict(lambda: [0, 0.0, 0.0])
+        self.state = {}
+        self._lock = threading.RLock()
+        # reentrant, as the SIGUSR1 write can interrupt the main thread
+        # while it holds the lock
+        self._update_lock = threading.RLock()
+        self._local = threading.local()
+        self._prefix = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def count(self, name, n=1):
+        with self._update_lock:
+            self.counters[name] += n
+
+    def add_time(self, name, seconds):
+        with self._update_lock:
+            t = self.timers[name]
+            t[0] += 1
+            t[1] += seconds
+            if seconds > t[2]:
+                t[2] = seconds
+        mine = self._thread_seconds()
+        mine[name] = mine.get(name, 0.0) + seconds
+
+    def _thread_seconds(self):
+        try:
+            return self._local.seconds
+        except AttributeError:
+            self._local.seconds = {}
+            return self._local.seconds
+
+    def seconds(self, name):
+        """Total time recorded under timer name by the calling thread."""
+        return self._thread_seconds().get(name, 0.0)
+
+    @contextmanager
+    def timer(self, name, excluding=None):
+        """Times the block. Time recorded under the excluding timer, or
+        timers if a tuple of names, while the block runs is not counted."""
+        if isinstance(excluding, str):
+            excluding = (excluding,)
+        excluding = excluding or ()
+        start = time.time()
+        excluded = sum(self.seconds(e) for e in excluding)
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            elapsed -= sum(self.seconds(e) for e in excluding) - excluded
+            self.add_time(name, elapsed)
+
+    def timed_iter(self, iterable, name):
+        """Iterates, recording the time spent waiting for each item."""
+        it = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add_time(name, time.time() - start)
+                return
+            self.add_time(name, time.time() - start)
+            yield item
+
+    def set_state(self, key, value):
+        with self._update_lock:
+            self.state[key] = value
+
+    def snapshot(self):
+        now = time.time()
+        with self._update_lock:
+            counters = dict(self.counters)
+            timers = dict((k, {'calls': v[0], 'seconds': v[1],
+                               'max_seconds': v[2]})
+                          for k, v in self.timers.items())
+            state = dict(self.state)
+        return {'collector': self.collector,
+                'host': socket.gethostname(),
+                'pid': os.getpid(),
+                'started': self.started,
+                'updated': now,
+                'elapsed': now - self.started,
+                'counters': counters,
+                'timers': timers,
+                'state': state}
+
+    def prometheus(self, snap=None):
+        snap = snap or self.snapshot()
+        label = 'collector="{}"'.format(snap['collector'])
+        lines = ['# TYPE collector_elapsed_seconds gauge',
+                 'collector_elapsed_seconds{{{}}} {}'.format(
+                     label, snap['elapsed'])]
+        for name in sorted(snap['counters']):
+            metric = 'collector_{}_total'.format(_metric_name(name))
+            lines.append('# TYPE {} counter'.format(metric))
+            lines.append('{}{{{}}} {}'.format(
+                metric, label, snap['counters'][name]))
+        for field, kind in (('seconds', 'counter'), ('calls', 'counter'),
+                            ('max_seconds', 'gauge')):
+            metric = 'collector_stage_{}{}'.format(
+                field, '_total' if kind == 'counter' else '')
+            lines.append('# TYPE {} {}'.format(metric, kind))
+            for name in sorted(snap['timers']):
+                lines.append('{}{{{},stage="{}"}} {}'.format(
+                    metric, label, name, snap['timers'][name][field]))
+        lines.append('# TYPE collector_state gauge')
+        for key in sorted(snap['state']):
+            v = snap['state'][key]
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                lines.append('collector_state{{{},key="{}"}} {}'.format(
+                    label, key, v))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, prefix=None):
+        prefix = prefix or self._prefix
+        if not prefix:
+            return
+        with self._lock:
+            snap = self.snapshot()
+            _write_atomic(prefix + '.json',
+                          json.dumps(snap, indent=2, sort_keys=True,
+                                     default=str))
+            _write_atomic(prefix + '.prom', self.prometheus(snap))
+
+    def start(self, prefix, interval=METRICS_INTERVAL_DEFAULT):
+        """Writes the metrics files every interval seconds, when the process
+        gets SIGUSR1 and at exit."""
+        self._prefix = prefix
+        if interval and interval > 0:
+            def run():
+                while not self._stop.wait(interval):
+                    self.write()
+            self._thread = threading.Thread(target=run)
+            self._thread.daemon = True
+            self._thread.start()
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.write())
+        atexit.register(self.stop)
+        self.write()
+
+    def stop(self):
+        self._stop.set()
+        self.write()
+
+
+def _metric_name(name):
+    return re.sub('[^a-zA-Z0-9_]', '_', name)
+
+
+def _write_atomic(path, text):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.rename(tmp, path)
+
+
+_registry = Registry()
+
+
+def registry():
+    return _registry
+
+
+def init(collector):
+    _registry.collector = collector
+
+
+def add_arguments(parser):
+    parser.add_argument('--metrics',
+                        help='write run metrics to <METRICS>.json and ' +
+                        '<METRICS>.prom, periodically and at the end of ' +
+                        'the run. Send SIGUSR1 for an immediate update.')
+    parser.add_argument('--metrics-interval', type=float,
+                        default=METRICS_INTERVAL_DEFAULT,
+                        help='seconds between metrics updates. ' +
+                        'Default %(default)s')
+
+
+def start_from_args(args):
+    if args.metrics:
+        _registry.start(args.metrics, args.metrics_interval)
+
+
+count = _registry.count
+add_time = _registry.add_time
+seconds = _registry.seconds
+timer = _registry.timer
+timed_iter = _registry.timed_iter
+set_state = _registry.set_state
+write = _registry.write
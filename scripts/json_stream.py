@@ -0,0 +1,191 @@
+'''
+Incremental reading and writing of large JSON objects.
+
+Most of the metrics outputs are one big JSON object keyed by user, workspace
+object or month. These helpers walk the members of such an object one at a
+time, so a consumer never has to hold the decoded document in memory, and
+write an object back out member by member.
+'''
+
+from __future__ import print_function
+import io
+import json
+
+READ_SIZE = 1 << 16
+WHITESPACE = ' \t\n\r'
+
+
+def open_json(path, mode='r'):
+    return io.open(path, mode, encoding='utf-8')
+
+
+def dumps(value, **kwargs):
+    """json.dumps, but always returns text so it can be written to files
+    from open_json under python 2 as well."""
+    s = json.dumps(value, **kwargs)
+    if isinstance(s, bytes):
+        s = s.decode('utf-8')
+    return s
+
+
+class _Reader(object):
+
+    def __init__(self, f):
+        self._f = f
+        self._buf = u''
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self, size=READ_SIZE):
+        if self._eof:
+            return False
+        chunk = self._f.read(size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while (self._pos < len(self._buf) and
+                   self._buf[self._pos] in WHITESPACE):
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        c = self.peek()
+        if c != char:
+            raise ValueError('Expected {} but found {!r}'.format(
+                char, c or 'end of file'))
+        self._pos += 1
+
+    def _grow(self):
+        # at least double what is buffered, so a value that needs many
+        # reads is decoded O(log n) times rather than once per READ_SIZE
+        return self._fill(max(READ_SIZE, len(self._buf) - self._pos))
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                v, end = self._decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if not self._grow():
+                    raise
+                continue
+            # a number at the very end of the buffer may be cut short
+            if end == len(self._buf) and self._grow():
+                continue
+            self._pos = end
+            return v
+
+    def key(self):
+        """Returns the next member key of the current object, or None if the
+        object is closed."""
+        c = self.peek()
+        if c == ',':
+            self._pos += 1
+            c = self.peek()
+        if c == '}':
+            self._pos += 1
+            return None
+        k = self.value()
+        self.expect(':')
+        return k
+
+
+def iter_object_items(f, path=()):
+    """Iterates over the (key, value) pairs of the JSON object in file f.
+
+    If path is given, the object found by following those keys from the top
+    level object is iterated instead, e.g. path=('by_workspace',). Members
+    passed over on the way are decoded and discarded. Nothing is yielded if
+    the path does not exist.
+    """
+    r = _Reader(f)
+    r.expect('{')
+    for target in path:
+        while True:
+            k = r.key()
+            if k is None:
+                return
+            if k == target:
+                break
+            r.value()
+        if r.peek() != '{':
+            return
+        r.expect('{')
+    while True:
+        k = r.key()
+        if k is None:
+            return
+        yield k, r.value()
+
+
+def load_object(path, keypath=()):
+    """Decodes only the object at keypath in the JSON file at path."""
+    with open_json(path) as f:
+        return dict(iter_object_items(f, keypath))
+
+
+class ObjectWriter(object):
+    """Writes a JSON object to file f one member at a time.
+
+    Written in sorted key order, the output is laid out like
+    json.dumps(obj, indent=indent, sort_keys=True). level is the nesting depth
+    of the object when it is itself a member of an enclosing object.
+    """
+
+    def __init__(self, f, indent=None, level=0):
+        self._f = f
+        self._indent = indent
+        self._level = level
+        self._count = 0
+        if indent is None:
+            self._seps = (u', ', u': ')
+        else:
+            self._seps = (u',', u': ')
+        self._f.write(u'{')
+
+    def _newline(self, level):
+        if self._indent is None:
+            return u''
+        return u'\n' + u' ' * (self._indent * level)
+
+    def _key(self, key):
+        if self._count:
+            self._f.write(self._seps[0])
+        self._f.write(self._newline(self._level + 1))
+        self._f.write(dumps(key) + self._seps[1])
+        self._count += 1
+
+    def write(self, key, value):
+        self._key(key)
+        text = dumps(value, indent=self._indent, sort_keys=True,
+                     separators=self._seps)
+        if self._indent is not None:
+            text = text.replace(u'\n', self._newline(self._level + 1))
+        self._f.write(text)
+
+    def write_raw(self, key, text):
+        """Writes a member whose value is already encoded as JSON text."""
+        self._key(key)
+        self._f.write(text)
+
+    def object(self, key):
+        """Starts an object valued member; returns the writer for it, which
+        must be closed before anything else is written to this writer."""
+        self._key(key)
+        return ObjectWriter(self._f, self._indent, self._level + 1)
+
+    def close(self):
+        if self._count:
+            self._f.write(self._newline(self._level))
+        self._f.write(u'}')
+        return self._count
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+'''
+Merges the narrative access summary (from narrative_access.pl) with the list
+of narrative objects (ws_object_list.json from workspace_statistics.py) and
+writes narratives2.json with per-month counts of new narratives.
+
+Replaces merge_narrative.pl, which downloaded both files over HTTP and decoded
+them whole. Here both are read from local disk and walked member by member.
+The smaller of the two is indexed by workspace object key (e.g. ws.2177.obj.9)
+and the larger one is streamed past the index.
+'''
+
+from __future__ import print_function
+from argparse import ArgumentParser
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+from json_stream import iter_object_items, load_object, open_json
+from json_stream import ObjectWriter
+
+STAFF_FILE_DEFAULT = 'kbase-staff.lst'
+ACCESS_FILE = 'narrative_access.json'
+OBJECT_FILE = 'ws_object_list.json'
+MERGED_FILE = 'narratives2.json'
+
+# access summary fields
+BY_WORKSPACE = 'by_workspace'
+BY_MONTH = 'by_month'
+BY_DATE = 'by_date'
+ACCESS_COUNT = 'access_count'
+BY_IP = 'by_ip'
+FIRST_ACCESS = 'first_access'
+
+# object list fields
+NAME = 'name'
+DELETED = 'del'
+SAVED_BY = 'savedby'
+SAVE_DATE = 'savedate'
+
+NEW = 'new_narrative'
+CUMULATIVE = 'cumulative_narrative'
+STAFF = ':staff'
+USER = ':user'
+
+AUTOSAVE_NAME = re.compile('^auto[0-9]+')
+
+
+def _parseArgs():
+    parser = ArgumentParser(description='Merge narrative access logs with ' +
+                            'the workspace narrative object list')
+    parser.add_argument('output',
+                        help='directory holding ' + OBJECT_FILE + ' where ' +
+                        MERGED_FILE + ' is written.')
+    parser.add_argument('-a', '--access',
+                        help='path to the narrative access summary. A copy ' +
+                        'is placed in the output directory as ' + ACCESS_FILE +
+                        '. Defaults to that copy.')
+    parser.add_argument('-w', '--objects',
+                        help='path to the workspace object list. Defaults ' +
+                        'to ' + OBJECT_FILE + ' in the output directory.')
+    parser.add_argument('-s', '--staff', default=STAFF_FILE_DEFAULT,
+                        help='path to the KBase staff list.')
+    return parser.parse_args()
+
+
+def load_staff(path):
+    with open(path) as f:
+        return set(line.rstrip('\n') for line in f)
+
+
+def save_day(obj):
+    return obj[SAVE_DATE].split('T')[0]
+
+
+def add_access(obj, access):
+    obj[ACCESS_COUNT] = access.get(ACCESS_COUNT)
+    obj[BY_IP] = access.get(BY_IP)
+    obj[FIRST_ACCESS] = access.get(FIRST_ACCESS)
+    # Some narratives may have been created on narrative-dev
+    if obj[FIRST_ACCESS] is None or obj[FIRST_ACCESS] > save_day(obj):
+        obj[FIRST_ACCESS] = save_day(obj)
+
+
+def keep_narrative(obj):
+    """Sets access defaults and filters out nameless, deleted and autosave
+    narratives."""
+    if obj.get(ACCESS_COUNT) is None:
+        obj[ACCESS_COUNT] = 0
+        obj[FIRST_ACCESS] = save_day(obj)
+    if obj.get(NAME) is None:
+        return False
+    if obj.get(DELETED):
+        return False
+    return not AUTOSAVE_NAME.match(obj[NAME])
+
+
+def joined_narratives(access_path, objects_path):
+    """Generates (key, object) pairs of the object list with the access data
+    for each object added, in object list order."""
+    def access_items():
+        with open_json(access_path) as f:
+            for item in iter_object_items(f, (BY_WORKSPACE,)):
+                yield item
+
+    def object_items():
+        with open_json(objects_path) as f:
+            for item in iter_object_items(f):
+                yield item
+
+    if os.path.getsize(objects_path) < os.path.getsize(access_path):
+        objects = dict(object_items())
+        for key, access in access_items():
+            if key in objects:
+                add_access(objects[key], access)
+        for key in sorted(objects):
+            yield key, objects[key]
+    else:
+        index = dict(access_items())
+        for key, obj in object_items():
+            if key in index:
+                add_access(obj, index[key])
+            yield key, obj
+
+
+def write_by_workspace(f, narratives, staff):
+    """Writes the kept narratives to f as the by_workspace member of the
+    output and returns the new narrative counts by month."""
+    by_month = {}
+    w = ObjectWriter(f, indent=2, level=1)
+    for key, obj in narratives:
+        if not keep_narrative(obj):
+            continue
+        w.write(key, obj)
+        counts = by_month.setdefault(obj[FIRST_ACCESS][0:7], {})
+        s = STAFF if obj.get(SAVED_BY) in staff else USER
+        for k in (NEW, NEW + s):
+            counts[k] = counts.get(k, 0) + 1
+    w.close()
+    return by_month
+
+
+def add_cumulative(by_month, access_by_month):
+    cum = dict((t, 0) for t in ('', STAFF, USER))
+    for month in sorted(by_month):
+        by_month[month][ACCESS_COUNT] = access_by_month.get(
+            month, {}).get(ACCESS_COUNT)
+        for t in cum:
+            cum[t] += by_month[month].get(NEW + t, 0)
+            by_month[month][CUMULATIVE + t] = cum[t]
+
+
+def merge(outdir, access_path, objects_path, staff):
+    outfile = os.path.join(outdir, MERGED_FILE)
+    with tempfile.NamedTemporaryFile(dir=outdir, delete=False) as tmp:
+        tmpname = tmp.name
+    try:
+        with open_json(tmpname, 'w') as tmp:
+            by_month = write_by_workspace(
+                tmp, joined_narratives(access_path, objects_path), staff)
+        add_cumulative(by_month, load_object(access_path, (BY_MONTH,)))
+
+        with open_json(outfile + '.tmp', 'w') as f:
+            out = ObjectWriter(f, indent=2)
+            by_date = out.object(BY_DATE)
+            with open_json(access_path) as af:
+                for date, counts in iter_object_items(af, (BY_DATE,)):
+                    by_date.write(date, counts)
+            by_date.close()
+            out.write(BY_MONTH, by_month)
+            out.write_raw(BY_WORKSPACE, u'')
+            with open_json(tmpname) as tmp:
+                shutil.copyfileobj(tmp, f)
+            out.write('meta', {
+                'author': 'Shane Canon',
+                'comments': 'This merges the narrative access logs from ' +
+                            'nginx with a dump of the narrative objects in ' +
+                            'the workspace.\n',
+                'dataset': 'nginx access logs and workspace objects',
+                'generated': time.strftime('%Y-%m-%d', time.gmtime())})
+            out.close()
+        os.rename(outfile + '.tmp', outfile)
+    finally:
+        os.remove(tmpname)
+        if os.path.exists(outfile + '.tmp'):
+            os.remove(outfile + '.tmp')
+
+
+def main():
+    args = _parseArgs()
+    outdir = args.output
+    objects_path = args.objects or os.path.join(outdir, OBJECT_FILE)
+    access_copy = os.path.join(outdir, ACCESS_FILE)
+    access_path = args.access or access_copy
+    for path in (access_path, objects_path):
+        if not os.access(path, os.R_OK):
+            print('Cannot read file ' + path)
+            sys.exit(1)
+    starttime = time.time()
+    if os.path.abspath(access_path) != os.path.abspath(access_copy):
+        # Write out the access data unaltered
+        shutil.copyfile(access_path, access_copy)
+    merge(outdir, access_copy, objects_path, load_staff(args.staff))
+    print('Elapsed time: ' + str(time.time() - starttime))
+
+
+if __name__ == '__main__':
+    main()
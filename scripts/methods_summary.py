@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+'''
+Summarizes the Splunk methods by day CSV (the methods-by-day export of
+splunk_client.py) into methods.json: per method totals, accesses by month,
+the most called methods and a moving average of the calls per day. Replaces
+methods_summary.pl.
+
+The moving average is over --window calendar days, with days missing from
+the CSV counted as days without calls. moving_average is its value on the
+last day, and moving_average_by_month its value on the last day of each
+month.
+
+The CSV has a column per method (up to 2000) and a row per day, and it is
+exported in full every night. The parsed day x method counts are kept in a
+binary cache; a run only parses the rows from the last cached day on and
+appends them, then summarizes the whole array.
+'''
+
+from __future__ import print_function
+from argparse import ArgumentParser
+import csv
+import datetime
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+# bogus splunk columns
+SKIP_COLUMNS = set(['-', '-:-', 'NULL'])
+SPAN_COLUMN = '_span'
+
+TOP_N = 21
+WINDOW_DEFAULT = 30
+
+
+def _parseArgs():
+    parser = ArgumentParser(description='Summarize method calls by day from ' +
+                            'the Splunk methods CSV')
+    parser.add_argument('methods',
+                        help='path to the methods CSV. Use - for stdin.')
+    parser.add_argument('-o', '--output',
+                        help='write json output to this file rather than ' +
+                        'stdout.')
+    parser.add_argument('-c', '--cache',
+                        help='path to the cache of previously parsed days. ' +
+                        'Created if it does not exist.')
+    parser.add_argument('-w', '--window', type=int, default=WINDOW_DEFAULT,
+                        help='calendar days in the moving average. ' +
+                        'Default %(default)s.')
+    args = parser.parse_args()
+    if args.window < 1:
+        print('--window must be at least 1 day')
+        sys.exit(1)
+    return args
+
+
+class MethodCounts(object):
+    """Method calls by day.
+
+    days - YYYY-MM-DD of each row, ascending
+    methods - method name of each column
+    counts - days x methods float array of calls
+    """
+
+    def __init__(self, days=(), methods=(), counts=None):
+        self.days = list(days)
+        self.methods = list(methods)
+        if counts is None:
+            counts = np.zeros((len(self.days), len(self.methods)))
+        self.counts = counts
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            return cls([str(d) for d in z['days']],
+                       [str(m) for m in z['methods']], z['counts'])
+
+    def save(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, days=np.array(self.days, dtype=str),
+                     methods=np.array(self.methods, dtype=str),
+                     counts=self.counts)
+        os.rename(tmp, path)
+
+    def update(self, f):
+        """Parses the rows of the CSV in f for days on or after the last day
+        already held and replaces the held rows for those days. Returns the
+        number of rows parsed."""
+        since = self.days[-1] if self.days else ''
+        reader = csv.reader(f)
+        header = [m.strip() for m in next(reader)[1:]]
+        n = len(header)
+        days = []
+        rows = []
+        for row in reader:
+            if not row:
+                continue
+            day = row[0].strip().split('T')[0]
+            if day < since:
+                continue
+            vals = [v or '0' for v in row[1:n + 1]]
+            vals.extend(['0'] * (n - len(vals)))
+            days.append(day)
+            rows.append(np.array(vals, dtype=float))
+        if not rows:
+            return 0
+
+        col = dict((m, i) for i, m in enumerate(self.methods))
+        for m in header:
+            if m not in col:
+                col[m] = len(self.methods)
+                self.methods.append(m)
+        keep = len(self.days) - sum(1 for d in self.days if d >= days[0])
+        counts = np.zeros((keep + len(rows), len(self.methods)))
+        counts[:keep, :self.counts.shape[1]] = self.counts[:keep]
+        counts[keep:, [col[m] for m in header]] = np.vstack(rows)
+        self.days = self.days[:keep] + days
+        self.counts = counts
+        return len(rows)
+
+
+def _ordinal(day):
+    return datetime.datetime.strptime(day, '%Y-%m-%d').toordinal()
+
+
+def moving_average(days, counts, window):
+    """Returns the months and the mean calls per day over the window days up
+    to the last day of each month, a months x methods array, for the
+    days x methods counts. Days missing from days count as no calls, and
+    the first window - 1 days average over the days so far."""
+    ords = np.array([_ordinal(d) for d in days])
+    ords -= ords[0]
+    ndays = ords[-1] + 1
+    # running totals over every calendar day, with a leading row of zeros
+    totals = np.zeros((ndays + 1, counts.shape[1]))
+    np.add.at(totals, ords + 1, counts)
+    np.cumsum(totals, axis=0, out=totals)
+    first = datetime.date.fromordinal(_ordinal(days[0]))
+    month = np.array([(first + datetime.timedelta(int(i))).strftime('%Y-%m')
+                      for i in range(ndays)])
+    ends = np.r_[np.nonzero(month[1:] != month[:-1])[0], ndays - 1]
+    starts = np.maximum(ends + 1 - window, 0)
+    average = ((totals[ends + 1] - totals[starts]) /
+               (ends + 1 - starts)[:, None])
+    return month[ends], average
+
+
+def summarize(mc, window):
+    keep = np.array([i for i, m in enumerate(mc.methods)
+                     if m not in SKIP_COLUMNS and SPAN_COLUMN not in m],
+                    dtype=int)
+    methods = [mc.methods[i] for i in keep]
+    counts = mc.counts[:, keep]
+    totals = counts.sum(axis=0)
+    by_method = dict((m, {}) for m in methods)
+    if len(mc.days):
+        row_month = np.array([d[0:7] for d in mc.days])
+        starts = np.r_[0, np.nonzero(row_month[1:] != row_month[:-1])[0] + 1]
+        monthly = np.add.reduceat(counts, starts, axis=0)
+        months = row_month[starts]
+        avg_months, average = moving_average(mc.days, counts, window)
+        for j in np.nonzero(totals)[0]:
+            nz = np.nonzero(monthly[:, j])[0]
+            anz = np.nonzero(average[:, j])[0]
+            by_method[methods[j]] = {
+                'total_count': int(totals[j]),
+                'accesses_by_month': dict((str(months[i]),
+                                           int(monthly[i, j])) for i in nz),
+                'moving_average': float(average[-1, j]),
+                'moving_average_by_month': dict(
+                    (str(avg_months[i]), float(average[i, j]))
+                    for i in anz)}
+    order = sorted(range(len(methods)), key=lambda j: (-totals[j], methods[j]))
+    top = [methods[j] for j in order[:TOP_N]]
+    top.extend([None] * (TOP_N - len(top)))
+    return {'by_method': by_method,
+            'top_list': top,
+            'meta': {'comments': 'Generated from a Splunk query and ' +
+                     'summarized by methods_summary',
+                     'author': 'Shane Canon',
+                     'generated': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                                time.gmtime()),
+                     'dataset': 'splunk-methods-by-day',
+                     'description': ('Number of methods access by date ' +
+                     'summarized over each month including grand totals. ' +
+                     'moving_average is the mean calls per day over the ' +
+                     '{} days up to the last day, and ' +
+                     'moving_average_by_month over the {} days up to the ' +
+                     'end of each month.').format(window, window)}}
+
+
+def main():
+    args = _parseArgs()
+    starttime = time.time()
+    mc = MethodCounts()
+    if args.cache and os.path.isfile(args.cache):
+        mc = MethodCounts.load(args.cache)
+    if args.methods == '-':
+        parsed = mc.update(sys.stdin)
+    else:
+        with open(args.methods) as f:
+            parsed = mc.update(f)
+    print('Parsed {} new rows, {} days x {} methods in {} s'.format(
+        parsed, len(mc.days), len(mc.methods), time.time() - starttime),
+        file=sys.stderr)
+    if args.cache:
+        mc.save(args.cache)
+    text = json.dumps(summarize(mc, args.window), indent=4, sort_keys=True,
+                      separators=(',', ': '))
+    if args.output:
+        with open(args.output + '.tmp', 'w') as f:
+            f.write(text)
+        os.rename(args.output + '.tmp', args.output)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
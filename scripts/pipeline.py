@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+
+'''
+Runs the nightly metrics collection as a graph of stages.
+
+Each stage declares the files it reads and the files it writes, and a stage
+starts as soon as the stages producing its inputs have finished. The
+workspace, Shock and AWE collectors talk to different databases and do not
+depend on each other, so they run side by side with the Splunk exports.
+
+A stage whose input files and command are unchanged since its last
+successful run is skipped. Stages without input files (collectors, Splunk
+exports) always run. Outputs are written to a staging directory next to
+their destination and renamed into place only if the stage succeeds, so the
+web directory never holds a half written file.
+'''
+
+from __future__ import print_function
+from argparse import ArgumentParser
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+STATE_FILE = 'pipeline_state.json'
+TIMINGS_FILE = 'pipeline_timings.json'
+
+WEB_DEFAULT = '/var/www/metrics/'
+WORK_DEFAULT = '/tmp'
+ACCESS_DEFAULT = '/kb/deployment/access_log/access.json'
+STAFF_FILE = 'kbase-staff.lst'
+
+OK = 'ok'
+UNCHANGED = 'unchanged'
+FAILED = 'failed'
+BLOCKED = 'blocked'
+
+
+class Stage(object):
+    """A step of the pipeline.
+
+    command is run through the shell from the base directory. {out} in the
+    command is replaced with the staging directory the stage must write its
+    outputs to, using the output file names. If stdout is given it is the
+    path the command's standard output is saved to; when that path is one of
+    the outputs it is staged like the others.
+    """
+
+    def __init__(self, name, command, inputs=(), outputs=(), stdout=None):
+        self.name = name
+        self.command = command
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.stdout = stdout
+        dirs = set(os.path.dirname(o) for o in self.outputs)
+        if len(dirs) > 1:
+            raise ValueError('Outputs of stage {} are not in one directory'
+                             .format(name))
+        self.outdir = dirs.pop() if dirs else None
+
+
+def nightly_stages(web, work, access):
+    def w(f):
+        return os.path.join(web, f)
+
+    def t(f):
+        return os.path.join(work, f)
+    visits = t('visit.csv')
+    methods = t('methods.csv')
+    return [
+        # Splunk exports, sharing one login
+        Stage('splunk', './scripts/splunk_client.py --output-dir {out} ' +
+              'users-by-day=' + os.path.basename(visits) + ' ' +
+              'methods-by-day=' + os.path.basename(methods),
+              outputs=[visits, methods], stdout=t('splunk.out')),
+        # User stats
+        Stage('visit_summaries', './scripts/visits_summary.py --output ' +
+              '{out} ' + visits,
+              inputs=[visits],
+              outputs=[w('histogram.json'), w('users.json'),
+                       w('recent.json')],
+              stdout=t('visits.out')),
+        # Shock/AWE/WS
+        Stage('workspace', './scripts/workspace_statistics.py --output {out}',
+              outputs=[w('user_data.json'), w('ws_data.json'),
+                       w('ws_object_list.json'), w('ws_bymonth.json'),
+                       w('ws_savers_sketches.json')],
+              stdout=t('ws.out')),
+        Stage('shock', './scripts/calculate_shock_disk_usage.py ' +
+              '--output {out}',
+              outputs=[w('shock_data.json'),
+                       w('shock_owners_sketches.json')],
+              stdout=t('shock.out')),
+        Stage('awe', './scripts/calculate_awe_usage.py --output {out}',
+              outputs=[w('awe_user_data.json')], stdout=t('awe.out')),
+        # Methods
+        Stage('methods_summary', './scripts/methods_summary.py --cache ' +
+              t('methods_cache.npz') + ' --output {out}/methods.json ' +
+              methods,
+              inputs=[methods], outputs=[w('methods.json')]),
+        Stage('narratives', './scripts/merge_narrative.py --access ' +
+              access + ' --objects ' + w('ws_object_list.json') + ' {out}',
+              inputs=[access, w('ws_object_list.json')],
+              outputs=[w('narrative_access.json'), w('narratives2.json')]),
+        # Per user index, updated in place for the sources that changed
+        Stage('user_index', './scripts/user_index.py --index ' +
+              t('user_index.sqlite') + ' --workspace ' +
+              w('user_data.json') + ' --shock ' + w('shock_data.json') +
+              ' --awe ' + w('awe_user_data.json') + ' --staff ' + STAFF_FILE,
+              inputs=[w('user_data.json'), w('shock_data.json'),
+                      w('awe_user_data.json'), STAFF_FILE],
+              stdout=t('user_index.out')),
+    ]
+
+
+def _parseArgs():
+    parser = ArgumentParser(description='Run the nightly metrics collection')
+    parser.add_argument('-w', '--web', default=WEB_DEFAULT,
+                        help='directory the dashboard files are written to.')
+    parser.add_argument('-t', '--workdir', default=WORK_DEFAULT,
+                        help='directory for intermediate files, logs and ' +
+                        'the pipeline state.')
+    parser.add_argument('-a', '--access', default=ACCESS_DEFAULT,
+                        help='path to the narrative access summary.')
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+                        help='maximum number of stages to run at once. ' +
+                        'By default there is no limit.')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='run every stage even if its inputs are ' +
+                        'unchanged.')
+    parser.add_argument('-s', '--stage', action='append',
+                        help='only run this stage. May be repeated.')
+    return parser.parse_args()
+
+
+def write_atomic(path, text):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.rename(tmp, path)
+
+
+def file_digest(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def input_signature(stage):
+    """Returns a digest of the stage's command and input files, or None if
+    the stage has no inputs or one is missing."""
+    if not stage.inputs:
+        return None
+    h = hashlib.sha1(stage.command.encode('utf-8'))
+    for i in stage.inputs:
+        if not os.path.isfile(i):
+            return None
+        h.update(i.encode('utf-8'))
+        h.update(file_digest(i).encode('utf-8'))
+    return h.hexdigest()
+
+
+def order_stages(stages):
+    """Maps each stage name to the names of the stages producing its inputs.
+    Fails on duplicate outputs and dependency cycles."""
+    producer = {}
+    for s in stages:
+        for o in s.outputs:
+            if o in producer:
+                raise ValueError('{} is written by both {} and {}'.format(
+                    o, producer[o], s.name))
+            producer[o] = s.name
+    deps = {}
+    for s in stages:
+        deps[s.name] = set(producer[i] for i in s.inputs if i in producer)
+    resolved = set()
+    while len(resolved) < len(deps):
+        ready = [n for n in deps if n not in resolved and
+                 deps[n] <= resolved]
+        if not ready:
+            raise ValueError('Stage dependency cycle among ' + ', '.join(
+                sorted(set(deps) - resolved)))
+        resolved.update(ready)
+    return deps
+
+
+def run_stage(stage, cwd):
+    """Runs the stage's command and moves its outputs into place. Returns
+    True on success."""
+    staging = None
+    if stage.outdir:
+        staging = tempfile.mkdtemp(prefix='.' + stage.name + '-',
+                                   dir=stage.outdir)
+    try:
+        cmd = stage.command.replace('{out}', staging or '')
+        out = None
+        if stage.stdout:
+            path = stage.stdout
+            if path in stage.outputs:
+                path = os.path.join(staging, os.path.basename(path))
+            out = open(path, 'w')
+        try:
+            ret = subprocess.call(cmd, shell=True, cwd=cwd, stdout=out)
+        finally:
+            if out:
+                out.close()
+        if ret != 0:
+            print('Stage {} exited with code {}'.format(stage.name, ret))
+            return False
+        staged = [(os.path.join(staging, os.path.basename(o)), o)
+                  for o in stage.outputs]
+        missing = [o for s, o in staged if not os.path.isfile(s)]
+        if missing:
+            print('Stage {} did not write {}'.format(
+                stage.name, ', '.join(missing)))
+            return False
+        for s, o in staged:
+            os.rename(s, o)
+        return True
+    finally:
+        if staging:
+            shutil.rmtree(staging, ignore_errors=True)
+
+
+class Pipeline(object):
+
+    def __init__(self, stages, workdir, cwd, jobs=0, force=False):
+        self._stages = dict((s.name, s) for s in stages)
+        self._deps = order_stages(stages)
+        self._cwd = cwd
+        self._jobs = jobs
+        self._force = force
+        self._state_file = os.path.join(workdir, STATE_FILE)
+        self._state = {}
+        if os.path.isfile(self._state_file):
+            with open(self._state_file) as f:
+                self._state = json.load(f)
+        self._cond = threading.Condition()
+        self.status = {}
+        self.timings = {}
+
+    def _worker(self, stage):
+        start = time.time()
+        sig = None
+        try:
+            sig = input_signature(stage)
+            if (not self._force and sig is not None and
+                    self._state.get(stage.name) == sig and
+                    all(os.path.isfile(o) for o in stage.outputs)):
+                status = UNCHANGED
+            else:
+                status = OK if run_stage(stage, self._cwd) else FAILED
+        except Exception as e:
+            print('Stage {} failed: {!r}'.format(stage.name, e))
+            status = FAILED
+        with self._cond:
+            try:
+                if status == OK and sig is not None:
+                    self._state[stage.name] = sig
+                    write_atomic(self._state_file, json.dumps(
+                        self._state, indent=2, sort_keys=True))
+            except Exception as e:
+                print('Could not save the state of stage {}: {!r}'.format(
+                    stage.name, e))
+            self.status[stage.name] = status
+            self.timings[stage.name] = {'status': status,
+                                        'start': start,
+                                        'seconds': time.time() - start}
+            print('Stage {} {} in {:.1f} s'.format(
+                stage.name, status, self.timings[stage.name]['seconds']))
+            sys.stdout.flush()
+            self._cond.notify()
+
+    def run(self):
+        pending = set(self._stages)
+        running = set()
+        with self._cond:
+            while pending or running:
+                running -= set(self.status)
+                for name in sorted(pending):
+                    deps = self._deps[name]
+                    if any(self.status.get(d) in (FAILED, BLOCKED)
+                           for d in deps):
+                        self.status[name] = BLOCKED
+                        print('Stage {} blocked by a failed input'.format(
+                            name))
+                        pending.discard(name)
+                    elif (all(d in self.status for d in deps) and
+                            (self._jobs < 1 or len(running) < self._jobs)):
+                        print('Starting stage ' + name)
+                        sys.stdout.flush()
+                        running.add(name)
+                        pending.discard(name)
+                        th = threading.Thread(target=self._worker,
+                                              args=(self._stages[name],))
+                        th.daemon = True
+                        th.start()
+                if running:
+                    self._cond.wait(1)
+                    running -= set(self.status)
+        return all(s in (OK, UNCHANGED) for s in self.status.values())
+
+
+def main():
+    args = _parseArgs()
+    starttime = time.time()
+    stages = nightly_stages(args.web, args.workdir, args.access)
+    if args.stage:
+        unknown = set(args.stage) - set(s.name for s in stages)
+        if unknown:
+            print('Unknown stage(s): ' + ', '.join(sorted(unknown)))
+            sys.exit(1)
+        stages = [s for s in stages if s.name in args.stage]
+    p = Pipeline(stages, args.workdir, os.getcwd(), args.jobs, args.force)
+    ok = p.run()
+    elapsed = time.time() - starttime
+    write_atomic(os.path.join(args.web, TIMINGS_FILE), json.dumps(
+        {'stages': p.timings, 'elapsed': elapsed,
+         'generated': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())},
+        indent=2, sort_keys=True))
+    print('\nElapsed time: ' + str(elapsed))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+'''
+Publishes the collectors' summaries to the TargetMongo database so the
+dashboard can query one user, workspace or time bucket at a time instead of
+downloading the whole JSON output.
+
+Each summary is a document
+
+    {'_id': 'workspace:alice', 'source': 'workspace', 'key': 'alice',
+     'data': {...}, 'hash': '<sha1 of data>', 'updated': <datetime>}
+
+in one of the collections
+
+    usage_users - per user, from every collector
+    usage_workspaces - per workspace, from workspace_statistics.py
+    usage_periods - per time bucket, with the bucket size in 'granularity'
+    usage_runs - one per collector, the output metadata of its last run
+
+A run reads the hashes of the documents it published last time and writes
+only the documents whose data changed, as unordered bulk upserts of
+BULK_SIZE. Documents from the last run that are no longer in the summary are
+removed. Mongo keys can't contain '.' or start with '$', so those characters
+in keys under data (type names, user names) are stored as their full width
+forms, U+FF0E and U+FF04.
+'''
+
+from __future__ import print_function
+import datetime
+import hashlib
+import json
+import sys
+
+from pymongo import MongoClient
+try:
+    from pymongo import DeleteMany, ReplaceOne
+except ImportError:  # pymongo 2
+    ReplaceOne = None
+
+import instrument
+
+COL_USERS = 'usage_users'
+COL_WORKSPACES = 'usage_workspaces'
+COL_PERIODS = 'usage_periods'
+COL_RUNS = 'usage_runs'
+
+BULK_SIZE = 1000
+
+CFG_HOST = 'host'
+CFG_PORT = 'port'
+CFG_DB = 'db'
+CFG_USER = 'user'
+CFG_PWD = 'pwd'
+
+DOT = u'\uff0e'
+DOLLAR = u'\uff04'
+
+try:
+    STRING = (str, unicode)
+except NameError:  # python 3
+    STRING = (str,)
+
+
+def escape(value):
+    """Copies value, making every dict key a valid Mongo field name."""
+    if isinstance(value, dict):
+        out = {}
+        for k, v in value.items():
+            if not isinstance(k, STRING):
+                k = str(k)
+            if k.startswith('$'):
+                k = DOLLAR + k[1:]
+            out[k.replace('.', DOT)] = escape(v)
+        return out
+    if isinstance(value, (list, tuple)):
+        return [escape(v) for v in value]
+    return value
+
+
+def content_hash(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True)
+                        .encode('utf-8')).hexdigest()
+
+
+class Publisher(object):
+    """Publishes the summaries of collector source to database db."""
+
+    def __init__(self, db, source):
+        self.db = db
+        self.source = source
+
+    def publish(self, collection, items, scope=None, indexes=()):
+        """Upserts a document for each (key, data) in items into collection
+        and removes the documents of the last run that aren't in items.
+        scope is a dict of further fields, e.g. the granularity, that with
+        the source identifies the set of documents; indexes are extra
+        indexes as lists of (field, direction). Returns the number of
+        documents written, unchanged and removed."""
+        coll = self.db[collection]
+        scope = dict(scope or {}, source=self.source)
+        fields = sorted(scope)
+        coll.create_index([(f, 1) for f in fields] + [('key', 1)])
+        for index in indexes:
+            coll.create_index(index)
+        prefix = ':'.join(str(scope[f]) for f in fields if f != 'source')
+        prefix = self.source + ':' + (prefix + ':' if prefix else '')
+        with instrument.timer('publish_read'):
+            old = dict((d['_id'], d.get('hash')) for d in
+                       coll.find(scope, ['hash']))
+        now = datetime.datetime.utcnow()
+        ops = []
+        written = unchanged = 0
+        for key, data in items:
+            data = escape(data)
+            h = content_hash(data)
+            docid = prefix + u'{}'.format(key)
+            if old.pop(docid, None) == h:
+                unchanged += 1
+                continue
+            doc = dict(scope, _id=docid, key=key, data=data, hash=h,
+                       updated=now)
+            ops.append(('replace', docid, doc))
+            written += 1
+            if len(ops) >= BULK_SIZE:
+                self._write(coll, ops)
+                ops = []
+        removed = list(old)
+        for i in range(0, len(removed), BULK_SIZE):
+            ops.append(('remove', removed[i:i + BULK_SIZE], None))
+        self._write(coll, ops)
+        instrument.count('published', written)
+        instrument.count('publish_unchanged', unchanged)
+        print('Published to {}: {} written, {} unchanged, {} removed'
+              .format(collection, written, unchanged, len(removed)))
+        sys.stdout.flush()
+        return written, unchanged, len(removed)
+
+    def _write(self, coll, ops):
+        if not ops:
+            return
+        with instrument.timer('publish_write'):
+            if ReplaceOne:
+                coll.bulk_write(
+                    [ReplaceOne({'_id': i}, doc, upsert=True)
+                     if op == 'replace' else DeleteMany({'_id': {'$in': i}})
+                     for op, i, doc in ops], ordered=False)
+                return
+            bulk = coll.initialize_unordered_bulk_op()
+            for op, i, doc in ops:
+                if op == 'replace':
+                    bulk.find({'_id': i}).upsert().replace_one(doc)
+                else:
+                    bulk.find({'_id': {'$in': i}}).remove()
+            bulk.execute()
+
+    def users(self, items):
+        return self.publish(COL_USERS, items, indexes=[[('key', 1)]])
+
+    def workspaces(self, items):
+        return self.publish(COL_WORKSPACES, items,
+                            indexes=[[('source', 1), ('data.owner', 1)]])
+
+    def periods(self, items, granularity):
+        return self.publish(COL_PERIODS, items,
+                            {'granularity': granularity})
+
+    def finish(self, meta):
+        """Records the run's output metadata, e.g. the time series
+        settings."""
+        doc = {'_id': self.source, 'meta': escape(meta),
+               'updated': datetime.datetime.utcnow()}
+        if ReplaceOne:
+            self.db[COL_RUNS].replace_one({'_id': self.source}, doc,
+                                          upsert=True)
+        else:
+            self.db[COL_RUNS].save(doc)
+
+
+def from_config(cfg, source):
+    """A Publisher to the database in the TargetMongo config section
+    cfg."""
+    client = MongoClient(cfg[CFG_HOST], cfg[CFG_PORT])
+    db = client[cfg[CFG_DB]]
+    if cfg[CFG_USER]:
+        db.authenticate(cfg[CFG_USER], cfg[CFG_PWD])
+    return Publisher(db, source)
+
+
+def add_arguments(parser):
+    parser.add_argument('--publish', action='store_true',
+                        help='also write the summaries to the TargetMongo ' +
+                        'database, skipping documents that have not ' +
+                        'changed since the last run.')
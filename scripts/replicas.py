@@ -0,0 +1,338 @@
+'''
+Reads from several members of the source replica set at once.
+
+The SourceMongo host setting may list more than one member, e.g.
+
+    host=mongo1,mongo2,mongo3:27018
+
+Members without a port use the section's port. Each member gets its own
+client, and so its own connection pool, and its own worker threads. The
+collector splits its scan into partitions (workspace id ranges, node _id
+ranges) which the workers take from a shared queue, so a faster member does
+more of them and read throughput grows with the number of members.
+
+Before taking a partition a worker checks its member, at most every
+CHECK_INTERVAL seconds. A member that doesn't answer ping is marked down, and
+a member more than max lag seconds behind the primary leaves the work to the
+others while any of them is in sync. If a read fails with a connection error
+the member is marked down and the partition goes back on the queue for
+another member; a down member is tried again after RETRY_INTERVAL. A
+partition's result is only handed back once the partition is complete, so a
+partition that is retried is never counted twice. If every member has failed
+MAX_FAILURES times in a row the run is given up.
+'''
+
+from __future__ import print_function
+from collections import defaultdict
+import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+from pymongo import MongoClient
+from pymongo.errors import ConnectionFailure, OperationFailure
+
+import hll
+import instrument
+
+CHECK_INTERVAL = 30.0
+RETRY_INTERVAL = 60.0
+MAX_FAILURES = 3
+WORKERS_PER_MEMBER_DEFAULT = 1
+PARTITIONS_PER_WORKER = 4
+RESULT_WAIT = 5.0
+
+
+class PartitionError(Exception):
+    pass
+
+
+def members(hosts, port):
+    """Returns (host, port) for each of hosts, a host name or list of names
+    each optionally followed by :port."""
+    if not isinstance(hosts, list):
+        hosts = [hosts]
+    out = []
+    for h in hosts:
+        h = h.strip()
+        if ':' in h:
+            h, p = h.rsplit(':', 1)
+            out.append((h, int(p)))
+        else:
+            out.append((h, port))
+    return out
+
+
+def replication_lag(status):
+    """Seconds the member that returned replSetGetStatus status is behind the
+    primary, or None if there is no primary."""
+    primary = me = None
+    for m in status['members']:
+        if m.get('self'):
+            me = m
+        if m.get('stateStr') == 'PRIMARY':
+            primary = m
+    if not primary or not me:
+        return None
+    return max(0, (primary['optimeDate'] - me['optimeDate']).total_seconds())
+
+
+def split(items, n, weight):
+    """Splits the list items into at most n contiguous lists of about equal
+    total weight(item)."""
+    total = float(sum(weight(i) for i in items))
+    parts = []
+    part = []
+    sofar = 0
+    for i in items:
+        part.append(i)
+        sofar += weight(i)
+        if len(parts) < n - 1 and sofar >= total * (len(parts) + 1) / n:
+            parts.append(part)
+            part = []
+    if part:
+        parts.append(part)
+    return parts
+
+
+def merge_counts(into, counts):
+    """Adds the nested dict of counts from one partition into another.
+    hll.HyperLogLog sketches among the counts are unioned."""
+    for k, v in counts.items():
+        if isinstance(v, dict):
+            if isinstance(into, defaultdict):
+                merge_counts(into[k], v)
+            else:
+                merge_counts(into.setdefault(k, {}), v)
+        elif isinstance(v, hll.HyperLogLog):
+            hll.merge_all(into, {k: v})
+        else:
+            into[k] = into.get(k, 0) + v
+
+
+class Member(object):
+
+    def __init__(self, host, port, dbname, user=None, pwd=None,
+                 client_args=None):
+        self.name = '{}:{}'.format(host, port)
+        self.host = host
+        self.port = port
+        self.dbname = dbname
+        self.user = user
+        self.pwd = pwd
+        self.client_args = client_args or {}
+        self.client = None
+        self.db = None
+        self.lag = None
+        self.down_since = None
+        self.failures = 0
+        self.checked = 0
+        # the member's workers check and mark it down concurrently
+        self._lock = threading.RLock()
+
+    def connect(self):
+        if self.client is None:
+            client = MongoClient(self.host, self.port, slaveOk=True,
+                                 **self.client_args)
+            db = client[self.dbname]
+            if self.user:
+                db.authenticate(self.user, self.pwd)
+            self.client, self.db = client, db
+        return self.db
+
+    def check(self, force=False):
+        """Pings the member and measures its lag, if not done lately."""
+        with self._lock:
+            self._check(force)
+
+    def _check(self, force):
+        now = time.time()
+        if not force and now - self.checked < CHECK_INTERVAL:
+            return
+        self.checked = now
+        if self.down_since and now - self.down_since < RETRY_INTERVAL:
+            return
+        try:
+            self.connect()
+            self.client.admin.command('ping')
+            self.lag = self._lag()
+        except ConnectionFailure as e:
+            self.mark_down(e)
+            return
+        if self.down_since:
+            print('Member {} is back up'.format(self.name))
+            self.down_since = None
+            self.failures = 0
+
+    def _lag(self):
+        try:
+            status = self.client.admin.command('replSetGetStatus')
+        except OperationFailure:
+            # not a replica set member, or not allowed to ask
+            return None
+        return replication_lag(status)
+
+    def mark_down(self, error):
+        with self._lock:
+            if not self.down_since:
+                print('Member {} is down: {}'.format(self.name, error))
+                sys.stdout.flush()
+            self.failures += 1
+            instrument.count('member_failures')
+            self.down_since = time.time()
+            self.client = None
+            self.db = None
+
+    @property
+    def up(self):
+        return self.down_since is None
+
+
+class MemberPool(object):
+    """The members of the source replica set, with workers_per_member
+    worker threads each."""
+
+    def __init__(self, hosts, port, dbname, user=None, pwd=None,
+                 max_lag=None, workers_per_member=WORKERS_PER_MEMBER_DEFAULT,
+                 client_args=None):
+        self.members = [Member(h, p, dbname, user, pwd, client_args)
+                        for h, p in members(hosts, port)]
+        self.max_lag = max_lag
+        self.workers_per_member = workers_per_member
+        self.max_attempts = 2 * len(self.members)
+
+    @property
+    def workers(self):
+        return len(self.members) * self.workers_per_member
+
+    def partitions(self):
+        """A good number of partitions to split a scan into."""
+        return self.workers * PARTITIONS_PER_WORKER
+
+    def db(self):
+        """The database on the first member that is up and in sync, for the
+        collector's small queries."""
+        for m in sorted(self.members, key=self._rank):
+            m.check(force=True)
+            if m.up:
+                return m.db
+        raise PartitionError('No source member is reachable: ' +
+                             ', '.join(m.name for m in self.members))
+
+    def _rank(self, member):
+        return (not member.up, not self._in_sync(member))
+
+    def _in_sync(self, member):
+        return (not self.max_lag or member.lag is None or
+                member.lag <= self.max_lag)
+
+    def _ready(self, member):
+        member.check()
+        if not member.up:
+            return False
+        if self._in_sync(member):
+            return True
+        # lagging; only work if every other member is lagging or down
+        return not any(m.up and self._in_sync(m) for m in self.members
+                       if m is not member)
+
+    def run(self, partitions, work, context=None, transient=None):
+        """Calls work(db, ctx, partition) for each partition on the worker
+        threads, where ctx is context(member) made once per worker, and
+        yields (partition, result) in the order the partitions finish.
+        A partition that fails with a lost connection is read again on
+        another member; one that fails with an error for which
+        transient(error) is true, e.g. a timed out cursor, is read again
+        without taking the member out of rotation."""
+        todo = queue.Queue()
+        for p in partitions:
+            todo.put((p, 0))
+        results = queue.Queue()
+        stop = threading.Event()
+
+        def attempt(member, ctx, p, attempts):
+            db = member.db if self._ready(member) else None
+            if db is None:
+                if all(m.failures >= MAX_FAILURES for m in self.members):
+                    results.put((p, None, PartitionError(
+                        'No source member is reachable: ' +
+                        ', '.join(m.name for m in self.members))))
+                    return
+                todo.put((p, attempts))
+                stop.wait(1)
+                return
+            try:
+                r = work(db, ctx, p)
+            except Exception as e:
+                if isinstance(e, ConnectionFailure):
+                    member.mark_down(e)
+                elif not (transient and transient(e)):
+                    raise
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    results.put((p, None, PartitionError(
+                        'Partition failed {} times, last on {}: {}'
+                        .format(attempts, member.name, e))))
+                else:
+                    instrument.count('partition_retries')
+                    todo.put((p, attempts))
+                return
+            results.put((p, r, None))
+
+        def worker(member):
+            # every partition taken ends up on results, even if the context,
+            # the member check or the work fails, so run() never waits for
+            # a dead thread
+            ctx = error = None
+            try:
+                ctx = context(member) if context else None
+            except Exception as e:
+                error = e
+            while not stop.is_set():
+                try:
+                    p, attempts = todo.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if error is not None:
+                    results.put((p, None, error))
+                    continue
+                try:
+                    attempt(member, ctx, p, attempts)
+                except Exception as e:
+                    results.put((p, None, e))
+
+        threads = []
+        for m in self.members:
+            for _ in range(self.workers_per_member):
+                t = threading.Thread(target=worker, args=(m,))
+                t.daemon = True
+                t.start()
+                threads.append(t)
+        try:
+            for _ in range(len(partitions)):
+                while True:
+                    try:
+                        p, r, error = results.get(timeout=RESULT_WAIT)
+                        break
+                    except queue.Empty:
+                        if not any(t.is_alive() for t in threads):
+                            raise PartitionError('All reader threads stopped')
+                if error is not None:
+                    raise error
+                instrument.count('partitions_done')
+                yield p, r
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+
+
+def add_arguments(parser):
+    parser.add_argument('--workers-per-member', type=int,
+                        default=WORKERS_PER_MEMBER_DEFAULT,
+                        help='reader threads per source member when the ' +
+                        'config lists more than one. Default %(default)s.')
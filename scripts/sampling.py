@@ -0,0 +1,143 @@
+'''
+Stratified random sampling for quick approximate collector runs.
+
+The collection being scanned is split into units (e.g. a window of object
+ids in a workspace, or a day of Shock nodes) and the units into strata of
+similar units. A fraction of each stratum is drawn at random, the sampled
+units are scanned, and the total of every number the collector reports is
+estimated from them:
+
+    estimate = sum over strata h of N_h * mean_h
+    variance = sum over strata h of N_h^2 * (1 - n_h / N_h) * s_h^2 / n_h
+
+where N_h is the number of units in the stratum, n_h the number sampled,
+and mean_h and s_h^2 the sample mean and variance of the unit totals. The
+reports carry a 95% confidence interval half width next to each estimate,
+e.g. {"cnt": 1200, "cnt_ci95": 85}.
+'''
+
+from __future__ import division
+from collections import defaultdict
+import math
+import random
+
+Z_95 = 1.959964
+MIN_UNITS = 2
+CI_SUFFIX = '_ci95'
+
+try:
+    NUMBER = (int, long, float)
+except NameError:  # python 3
+    NUMBER = (int, float)
+
+
+def sample_file(name):
+    """user_data.json -> user_data_sample.json"""
+    base, ext = name.rsplit('.', 1)
+    return '{}_sample.{}'.format(base, ext)
+
+
+def flatten(d, prefix=()):
+    """Yields (key path tuple, number) for the numeric leaves of nested
+    dicts."""
+    for k, v in d.items():
+        if isinstance(v, dict):
+            for item in flatten(v, prefix + (k,)):
+                yield item
+        elif isinstance(v, NUMBER) and not isinstance(v, bool):
+            yield prefix + (k,), v
+
+
+def nest(estimates):
+    """Builds nested dicts from {key path: (estimate, variance)}, putting
+    the confidence interval half width next to each estimate."""
+    out = {}
+    for path, (est, var) in estimates.items():
+        d = out
+        for k in path[:-1]:
+            d = d.setdefault(k, {})
+        d[path[-1]] = int(round(est))
+        d[str(path[-1]) + CI_SUFFIX] = int(math.ceil(Z_95 * math.sqrt(var)))
+    return out
+
+
+class StratifiedSample(object):
+    """Draws the sample and accumulates the unit totals.
+
+    population - stratum -> number of units
+    sampled - stratum -> number of sampled units added
+    """
+
+    def __init__(self, fraction, min_units=MIN_UNITS, seed=None):
+        if not 0 < fraction <= 1:
+            raise ValueError('Sample fraction must be > 0 and <= 1')
+        self.fraction = fraction
+        self.min_units = min_units
+        self.random = random.Random(seed)
+        self.population = {}
+        self.sampled = defaultdict(int)
+        # stratum -> key path -> sum, sum of squares of the unit totals
+        self._s1 = defaultdict(lambda: defaultdict(float))
+        self._s2 = defaultdict(lambda: defaultdict(float))
+
+    def draw(self, strata):
+        """Takes stratum -> list of units and returns a sorted list of
+        (stratum, unit) to scan."""
+        drawn = []
+        for h, units in strata.items():
+            self.population[h] = len(units)
+            n = max(self.min_units, int(math.ceil(self.fraction * len(units))))
+            drawn.extend((h, u) for u in
+                         self.random.sample(units, min(n, len(units))))
+        drawn.sort()
+        return drawn
+
+    def add(self, stratum, totals):
+        """Adds the nested dict of totals for one sampled unit. Must be
+        called for every drawn unit, including those with no data."""
+        self.sampled[stratum] += 1
+        s1 = self._s1[stratum]
+        s2 = self._s2[stratum]
+        for key, v in flatten(totals):
+            s1[key] += v
+            s2[key] += v * v
+
+    def units(self):
+        return sum(self.population.values()), sum(self.sampled.values())
+
+    def estimates(self):
+        """Returns {key path: (estimate, variance)} for every key seen."""
+        est = defaultdict(float)
+        var = defaultdict(float)
+        for h, s1 in self._s1.items():
+            N = self.population[h]
+            n = self.sampled[h]
+            s2 = self._s2[h]
+            for key, total in s1.items():
+                mean = total / n
+                est[key] += N * mean
+                if n > 1 and n < N:
+                    s_sq = max(0.0, (s2[key] - n * mean * mean) / (n - 1))
+                    var[key] += N * N * (1 - n / N) * s_sq / n
+        return dict((k, (est[k], var[k])) for k in est)
+
+    def meta(self):
+        total, sampled = self.units()
+        return {'sample_fraction': self.fraction,
+                'units': total,
+                'units_sampled': sampled,
+                'strata': len(self.population),
+                'confidence': 0.95,
+                'comments': 'Estimated from a stratified random sample. ' +
+                'Each estimate x has a 95% confidence interval ' +
+                'half width x' + CI_SUFFIX + '.'}
+
+
+def add_arguments(parser, unit):
+    parser.add_argument('--sample', type=float, metavar='FRACTION',
+                        help='estimate from a stratified random sample of ' +
+                        'this fraction of ' + unit + ' and write the ' +
+                        'estimates with confidence intervals to *_sample ' +
+                        'output files.')
+    parser.add_argument('--seed', type=int,
+                        help='random seed for --sample.')
@@ -0,0 +1,185 @@
+'''
+Writes a collector output as gzipped JSON shards with a manifest, so the
+dashboard downloads only the shards it shows and a nightly run rewrites only
+the shards whose content changed.
+
+An output, e.g. user_data, becomes the directory
+
+    user_data/manifest.json
+    user_data/users/al.json.gz
+    user_data/users/bo.json.gz
+    ...
+
+Each shard is a JSON object holding some of the output's keys: the users
+whose names start with the same PREFIX_LEN characters, the objects saved in
+the same month, and so on. It is compact (no indentation) and gzipped with a
+zero timestamp, so the same content always gives the same bytes. The
+manifest is small and uncompressed:
+
+    {"meta": {...},
+     "shards": {"users/al": {"file": "users/al.json.gz", "sha1": "...",
+                             "keys": 12, "bytes": 345}, ...}}
+
+where sha1 is the hash of the uncompressed shard. A shard is only written
+when its hash differs from the one in the last manifest, and shards that
+are no longer in the output are removed. Shards and the manifest are written
+to a temporary file and renamed into place.
+
+Entries are buffered in memory up to BUFFER_BYTES and then appended to a
+temporary file per shard, so an output bigger than memory (e.g. from a spill
+file) can be written in any order. Each shard's entries are sorted by key
+when it is written, so its content doesn't depend on that order.
+'''
+
+from __future__ import print_function
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+import instrument
+
+MANIFEST = 'manifest.json'
+SUFFIX = '.json.gz'
+PREFIX_LEN = 2
+BUFFER_BYTES = 16 * 1024 * 1024
+COMPRESS_LEVEL = 6
+
+_UNSAFE = re.compile('[^a-z0-9]')
+
+
+def user_shard(name, directory='users'):
+    """The shard of the entry for user name: its first PREFIX_LEN
+    characters, lower case, with anything but letters and digits as _."""
+    prefix = _UNSAFE.sub('_', u'{}'.format(name)[:PREFIX_LEN].lower())
+    return directory + '/' + (prefix or '_')
+
+
+def month_shard(label, directory='months'):
+    """The shard of the entry for time bucket label, e.g. 201503."""
+    return directory + '/' + label
+
+
+def _entry(key, value):
+    return (json.dumps(u'{}'.format(key)) + ':' +
+            json.dumps(value, separators=(',', ':'), sort_keys=True))
+
+
+class ShardWriter(object):
+    """Writes output name to directory outdir/name."""
+
+    def __init__(self, outdir, name):
+        self.name = name
+        self.dir = os.path.join(outdir, name)
+        if not os.path.isdir(self.dir):
+            os.makedirs(self.dir)
+        self.old = {}
+        path = os.path.join(self.dir, MANIFEST)
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.old = json.load(f).get('shards', {})
+        self._tmp = tempfile.mkdtemp(prefix='.shards-', dir=self.dir)
+        self._files = {}  # shard -> temporary file
+        self._buffers = {}  # shard -> entries not yet in the file
+        self._buffered = 0
+
+    def add(self, shard, key, value):
+        entry = _entry(key, value)
+        self._buffers.setdefault(shard, []).append(entry)
+        self._buffered += len(entry)
+        if self._buffered > BUFFER_BYTES:
+            self._flush()
+
+    def add_all(self, shard_of, items):
+        """Adds (key, value) items, each to shard shard_of(key, value)."""
+        for key, value in items:
+            self.add(shard_of(key, value), key, value)
+
+    def _flush(self):
+        for shard, entries in self._buffers.items():
+            if shard not in self._files:
+                self._files[shard] = os.path.join(
+                    self._tmp, str(len(self._files)))
+            with open(self._files[shard], 'a') as f:
+                f.write('\n'.join(entries) + '\n')
+        self._buffers = {}
+        self._buffered = 0
+
+    def _entries(self, shard):
+        entries = self._buffers.get(shard, [])
+        if shard in self._files:
+            with open(self._files[shard]) as f:
+                entries = [line.rstrip('\n') for line in f] + entries
+        return entries
+
+    def close(self, meta=None):
+        """Writes the changed shards and the manifest and removes the shards
+        no longer in the output. Returns the number of shards written,
+        unchanged and removed."""
+        written = unchanged = 0
+        shards = {}
+        try:
+            with instrument.timer('shards'):
+                for shard in sorted(set(self._files) | set(self._buffers)):
+                    entries = sorted(self._entries(shard))
+                    text = ('{' + ','.join(entries) + '}').encode('utf-8')
+                    h = hashlib.sha1(text).hexdigest()
+                    path = os.path.join(self.dir, shard + SUFFIX)
+                    old = self.old.get(shard, {})
+                    if old.get('sha1') == h and os.path.isfile(path):
+                        unchanged += 1
+                        size = old['bytes']
+                    else:
+                        size = self._write(path, text)
+                        written += 1
+                    shards[shard] = {'file': shard + SUFFIX, 'sha1': h,
+                                     'keys': len(entries), 'bytes': size}
+                removed = [s for s in self.old if s not in shards]
+                for shard in removed:
+                    path = os.path.join(self.dir, shard + SUFFIX)
+                    if os.path.isfile(path):
+                        os.remove(path)
+                self._manifest({'meta': meta or {}, 'shards': shards})
+        finally:
+            shutil.rmtree(self._tmp, ignore_errors=True)
+        instrument.count('shards_written', written)
+        instrument.count('shards_unchanged', unchanged)
+        print('Wrote {}: {} shards written, {} unchanged, {} removed'.format(
+            self.dir, written, unchanged, len(removed)))
+        sys.stdout.flush()
+        return written, unchanged, len(removed)
+
+    def _write(self, path, text):
+        """Writes gzipped text to path and returns the compressed size."""
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            z = gzip.GzipFile(filename='', mode='wb', fileobj=f, mtime=0,
+                              compresslevel=COMPRESS_LEVEL)
+            z.write(text)
+            z.close()
+        os.rename(tmp, path)
+        return os.path.getsize(path)
+
+    def _manifest(self, manifest):
+        path = os.path.join(self.dir, MANIFEST)
+        text = json.dumps(manifest, separators=(',', ':'), sort_keys=True)
+        if os.path.isfile(path):
+            with open(path) as f:
+                if f.read() == text:
+                    return
+        with open(path + '.tmp', 'w') as f:
+            f.write(text)
+        os.rename(path + '.tmp', path)
+
+
+def add_arguments(parser):
+    parser.add_argument('--shard-dir',
+                        help='also write the output as gzipped JSON shards ' +
+                        'with a manifest under this directory, rewriting ' +
+                        'only the shards that changed since the last run.')
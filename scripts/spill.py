@@ -0,0 +1,190 @@
+'''
+An on disk store for collector state that has outgrown its memory budget.
+
+Aggregates are nested dicts of counts, e.g. user -> pub -> del -> cnt, and
+are spilled as (key path, value) rows. The same path can be spilled many
+times; the values are summed when the store is read back. Object lists map
+an object id to a dict that includes its version, and when an object has
+been spilled more than once the highest version is kept.
+
+The store is SQLite, appended to while collecting and indexed once, before
+reading back, so that rows come back sorted by key path and the nested
+output can be streamed with json_stream.ObjectWriter, e.g.
+
+    store = SpillStore(tmpdir)
+    store.add_counts(('users',), userdata)
+    userdata.clear()
+    ...
+    w = json_stream.ObjectWriter(f, indent=2)
+    write_nested(w, store.counts(('users',)))
+    w.close()
+'''
+
+import json
+import os
+import sqlite3
+import tempfile
+
+import sampling
+
+MB = 1024 * 1024
+
+# key path components are joined with SEP, and the characters up to ESC in
+# the keys escaped, so the joined text sorts like the tuple of keys
+SEP = u'\x01'
+ESC = u'\x02'
+_ESCAPES = dict((chr(i), ESC + chr(i + 1)) for i in range(3))
+
+
+def _key_text(key):
+    if not isinstance(key, type(u'')):
+        key = key.decode('utf-8') if isinstance(key, bytes) else (
+            json.dumps(key))
+    if key and min(key) <= ESC:
+        key = u''.join(_ESCAPES.get(c, c) for c in key)
+    return key
+
+
+def sort_key(path):
+    """Text for the key path tuple path that sorts, in SQLite as well, in
+    the order of the tuples of their keys. Keys that aren't strings sort
+    by their JSON text."""
+    return u''.join(_key_text(k) + SEP for k in path)
+
+
+class SpillStore(object):
+    """A SQLite file in directory tmpdir (the system temp directory if
+    None), deleted by close(). To resume a run, pass the mark() saved with
+    its checkpoint as resume to reopen the run's file as it was then."""
+
+    def __init__(self, tmpdir=None, resume=None):
+        self.spills = 0
+        self._indexed = False
+        if resume:
+            self.path = resume['path']
+        else:
+            fd, self.path = tempfile.mkstemp(suffix='.sqlite',
+                                             prefix='spill.', dir=tmpdir)
+            os.close(fd)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('PRAGMA journal_mode = OFF')
+        self.conn.execute('PRAGMA synchronous = OFF')
+        if resume:
+            self.rollback(resume)
+            return
+        self.conn.execute(
+            'CREATE TABLE counts (sortkey TEXT, path TEXT, value INTEGER)')
+        self.conn.execute(
+            'CREATE TABLE objects (id TEXT, ver INTEGER, data TEXT)')
+
+    def add_counts(self, prefix, nested):
+        """Spills the numeric leaves of nested, with prefix prepended to
+        their key paths."""
+        prefix = tuple(prefix)
+        self.conn.executemany(
+            'INSERT INTO counts VALUES (?, ?, ?)',
+            ((sort_key(prefix + path), json.dumps(prefix + path), v)
+             for path, v in sampling.flatten(nested)))
+
+    def add_objects(self, objlist, version_key):
+        self.conn.executemany(
+            'INSERT INTO objects VALUES (?, ?, ?)',
+            ((i, o[version_key], json.dumps(o, sort_keys=True))
+             for i, o in objlist.items()))
+
+    def commit(self):
+        self.conn.commit()
+        self.spills += 1
+
+    def mark(self):
+        """Describes the spilled rows so far, for a checkpoint."""
+        self.conn.commit()
+        return {'path': self.path, 'spills': self.spills,
+                'counts': self._last_row('counts'),
+                'objects': self._last_row('objects')}
+
+    def _last_row(self, table):
+        return self.conn.execute(
+            'SELECT MAX(rowid) FROM ' + table).fetchone()[0] or 0
+
+    def rollback(self, mark):
+        """Drops the rows spilled after mark()."""
+        for table in ('counts', 'objects'):
+            self.conn.execute('DELETE FROM {} WHERE rowid > ?'.format(table),
+                              (mark[table],))
+        self.conn.commit()
+        self.spills = mark['spills']
+
+    def _index(self):
+        if not self._indexed:
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS counts_path ON counts (sortkey)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS objects_id ON ' +
+                              'objects (id, ver DESC)')
+            self._indexed = True
+
+    def counts(self, prefix):
+        """Yields (key path, summed value) for the paths under prefix,
+        sorted by path, with prefix removed from the paths."""
+        self._index()
+        where, bounds = '', ()
+        if prefix:
+            # the sort keys under prefix start with the prefix's, so they
+            # sort between it and it with its last SEP raised to ESC
+            start = sort_key(prefix)
+            where, bounds = 'WHERE sortkey > ? AND sortkey < ? ', (
+                start, start[:-1] + ESC)
+        for text, value in self.conn.execute(
+                'SELECT MIN(path), SUM(value) FROM counts ' + where +
+                'GROUP BY sortkey ORDER BY sortkey', bounds):
+            yield json.loads(text)[len(prefix):], value
+
+    def objects(self):
+        """Yields (id, object) sorted by id, the highest version only."""
+        self._index()
+        last = None
+        for i, data in self.conn.execute(
+                'SELECT id, data FROM objects ORDER BY id, ver DESC'):
+            if i != last:
+                yield i, json.loads(data)
+                last = i
+
+    def close(self):
+        self.conn.close()
+        os.remove(self.path)
+
+
+def write_nested(writer, rows):
+    """Writes (key path, value) rows, sorted or at least grouped by path
+    prefix, as nested objects under json_stream.ObjectWriter writer."""
+    stack = []  # (key, writer) of the open nested objects
+    for path, value in rows:
+        common = 0
+        while (common < len(stack) and common < len(path) - 1 and
+               stack[common][0] == path[common]):
+            common += 1
+        while len(stack) > common:
+            stack.pop()[1].close()
+        for key in path[common:-1]:
+            parent = stack[-1][1] if stack else writer
+            stack.append((key, parent.object(key)))
+        (stack[-1][1] if stack else writer).write(path[-1], value)
+    while stack:
+        stack.pop()[1].close()
+
+
+def groups(rows):
+    """Yields (first key, nested dict of the rest) for (key path, value)
+    rows sorted by path, e.g. one user's counts at a time."""
+    key = nested = None
+    for path, value in rows:
+        if nested is None or path[0] != key:
+            if nested is not None:
+                yield key, nested
+            key, nested = path[0], {}
+        d = nested
+        for k in path[1:-1]:
+            d = d.setdefault(k, {})
+        d[path[-1]] = value
+    if nested is not None:
+        yield key, nested
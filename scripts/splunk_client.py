@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+'''
+Exports Splunk search results to files. Replaces splunk-users-by-day.pl,
+splunk-methods-by-day.pl and splunk-fetch.pl.
+
+One login session is shared by every export in a run. All search jobs are
+created up front so Splunk runs them concurrently. Each job is polled until
+done, and its results are then fetched as offset pages by several threads.
+Every page is streamed to its own part file, so no result set is ever held in
+memory. The parts are joined in order into the output file.
+
+fake_splunk_server.py serves the same REST endpoints from local files for
+offline testing.
+'''
+
+from __future__ import print_function
+from argparse import ArgumentParser
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import requests
+
+BASE_URL_DEFAULT = 'https://kbase.us/'
+USERNAME_DEFAULT = 'admin'
+APP_DEFAULT = 'search'
+PASSWORD_ENV = 'SPLUNKPW'
+
+PAGE_SIZE_DEFAULT = 50000
+WORKERS_DEFAULT = 4
+POLL_INTERVAL = 2
+
+#  Note: be careful with quota and special characters
+SEARCHES = {
+    # users who accessed the workspace by day
+    'users-by-day': 'search workspace | timechart span=1d count by user ' +
+                    'useother=f limit=1000',
+    # method calls by day
+    'methods-by-day': 'search INFO | eval ' +
+                      'method=servicemodule+":"+servicemethod|timechart ' +
+                      'span=1d count by method useother=f limit=2000',
+}
+
+CSV = 'csv'
+JSON = 'json'
+
+
+class SplunkError(Exception):
+    pass
+
+
+def _findtext(r, tag):
+    """The text of the first tag element of the XML response r, or None if
+    there is none or r is not XML."""
+    try:
+        return ET.fromstring(r.content).findtext(tag)
+    except ET.ParseError:
+        return None
+
+
+def _key(content, name):
+    m = re.search(r'name="{}">([^<]*)<'.format(name), content)
+    return m.group(1) if m else None
+
+
+class SplunkClient(object):
+
+    def __init__(self, base_url, username, password, app=APP_DEFAULT,
+                 workers=WORKERS_DEFAULT, page_size=PAGE_SIZE_DEFAULT,
+                 poll_interval=POLL_INTERVAL, verify=False):
+        self._base = base_url.rstrip('/')
+        self._user = username
+        self._password = password
+        self._app = app
+        self._workers = workers
+        self._page_size = page_size
+        self._poll = poll_interval
+        self._session = requests.Session()
+        self._session.verify = verify
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._logged_in = False
+
+    def _url(self, path, user=None):
+        return '{}/servicesNS/{}/{}/{}'.format(
+            self._base, user or self._user, self._app, path)
+
+    def _request(self, method, url, **kwargs):
+        if not self._logged_in:
+            self.login()
+        r = self._session.request(method, url, **kwargs)
+        if r.status_code >= 400:
+            raise SplunkError('{} {} failed with status {}: {}'.format(
+                method, url, r.status_code, r.text[:500]))
+        return r
+
+    def login(self):
+        r = self._session.post(self._url('auth/login', 'admin'),
+                               data={'username': self._user,
+                                     'password': self._password})
+        key = None
+        if r.status_code < 400:
+            key = _findtext(r, 'sessionKey')
+        if not key:
+            raise SplunkError('Login as {} failed: {}'.format(
+                self._user, r.text[:500]))
+        self._session.headers['Authorization'] = 'Splunk ' + key
+        self._logged_in = True
+
+    def create_job(self, search):
+        r = self._request('POST', self._url('search/jobs'),
+                          data={'search': search})
+        sid = _findtext(r, 'sid')
+        if not sid:
+            raise SplunkError('Unable to run search {}: {}'.format(
+                search, r.text[:500]))
+        return sid
+
+    def wait(self, sid):
+        """Polls the job until it is done and returns its result count."""
+        while True:
+            content = self._request('GET', self._url(
+                'search/jobs/' + sid)).text
+            if _key(content, 'isDone') == '1':
+                if _key(content, 'isFailed') == '1':
+                    raise SplunkError('Search {} failed'.format(sid))
+                return int(_key(content, 'resultCount') or 0)
+            prog = _key(content, 'doneProgress')
+            print('Search {} progress: {}'.format(
+                sid, '-' if prog is None else float(prog) * 100),
+                file=sys.stderr)
+            time.sleep(self._poll)
+
+    def _fetch_page(self, sid, offset, fmt, path):
+        r = self._request('GET', self._url('search/jobs/{}/results'.format(
+            sid)), params={'output_mode': fmt, 'offset': offset,
+                           'count': self._page_size}, stream=True)
+        try:
+            with open(path, 'wb') as f:
+                if fmt == JSON:
+                    results = json.loads(r.content.decode('utf-8'))
+                    for i, res in enumerate(results.get('results', [])):
+                        f.write(b',\n' if i or offset else b'\n')
+                        f.write(json.dumps(res, sort_keys=True).encode(
+                            'utf-8'))
+                    return
+                header = offset == 0
+                for chunk in r.iter_content(1 << 16):
+                    if not header:
+                        nl = chunk.find(b'\n')
+                        if nl < 0:
+                            continue
+                        chunk = chunk[nl + 1:]
+                        header = True
+                    f.write(chunk)
+        finally:
+            r.close()
+
+    def fetch(self, sid, path, fmt=CSV, count=None):
+        """Writes the results of a finished job to path. Pages are fetched in
+        parallel and joined in order."""
+        if count is None:
+            count = self.wait(sid)
+        # the first page is fetched even without results, for the CSV header
+        offsets = list(range(0, max(count, 1), self._page_size))
+        tmpdir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    if not offsets or errors:
+                        return
+                    offset = offsets.pop(0)
+                try:
+                    self._fetch_page(sid, offset, fmt,
+                                     os.path.join(tmpdir, str(offset)))
+                except Exception as e:
+                    with lock:
+                        errors.append(e)
+        try:
+            threads = [threading.Thread(target=worker)
+                       for _ in range(min(self._workers, len(offsets)))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            if errors:
+                raise errors[0]
+            with open(path + '.tmp', 'wb') as out:
+                if fmt == JSON:
+                    out.write(b'[')
+                for offset in range(0, max(count, 1), self._page_size):
+                    with open(os.path.join(tmpdir, str(offset)), 'rb') as f:
+                        shutil.copyfileobj(f, out)
+                if fmt == JSON:
+                    out.write(b'\n]\n')
+            os.rename(path + '.tmp', path)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        return count
+
+    def export(self, searches, fmt=CSV):
+        """Runs each search in the (search, path) list and writes its results
+        to path."""
+        jobs = []
+        for search, path in searches:
+            sid = self.create_job(search)
+            print('Search {} started for {}'.format(sid, path),
+                  file=sys.stderr)
+            jobs.append((sid, path))
+        for sid, path in jobs:
+            self.fetch_existing(sid, path, fmt)
+
+    def fetch_existing(self, sid, path, fmt=CSV):
+        t = time.time()
+        count = self.fetch(sid, path, fmt)
+        print('Wrote {} results of search {} to {} in {} s'.format(
+            count, sid, path, time.time() - t), file=sys.stderr)
+
+
+def _parseArgs():
+    parser = ArgumentParser(description='Export Splunk search results')
+    parser.add_argument('exports', nargs='+', metavar='NAME=FILE',
+                        help='write the results of a search to a file. ' +
+                        'NAME is one of ' + ', '.join(sorted(SEARCHES)) +
+                        ', or the id of an existing search job with --sid.')
+    parser.add_argument('-o', '--output-dir', default='.',
+                        help='directory relative file names are written to.')
+    parser.add_argument('--sid', action='store_true',
+                        help='names are ids of existing search jobs.')
+    parser.add_argument('-f', '--format', choices=[CSV, JSON], default=CSV)
+    parser.add_argument('-u', '--url', default=BASE_URL_DEFAULT,
+                        help='Splunk base url. Default %(default)s')
+    parser.add_argument('--user', default=USERNAME_DEFAULT)
+    parser.add_argument('-p', '--page-size', type=int,
+                        default=PAGE_SIZE_DEFAULT,
+                        help='results per page. Default %(default)s')
+    parser.add_argument('-w', '--workers', type=int, default=WORKERS_DEFAULT,
+                        help='pages fetched at once. Default %(default)s')
+    parser.add_argument('--poll', type=float, default=POLL_INTERVAL,
+                        help='seconds between job status checks.')
+    return parser.parse_args()
+
+
+def main():
+    args = _parseArgs()
+    password = os.environ.get(PASSWORD_ENV)
+    if password is None:
+        print('Set the Splunk password in ' + PASSWORD_ENV)
+        sys.exit(1)
+    exports = []
+    for e in args.exports:
+        name, sep, path = e.partition('=')
+        if not sep or not path:
+            print('Exports must be given as NAME=FILE: ' + e)
+            sys.exit(1)
+        if not args.sid and name not in SEARCHES:
+            print('Unknown search ' + name)
+            sys.exit(1)
+        exports.append((name, os.path.join(args.output_dir, path)))
+    starttime = time.time()
+    client = SplunkClient(args.url, args.user, password,
+                          workers=args.workers, page_size=args.page_size,
+                          poll_interval=args.poll)
+    if args.sid:
+        for sid, path in exports:
+            client.fetch_existing(sid, path, args.format)
+    else:
+        client.export([(SEARCHES[n], p) for n, p in exports], args.format)
+    print('Elapsed time: ' + str(time.time() - starttime), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+'''
+Load aware pacing for the collectors' Mongo scans, so they can run against
+the secondary during the day.
+
+The throttle samples the source server every few seconds:
+
+    globalLock.currentQueue.total from serverStatus - operations waiting on
+        locks
+    opcounters from serverStatus - operations per second, all clients
+    replSetGetStatus - how far the member is behind the primary
+
+and also watches the collector's own query wait per record, compared to the
+fastest rate seen so far in the run. Each signal is divided by its budget and
+the largest ratio is the load. Over budget, the pause between batches is
+doubled (up to max delay) and the batch size halved; under budget the pause
+is halved and the batch size grown back. At twice the budget the collector
+pauses, sampling the server until the load is back under budget, then
+resumes where it left off.
+
+A paused cursor is closed by the server after 10 minutes idle, so a single
+pause is capped at MAX_PAUSE_DEFAULT seconds, after which the collector
+carries on at the max delay.
+
+Usage:
+
+    t = throttle.from_args(args, db)
+    for rec in t.paced(cursor):
+        ...
+
+or, when the collector controls its own batches:
+
+    size = t.batch_size(LIMIT)
+    ... query and process size records ...
+    t.batch_done(query_wait_seconds, records)
+    t.wait()
+'''
+
+from __future__ import print_function
+import sys
+import time
+
+from pymongo.errors import OperationFailure
+
+import instrument
+import replicas
+
+MAX_QUEUE_DEFAULT = 10
+MAX_OPS_DEFAULT = 0
+MAX_LAG_DEFAULT = 30
+MAX_SLOWDOWN_DEFAULT = 3.0
+MAX_DELAY_DEFAULT = 30.0
+MAX_PAUSE_DEFAULT = 300.0
+SAMPLE_INTERVAL_DEFAULT = 10.0
+
+PAUSE_LOAD = 2.0
+MIN_DELAY = 0.05
+MIN_BATCH_FRACTION = 0.05
+PACED_BATCH = 1000
+
+
+class Throttle(object):
+    """Paces a scan of db to keep the load under budget. A budget of 0 or
+    None turns that signal off. With enabled False every call returns
+    immediately."""
+
+    def __init__(self, db, max_queue=MAX_QUEUE_DEFAULT,
+                 max_ops=MAX_OPS_DEFAULT, max_lag=MAX_LAG_DEFAULT,
+                 max_slowdown=MAX_SLOWDOWN_DEFAULT,
+                 max_delay=MAX_DELAY_DEFAULT, max_pause=MAX_PAUSE_DEFAULT,
+                 sample_interval=SAMPLE_INTERVAL_DEFAULT, enabled=True):
+        self.db = db
+        self.enabled = enabled
+        self.max_queue = max_queue
+        self.max_ops = max_ops
+        self.max_lag = max_lag
+        self.max_slowdown = max_slowdown
+        self.max_delay = max_delay
+        self.max_pause = max_pause
+        self.sample_interval = sample_interval
+        self.delay = 0.0
+        self.fraction = 1.0
+        self.load = 0.0
+        self.signals = {}
+        self._last_sample = None
+        self._last_ops = None
+        self._server_status = True
+        self._repl_status = True
+        self._fastest = None
+        self._latency = None
+
+    def _sample_server(self):
+        """Returns the server signals as load ratios, dropping any the
+        server won't report."""
+        ratios = {}
+        now = time.time()
+        if self._server_status:
+            try:
+                status = self.db.command('serverStatus')
+            except OperationFailure as e:
+                print('Throttle: serverStatus not available, ignoring ' +
+                      'server load: ' + str(e))
+                self._server_status = False
+            else:
+                queue = status['globalLock']['currentQueue']['total']
+                if self.max_queue:
+                    ratios['queue'] = float(queue) / self.max_queue
+                ops = sum(v for v in status['opcounters'].values())
+                if self.max_ops and self._last_ops:
+                    t, last = self._last_ops
+                    if now > t:
+                        ratios['ops'] = ((ops - last) / (now - t) /
+                                         self.max_ops)
+                self._last_ops = (now, ops)
+        if self._repl_status and self.max_lag:
+            lag = self._replication_lag()
+            if lag is not None:
+                ratios['lag'] = lag / self.max_lag
+        self._last_sample = now
+        return ratios
+
+    def _replication_lag(self):
+        try:
+            client = getattr(self.db, 'client', None) or self.db.connection
+            status = client.admin.command('replSetGetStatus')
+        except OperationFailure:
+            # not a replica set member, or not allowed to ask
+            self._repl_status = False
+            return None
+        return replicas.replication_lag(status)
+
+    def batch_done(self, seconds, records):
+        """Records the query wait for a batch of records."""
+        if not self.enabled or not records:
+            return
+        per_record = float(seconds) / records
+        if self._fastest is None or per_record < self._fastest:
+            self._fastest = per_record
+        self._latency = per_record
+
+    def _update(self):
+        if (self._last_sample is None or
+                time.time() - self._last_sample >= self.sample_interval):
+            self.signals = self._sample_server()
+        if self.max_slowdown and self._latency and self._fastest:
+            self.signals['latency'] = (self._latency / self._fastest /
+                                       self.max_slowdown)
+        self.load = max(self.signals.values()) if self.signals else 0.0
+        instrument.set_state('throttle_load', self.load)
+        return self.load
+
+    def wait(self):
+        """Called between batches. Sleeps for the current delay, or pauses
+        while the server is well over budget, and adjusts the delay and batch
+        size to the load."""
+        if not self.enabled:
+            return
+        load = self._update()
+        if load >= PAUSE_LOAD:
+            self._pause()
+            load = self.load
+        if load > 1:
+            self.delay = min(self.max_delay, max(MIN_DELAY, self.delay * 2))
+            self.fraction = max(MIN_BATCH_FRACTION, self.fraction / 2)
+        else:
+            self.delay = self.delay / 2 if self.delay > MIN_DELAY else 0.0
+            self.fraction = min(1.0, self.fraction * 2)
+        instrument.set_state('throttle_delay', self.delay)
+        instrument.set_state('throttle_batch_fraction', self.fraction)
+        if self.delay:
+            self._sleep(self.delay)
+
+    def _pause(self):
+        print('Throttle: pausing at load {:.2f} ({}) at {}'.format(
+            self.load, self._describe(), time.strftime('%H:%M:%S')))
+        sys.stdout.flush()
+        instrument.count('throttle_pauses')
+        instrument.set_state('throttle_paused', 1)
+        start = time.time()
+        # the latency signal can't change while nothing is being read
+        self._latency = None
+        while time.time() - start < self.max_pause:
+            self._sleep(self.sample_interval)
+            self._last_sample = None
+            if self._update() <= 1:
+                break
+        else:
+            print('Throttle: paused for {} s, resuming at the max delay'
+                  .format(self.max_pause))
+            self.delay = self.max_delay
+        instrument.set_state('throttle_paused', 0)
+        print('Throttle: resuming at load {:.2f} after {:.0f} s'.format(
+            self.load, time.time() - start))
+        sys.stdout.flush()
+
+    def _describe(self):
+        return ', '.join('{} {:.2f}'.format(k, v)
+                         for k, v in sorted(self.signals.items()))
+
+    def _sleep(self, seconds):
+        with instrument.timer('throttle'):
+            time.sleep(seconds)
+
+    def batch_size(self, size):
+        """Scales a batch size to the load."""
+        if not self.enabled:
+            return size
+        return max(1, int(size * self.fraction))
+
+    def paced(self, iterable, batch=PACED_BATCH):
+        """Iterates, calling batch_done and wait every batch items. The time
+        spent in wait is not part of the recorded query wait."""
+        if not self.enabled:
+            for item in iterable:
+                yield item
+            return
+        it = iter(iterable)
+        n = 0
+        waited = 0.0
+        while True:
+            start = time.time()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            waited += time.time() - start
+            n += 1
+            yield item
+            if n >= self.batch_size(batch):
+                self.batch_done(waited, n)
+                self.wait()
+                n = 0
+                waited = 0.0
+
+
+def add_arguments(parser):
+    parser.add_argument('--throttle', action='store_true',
+                        help='pace the scan to keep the source server ' +
+                        'under the load budget set by the --max-* options.')
+    parser.add_argument('--max-queue', type=int, default=MAX_QUEUE_DEFAULT,
+                        help='operations queued on the server lock. ' +
+                        'Default %(default)s, 0 to ignore.')
+    parser.add_argument('--max-ops', type=float, default=MAX_OPS_DEFAULT,
+                        help='server operations per second, all clients. ' +
+                        'Default %(default)s, 0 to ignore.')
+    parser.add_argument('--max-lag', type=float, default=MAX_LAG_DEFAULT,
+                        help='seconds the member may fall behind the ' +
+                        'primary. Default %(default)s, 0 to ignore.')
+    parser.add_argument('--max-slowdown', type=float,
+                        default=MAX_SLOWDOWN_DEFAULT,
+                        help='query wait per record relative to the ' +
+                        'fastest seen this run. Default %(default)s, 0 to ' +
+                        'ignore.')
+    parser.add_argument('--max-delay', type=float, default=MAX_DELAY_DEFAULT,
+                        help='longest pause between batches in seconds. ' +
+                        'Default %(default)s.')
+
+
+def from_args(args, db):
+    return Throttle(db, args.max_queue, args.max_ops, args.max_lag,
+                    args.max_slowdown, args.max_delay,
+                    enabled=args.throttle)
@@ -0,0 +1,145 @@
+'''
+Time buckets for the collectors' by month series, at day, week or month
+granularity, and the ObjectId ranges that limit a scan to a date window.
+
+Buckets are labelled YYYYMMDD (day), YYYYWnn (ISO week) or YYYYMM (month)
+so that labels sort in time order. As with the original month buckets, a
+record's bucket is the local date of the creation time in its ObjectId, and
+--since and --until are local dates.
+'''
+
+import datetime
+import time
+
+from bson.objectid import ObjectId
+
+GRANULARITIES = ('day', 'week', 'month')
+GRANULARITY_DEFAULT = 'month'
+
+CUMULATIVE = 'cumulative_'
+
+
+def parse_date(s):
+    return datetime.datetime.strptime(s, '%Y-%m-%d').date()
+
+
+def parse_until(s):
+    """parse_date, but no later than tomorrow, so that a window reaching
+    into the future ends with today's bucket."""
+    return min(parse_date(s),
+               datetime.date.today() + datetime.timedelta(days=1))
+
+
+def object_id(d):
+    """The lowest ObjectId created at or after local midnight of date d."""
+    ts = time.mktime(d.timetuple())
+    return ObjectId.from_datetime(datetime.datetime.utcfromtimestamp(ts))
+
+
+def id_range(since=None, until=None):
+    """An _id query for records created on or after since and before until,
+    or None if neither is given."""
+    r = {}
+    if since:
+        r['$gte'] = object_id(since)
+    if until:
+        r['$lt'] = object_id(until)
+    return r or None
+
+
+def label(d, granularity):
+    if granularity == 'day':
+        return d.strftime('%Y%m%d')
+    if granularity == 'week':
+        return '%04dW%02d' % d.isocalendar()[:2]
+    return d.strftime('%Y%m')
+
+
+def id_date(oid):
+    """The local date the record with ObjectId oid was created on."""
+    return datetime.date.fromtimestamp(int(str(oid)[0:8], 16))
+
+
+def id_label(oid, granularity):
+    """The bucket of the record with ObjectId oid."""
+    return label(id_date(oid), granularity)
+
+
+def label_date(lbl, granularity):
+    """The first day of bucket lbl."""
+    if granularity == 'day':
+        return datetime.datetime.strptime(lbl, '%Y%m%d').date()
+    if granularity == 'week':
+        year, week = lbl.split('W')
+        jan4 = datetime.date(int(year), 1, 4)
+        return (jan4 - datetime.timedelta(days=jan4.weekday()) +
+                datetime.timedelta(weeks=int(week) - 1))
+    return datetime.datetime.strptime(lbl, '%Y%m').date()
+
+
+def labels(keys, granularity, since=None, until=None):
+    """Returns every bucket label, in order, from since (or the earliest of
+    keys) up to until (or the latest of keys), so that buckets with no
+    records are part of the series."""
+    keys = [k for k in keys if not k.startswith(CUMULATIVE)]
+    first = since or (label_date(min(keys), granularity) if keys else None)
+    if until:
+        last = until - datetime.timedelta(days=1)
+    else:
+        last = label_date(max(keys), granularity) if keys else None
+    if not first or not last:
+        return []
+    out = []
+    d = first
+    while d <= last:
+        lbl = label(d, granularity)
+        if not out or out[-1] != lbl:
+            out.append(lbl)
+        d += datetime.timedelta(days=1)
+    return out
+
+
+def add_cumulative(series, lbls):
+    """For each bucket in series (label -> key -> nested counts) adds
+    cumulative_<key> with the counts summed over that and all earlier
+    buckets in lbls."""
+    running = {}
+    for lbl in lbls:
+        bucket = series[lbl]
+        for key in [k for k in bucket if not k.startswith(CUMULATIVE)]:
+            _add(running.setdefault(key, {}), bucket[key])
+        for key, counts in running.items():
+            bucket[CUMULATIVE + key] = _copy(counts)
+
+
+def _add(total, counts):
+    for k, v in counts.items():
+        if isinstance(v, dict):
+            _add(total.setdefault(k, {}), v)
+        else:
+            total[k] = total.get(k, 0) + v
+
+
+def _copy(counts):
+    return dict((k, _copy(v) if isinstance(v, dict) else v)
+                for k, v in counts.items())
+
+
+def add_arguments(parser):
+    parser.add_argument('--since', type=parse_date, metavar='YYYY-MM-DD',
+                        help='only count records created on or after this ' +
+                        'date. Cumulative figures then start from this date.')
+    parser.add_argument('--until', type=parse_until, metavar='YYYY-MM-DD',
+                        help='only count records created before this date. ' +
+                        'Later than tomorrow counts as tomorrow.')
+    parser.add_argument('--granularity', choices=GRANULARITIES,
+                        default=GRANULARITY_DEFAULT,
+                        help='size of the time buckets of the by month ' +
+                        'series. Default %(default)s.')
+
+
+def meta(args):
+    """Describes the series for the output metadata."""
+    return {'granularity': args.granularity,
+            'since': args.since.isoformat() if args.since else None,
+            'until': args.until.isoformat() if args.until else None}
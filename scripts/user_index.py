@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+'''
+Builds a per user index of the collectors' outputs and answers questions
+about single users or the top users by a figure from it.
+
+The per user figures are spread over user_data.json (workspace_statistics.py),
+shock_data.json (calculate_shock_disk_usage.py), awe_user_data.json
+(calculate_awe_usage.py) and the narrative log SQLite file written by
+kb-log-dump, each in its own shape. They are joined on user name into one
+row per user of a SQLite file, together with the staff flag from
+kbase-staff.lst:
+
+    user, staff, bytes (workspace + Shock), ws_objects, ws_bytes,
+    shock_nodes, shock_bytes, awe_jobs, awe_seconds, narrative_opens,
+    method_calls, method_seconds
+
+The user name is the primary key, and every figure has an index so the top N
+users by it are read straight off the index.
+
+The index is updated in place. The digest of each source file is kept with
+the index, and only sources that changed since the last run are read again:
+their columns are zeroed and refilled, in one transaction per source. Users
+left with nothing but zeros are removed.
+
+    user_index.py --workspace user_data.json --shock shock_data.json
+    user_index.py --user alice --user bob
+    user_index.py --top 10 --by shock_bytes
+'''
+
+from __future__ import print_function
+from argparse import ArgumentParser
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from json_stream import iter_object_items, open_json
+from pipeline import file_digest
+
+INDEX_DEFAULT = 'user_index.sqlite'
+NARRATIVE_TABLE_DEFAULT = 'narrative'
+TOP_BY_DEFAULT = 'bytes'
+BATCH = 10000
+MMAP_BYTES = 256 * 1024 * 1024
+
+# source -> the columns it fills
+SOURCES = [('workspace', ['ws_objects', 'ws_bytes']),
+           ('shock', ['shock_nodes', 'shock_bytes']),
+           ('awe', ['awe_jobs', 'awe_seconds']),
+           ('narrative', ['narrative_opens', 'method_calls',
+                          'method_seconds']),
+           ('staff', ['staff'])]
+TOTAL_BYTES = 'bytes'
+COLUMNS = ([TOTAL_BYTES] +
+           [c for _, cols in SOURCES for c in cols if c != 'staff'])
+
+# collector output fields
+PUBLIC = 'pub'
+PRIVATE = 'priv'
+DELETED = 'del'
+NOT_DEL = 'std'
+OBJ_CNT = 'cnt'
+BYTES = 'byte'
+SECONDS = 'seconds'
+BY_USER = 'by_user'
+WS_PATHS = [(PUBLIC, DELETED), (PUBLIC, NOT_DEL), (PRIVATE, DELETED),
+            (PRIVATE, NOT_DEL)]
+
+
+def _parseArgs():
+    parser = ArgumentParser(description='Build and query the per user ' +
+                            'usage index')
+    parser.add_argument('-i', '--index', default=INDEX_DEFAULT,
+                        help='path to the index file. Default %(default)s.')
+    parser.add_argument('--workspace',
+                        help='user_data.json from workspace_statistics.py.')
+    parser.add_argument('--shock',
+                        help='shock_data.json from ' +
+                        'calculate_shock_disk_usage.py.')
+    parser.add_argument('--awe',
+                        help='awe_user_data.json from calculate_awe_usage.py.')
+    parser.add_argument('--narrative-db',
+                        help='SQLite file written by kb-log-dump -f.')
+    parser.add_argument('--narrative-table', default=NARRATIVE_TABLE_DEFAULT,
+                        help='table in the narrative log file. Default ' +
+                        '%(default)s.')
+    parser.add_argument('-s', '--staff',
+                        help='path to the KBase staff list.')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='read the given sources even if unchanged.')
+    parser.add_argument('-u', '--user', action='append',
+                        help='print the index row of this user. May be ' +
+                        'repeated.')
+    parser.add_argument('-n', '--top', type=int,
+                        help='print the top this many users.')
+    parser.add_argument('-b', '--by', choices=COLUMNS, default=TOP_BY_DEFAULT,
+                        help='figure to rank users by for --top. Default ' +
+                        '%(default)s.')
+    return parser.parse_args()
+
+
+def open_index(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    # read the index through a memory map rather than read calls
+    conn.execute('PRAGMA mmap_size = {}'.format(MMAP_BYTES))
+    conn.execute('CREATE TABLE IF NOT EXISTS users (user TEXT PRIMARY KEY, ' +
+                 'staff INTEGER DEFAULT 0, ' +
+                 ', '.join(c + ' INTEGER DEFAULT 0' for c in COLUMNS) + ')')
+    for c in COLUMNS:
+        conn.execute('CREATE INDEX IF NOT EXISTS users_{0} ON users ({0})'
+                     .format(c))
+    conn.execute('CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY ' +
+                 'KEY, signature TEXT, path TEXT, updated TEXT)')
+    conn.commit()
+    return conn
+
+
+def _sum(d, *paths):
+    total = 0
+    for path in paths:
+        v = d
+        for k in path:
+            v = v.get(k, {})
+        total += v or 0
+    return total
+
+
+def workspace_rows(path):
+    with open_json(path) as f:
+        for user, d in iter_object_items(f):
+            yield user, {'ws_objects': _sum(d, *[p + (OBJ_CNT,)
+                                                 for p in WS_PATHS]),
+                         'ws_bytes': _sum(d, *[p + (BYTES,)
+                                               for p in WS_PATHS])}
+
+
+def shock_rows(path):
+    with open_json(path) as f:
+        for user, d in iter_object_items(f, (BY_USER,)):
+            yield user, {'shock_nodes': _sum(d, (PUBLIC, OBJ_CNT),
+                                             (PRIVATE, OBJ_CNT)),
+                         'shock_bytes': _sum(d, (PUBLIC, BYTES),
+                                             (PRIVATE, BYTES))}
+
+
+def awe_rows(path):
+    with open_json(path) as f:
+        for user, d in iter_object_items(f):
+            yield user, {'awe_jobs': _sum(d, (PUBLIC, OBJ_CNT),
+                                          (PRIVATE, OBJ_CNT)),
+                         'awe_seconds': int(_sum(d, (PUBLIC, SECONDS),
+                                                 (PRIVATE, SECONDS)))}
+
+
+def narrative_rows(path, table):
+    conn = sqlite3.connect(path)
+    try:
+        for user, opens, calls, seconds in conn.execute(
+                "SELECT user, SUM(event = 'O'), SUM(event = 'F'), " +
+                "SUM(CASE WHEN event = 'F' THEN dur ELSE 0 END) " +
+                'FROM {} GROUP BY user'.format(table)):
+            yield user, {'narrative_opens': opens, 'method_calls': calls,
+                         'method_seconds': int(seconds or 0)}
+    finally:
+        conn.close()
+
+
+def staff_rows(path):
+    with open(path) as f:
+        for line in f:
+            name = line.strip()
+            if name:
+                yield name, {'staff': 1}
+
+
+def update_source(conn, source, columns, path, rows, signature, force=False):
+    """Replaces the columns of source with rows of (user, {column: value})
+    unless signature matches the last update. Returns True if updated."""
+    old = conn.execute('SELECT signature FROM sources WHERE name = ?',
+                       (source,)).fetchone()
+    if not force and old and old[0] == signature:
+        print('{} unchanged'.format(source))
+        return False
+    start = time.time()
+    conn.execute('UPDATE users SET ' + ', '.join(c + ' = 0' for c in columns))
+    insert = 'INSERT OR IGNORE INTO users (user) VALUES (?)'
+    update = 'UPDATE users SET {} WHERE user = ?'.format(
+        ', '.join(c + ' = ?' for c in columns))
+    count = 0
+    batch = []
+    for user, values in rows:
+        batch.append([values[c] for c in columns] + [user])
+        if len(batch) >= BATCH:
+            count += _write_batch(conn, insert, update, batch)
+            batch = []
+    count += _write_batch(conn, insert, update, batch)
+    conn.execute('UPDATE users SET {} = ws_bytes + shock_bytes'.format(
+        TOTAL_BYTES))
+    conn.execute('DELETE FROM users WHERE staff = 0 AND ' +
+                 ' AND '.join(c + ' = 0' for c in COLUMNS))
+    conn.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)',
+                 (source, signature, os.path.abspath(path),
+                  time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())))
+    conn.commit()
+    print('{} updated, {} users in {:.1f} s'.format(
+        source, count, time.time() - start))
+    return True
+
+
+def _write_batch(conn, insert, update, batch):
+    conn.executemany(insert, ([b[-1]] for b in batch))
+    conn.executemany(update, batch)
+    return len(batch)
+
+
+def update_index(conn, args):
+    """Updates the index from the sources given on the command line."""
+    sources = {'workspace': (args.workspace, workspace_rows),
+               'shock': (args.shock, shock_rows),
+               'awe': (args.awe, awe_rows),
+               'narrative': (args.narrative_db, lambda path: narrative_rows(
+                   path, args.narrative_table)),
+               'staff': (args.staff, staff_rows)}
+    for source, columns in SOURCES:
+        path, rows = sources[source]
+        if not path:
+            continue
+        if not os.access(path, os.R_OK):
+            print('Cannot read file ' + path)
+            sys.exit(1)
+        signature = file_digest(path)
+        if source == 'narrative':
+            signature += ':' + args.narrative_table
+        update_source(conn, source, columns, path, rows(path), signature,
+                      args.force)
+
+
+def lookup(conn, user):
+    """The index row of user as a dict, or None."""
+    row = conn.execute('SELECT * FROM users WHERE user = ?',
+                       (user,)).fetchone()
+    return dict(zip(row.keys(), row)) if row else None
+
+
+def top(conn, column, n):
+    """The index rows of the n users with the highest column."""
+    if column not in COLUMNS:
+        raise ValueError('Unknown column ' + column)
+    return [dict(zip(row.keys(), row)) for row in conn.execute(
+        'SELECT * FROM users ORDER BY {} DESC LIMIT ?'.format(column), (n,))]
+
+
+def main():
+    args = _parseArgs()
+    conn = open_index(args.index)
+    try:
+        update_index(conn, args)
+        for user in args.user or []:
+            print(json.dumps({user: lookup(conn, user)}, sort_keys=True))
+        if args.top:
+            print(json.dumps(top(conn, args.by, args.top), indent=2,
+                             sort_keys=True))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+
+'''
+Summarizes the Splunk users by day CSV (the users-by-day export of
+splunk_client.py) into the dashboard files:
+
+histogram.json - per user visit statistics and a histogram of # of days
+    using KBase (formerly user_visits_histogram.pl)
+users.json - new, returning and total external users by month (formerly
+    user_counts.pl)
+recent.json - users who accessed KBase on the most recent day (formerly
+    recent.pl)
+
+The CSV has one column per user and one row per day. It is parsed once into
+a day x user boolean activity matrix and all three summaries are computed
+from that matrix.
+'''
+
+from __future__ import print_function
+from argparse import ArgumentParser
+import csv
+import datetime
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+STAFF_FILE_DEFAULT = 'kbase-staff.lst'
+
+HISTOGRAM_FILE = 'histogram.json'
+USERS_FILE = 'users.json'
+RECENT_FILE = 'recent.json'
+
+# bogus splunk columns
+SKIP_COLUMNS = set(['-', 'NULL'])
+SPAN_COLUMN = '_span'
+
+N_BUCKETS = 6
+
+
+def _parseArgs():
+    parser = ArgumentParser(description='Summarize users by day from the ' +
+                            'Splunk visits CSV')
+    parser.add_argument('visits',
+                        help='path to the visits CSV. Use - for stdin.')
+    parser.add_argument('-o', '--output', required=True,
+                        help='write json output to this directory.')
+    parser.add_argument('-s', '--staff', default=STAFF_FILE_DEFAULT,
+                        help='path to the KBase staff list.')
+    parser.add_argument('-m', '--monthly-returns', action='store_true',
+                        help='only count a user as returning when seen in ' +
+                        'a later month than their first visit, rather than ' +
+                        'on a later day.')
+    return parser.parse_args()
+
+
+def load_staff(path):
+    with open(path) as f:
+        return set(line.rstrip('\n') for line in f)
+
+
+class Visits(object):
+    """The visits CSV as a day x user activity matrix.
+
+    times - the time column, one entry per row
+    days - the YYYY-MM-DD part of each time
+    users - the user column names
+    active - boolean array, active[i, j] is True if users[j] has a non zero
+        count on row i
+    """
+
+    def __init__(self, f):
+        reader = csv.reader(f)
+        header = next(reader)
+        self.users = [u.strip() for u in header[1:]]
+        n = len(self.users)
+        self.times = []
+        rows = []
+        for row in reader:
+            if not row:
+                continue
+            self.times.append(row[0].strip())
+            vals = [v or '0' for v in row[1:n + 1]]
+            vals.extend(['0'] * (n - len(vals)))
+            rows.append(np.array(vals, dtype=float) > 0)
+        if rows:
+            self.active = np.vstack(rows)
+        else:
+            self.active = np.zeros((0, n), dtype=bool)
+        self.days = [t.split('T')[0] for t in self.times]
+
+    def columns(self, keep):
+        """Returns the indexes of the user columns for which keep(user) is
+        true, skipping bogus splunk columns."""
+        return np.array([i for i, u in enumerate(self.users)
+                         if u not in SKIP_COLUMNS and SPAN_COLUMN not in u and
+                         keep(u)], dtype=int)
+
+
+def _date(day):
+    return datetime.datetime.strptime(day, '%Y-%m-%d').date()
+
+
+def _generated():
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())
+
+
+def histogram(visits, staff):
+    cols = visits.columns(lambda u: True)
+    names = [visits.users[i] for i in cols]
+    is_staff = np.array([u in staff for u in names], dtype=bool)
+    active = visits.active[:, cols]
+    nvisits = active.sum(axis=0)
+    seen = nvisits > 0
+    first = last = np.zeros(len(cols), dtype=int)
+    if len(visits.days):
+        first = active.argmax(axis=0)
+        last = len(visits.days) - 1 - active[::-1].argmax(axis=0)
+
+    by_user = {}
+    end_date = visits.days[-1] if visits.days else 0
+    for j, u in enumerate(names):
+        if not seen[j]:
+            if not is_staff[j]:
+                by_user[u] = {'staff': False}
+            continue
+        span = (_date(end_date) - _date(visits.days[first[j]])).days + 1
+        by_user[u] = {'staff': bool(is_staff[j]),
+                      'visits': int(nvisits[j]),
+                      'first': visits.days[first[j]],
+                      'last': visits.days[last[j]],
+                      'span': span,
+                      'visitation_rate': float(nvisits[j]) / span}
+
+    counts = {}
+    for key, mask in (('visitors_by_date_all', np.ones_like(is_staff)),
+                      ('visitors_by_date_ext', ~is_staff)):
+        per_day = active[:, mask].sum(axis=1)
+        nz = np.nonzero(per_day)[0]
+        if len(nz):
+            counts[key] = dict((visits.days[i], int(per_day[i])) for i in nz)
+    repeat = nvisits > 1
+    for key, mask in (('all', repeat), ('nonkbase', repeat & ~is_staff)):
+        if mask.any():
+            b = np.bincount(nvisits[mask])
+            counts[key] = dict((str(v), int(b[v])) for v in np.nonzero(b)[0])
+
+    return {'by_user': by_user,
+            'counts_by_visits': counts,
+            'histogram': visit_buckets(nvisits, is_staff),
+            'range': {'start': visits.days[0] if visits.days else 0,
+                      'end': end_date},
+            'meta': {'comments': 'Generated from a Splunk query and ' +
+                     'summarized by visits_summary',
+                     'author': 'Shane Canon',
+                     'generated_on': time.strftime('%Y-%m-%d', time.gmtime())}
+            }
+
+
+def visit_buckets(nvisits, is_staff):
+    """Groups users with 2 or more visits into about N_BUCKETS buckets of
+    similar size by their number of visits."""
+    repeat = nvisits > 1
+    if not repeat.any():
+        return None
+    all_ = np.bincount(nvisits[repeat])
+    ext = np.bincount(nvisits[repeat & ~is_staff], minlength=len(all_))
+    max_visits = len(all_) - 1
+    per_bucket = float(repeat.sum()) / N_BUCKETS
+    histo = []
+    tot = ext_tot = 0
+    start = None
+    for t in range(2, max_visits + 1):
+        if start is None:
+            start = t
+        if not all_[t]:
+            continue
+        tot += int(all_[t])
+        ext_tot += int(ext[t])
+        if tot > per_bucket or t == max_visits:
+            if start == t:
+                label = '{} visits'.format(t)
+            else:
+                label = '{} to {} visits'.format(start, t)
+            histo.append({'label': label,
+                          'range': {'start': start, 'end': t},
+                          'counts': {'all': tot, 'nonkbase': ext_tot}})
+            tot = ext_tot = 0
+            start = None
+    return histo
+
+
+def user_counts(visits, staff, monthly_returns=False):
+    cols = visits.columns(lambda u: u not in staff)
+    active = visits.active[:, cols]
+    months, row_month = np.unique([d[0:7] for d in visits.days],
+                                  return_inverse=True)
+    row_month = row_month.reshape(-1)
+    nmonths = len(months)
+    seen = active.any(axis=0)
+    returned = np.zeros(len(cols), dtype=bool)
+    first = ret_row = np.zeros(len(cols), dtype=int)
+    if len(visits.days):
+        first = active.argmax(axis=0)
+        if monthly_returns:
+            later = active & (row_month[:, None] != row_month[first][None, :])
+        else:
+            later = active & (np.cumsum(active, axis=0, dtype=np.int32) == 2)
+        returned = later.any(axis=0)
+        ret_row = later.argmax(axis=0)
+
+    new = np.bincount(row_month[first[seen]], minlength=nmonths)
+    ret = np.bincount(row_month[ret_row[returned]], minlength=nmonths)
+    if len(visits.days):
+        starts = np.r_[0, np.nonzero(np.diff(row_month))[0] + 1]
+        total = np.logical_or.reduceat(active, starts, axis=0).sum(axis=1)
+    else:
+        total = np.zeros(0, dtype=int)
+    cum_new = np.cumsum(new)
+    cum_ret = np.cumsum(ret)
+
+    by_month = []
+    for i, m in enumerate(months):
+        year, mon = m.split('-')
+        by_month.append({'year': int(year), 'month': int(mon),
+                         'cummulative_users': int(cum_new[i]),
+                         'cummulative_return_users': int(cum_ret[i]),
+                         'new_users': int(new[i]),
+                         'return_users': int(ret[i]),
+                         'total_users': int(total[i])})
+    cts = {'excludes_internal_kbase': True,
+           'return_user_window': '> 1 month' if monthly_returns else '> 1 day',
+           'by_month': by_month,
+           'cumulative_users': int(seen.sum()),
+           'cummulative_return_users': int(returned.sum()),
+           'meta': {'comments': 'Generated from a Splunk query and ' +
+                    'summarized by visits_summary',
+                    'author': 'Shane Canon',
+                    'generated': _generated(),
+                    'dataset': 'splunk-users-by-day',
+                    'description': 'Summary of users of KBase over time.  ' +
+                    'Excludes internal KBase users.'}}
+    if len(months):
+        cts['start'] = str(months[0])
+        cts['end'] = str(months[-1])
+    return cts
+
+
+def recent(visits, staff):
+    cols = visits.columns(lambda u: True)
+    users = []
+    if len(visits.times):
+        for j in cols[visits.active[-1, cols]]:
+            u = visits.users[j]
+            users.append({'userid': u, 'staff': u in staff})
+    return {'users': users,
+            'data': {'timerange': {
+                'below': visits.times[-1] if visits.times else None,
+                'from': visits.times[-2] if len(visits.times) > 1 else None}},
+            'meta': {'generated': _generated(),
+                     'dataset': 'kbase-daily-user-access',
+                     'description': 'List of users who accessed KBase ' +
+                     'services during the given time range.'}}
+
+
+def write_json(outdir, name, data):
+    path = os.path.join(outdir, name)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f, indent=4, sort_keys=True, separators=(',', ': '))
+    os.rename(path + '.tmp', path)
+
+
+def main():
+    args = _parseArgs()
+    starttime = time.time()
+    staff = load_staff(args.staff)
+    if args.visits == '-':
+        visits = Visits(sys.stdin)
+    else:
+        with open(args.visits) as f:
+            visits = Visits(f)
+    print('Read {} days x {} users in {} s'.format(
+        len(visits.days), len(visits.users), time.time() - starttime))
+    write_json(args.output, HISTOGRAM_FILE, histogram(visits, staff))
+    write_json(args.output, USERS_FILE,
+               user_counts(visits, staff, args.monthly_returns))
+    write_json(args.output, RECENT_FILE, recent(visits, staff))
+    print('Elapsed time: ' + str(time.time() - starttime))
+
+
+if __name__ == '__main__':
+    main()
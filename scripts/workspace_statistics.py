@@ -19,9 +19,62 @@ reasons:
 
 All versions are included in the counts and disk usage statistics.
 
-Don't run this during high loads - runs through every object in the DB
-Hasn't been optimized much either, could probably optimize by not querying
-ws by ws.
+With --sample, only a random sample of the windows of object ids is scanned,
+stratified by workspace size, and the per user and per month figures are
+estimated from it (see sampling.py). The estimates are written to
+user_data_sample.json and ws_bymonth_sample.json, under 'data', with the
+sample details under 'meta'.
+
+With --since and --until, only object versions created in that date window
+are counted. The window is scanned by _id (see timeseries.py) rather than
+workspace by workspace. --granularity sets the size of the ws_bymonth.json
+buckets.
+
+Every ws_bymonth.json bucket carries cumulative_pub and cumulative_priv
+totals, and the series has a bucket for every month (or day or week) from
+the first to the last, empty if nothing was saved in it. Both are new in
+the default full run as well; earlier versions of this script wrote only
+the buckets that had versions, without cumulative totals.
+
+Each ws_bymonth.json bucket also has the number of distinct users who saved
+versions in it, under savers, and in it or any earlier bucket, under
+cumulative_savers. These are estimated from a HyperLogLog sketch per day
+(see hll.py), which ws_savers_sketches.json holds for unioning into other
+buckets later.
+
+With --memory-budget, the per user and type figures and the object list are
+spilled to a temporary SQLite file (see spill.py) whenever their
+estimated size passes the budget, and are merged back from it while the
+output is written. It can't be used for a full run reading from several
+source members.
+
+Don't run this during high loads - runs through every object in the DB,
+unless run with --throttle to pace the scan to the load on the server.
+Objects are read in batches planned by batch_planner.py: windows of object
+ids sized to the throughput measured so far, or groups of small workspaces.
+
+If the source host setting lists several replica set members, e.g.
+host=mongo1,mongo2,mongo3, the workspaces are split into partitions that are
+read from all of the members at once (see replicas.py). Each member's reader
+plans and paces its own batches. --sample and --since / --until read from a
+single member.
+
+With --publish, the per user, workspace and time bucket summaries are also
+written to the TargetMongo database (see publish.py).
+
+With --shard-dir DIR, each output is also written as gzipped JSON shards
+under DIR/<output name> with a manifest (see shards.py): users by the first
+letters of their name, workspaces by those of their owner's, objects by the
+month they were saved, and the time buckets in a single shard. Only the
+shards whose content changed since the last run are written.
+
+With --checkpoint FILE, the scan position and the totals so far are saved
+every --checkpoint-interval seconds, and a run with --resume carries on from
+there after a crash (see checkpoint.py). The position is the workspaces
+already read and the last object id read in a workspace read part way, or
+with several members the partitions and which of them were read. A batch
+that fails with a lost connection or a timed out cursor is read again. Use a
+--spill-dir that survives a reboot when combining this with --memory-budget.
 '''
 
 # TODO: checks to see this is accurate
@@ -39,6 +92,19 @@ from argparse import ArgumentParser
 import json
 import errno
 
+import batch_planner
+import checkpoint
+import hll
+import instrument
+import json_stream
+import publish
+import replicas
+import sampling
+import shards
+import spill
+import throttle
+import timeseries
+
 # workspace metadata to include
 WS_META_INC = ['is_temporary', 'narrative', 'narrative_nice_name']
 OBJ_META_INC = ['methods', 'job_info']
@@ -63,6 +129,7 @@ USER_FILE = 'user_data.json'
 WS_FILE = 'ws_data.json'
 OBJECT_FILE = 'ws_object_list.json'
 BYMONTH_FILE = 'ws_bymonth.json'
+SAVERS_FILE = 'ws_savers_sketches.json'
 
 # collection names
 COL_WS = 'workspaces'
@@ -85,6 +152,7 @@ OBJ_TYPE = 'type'
 OBJ_SAVED_BY = 'savedby'
 OBJ_SAVE_DATE = 'savedate'
 OBJ_META = 'meta'
+VER_SIZE = 'size'
 
 # program fields
 PUBLIC = 'pub'
@@ -99,12 +167,18 @@ NAME = WS_NAME
 SHARED = 'shd'
 SHARED_WITH = 'shdwith'
 META = 'meta'
+SAVERS = 'savers'
 
 
-LIMIT = 10000
+LIMIT = 10000  # versions per batch to start from, see batch_planner.py
 OR_QUERY_SIZE = 100  # 75 was slower, 150 was slower
 MAX_WS = -1  # for testing, set to < 1 for all ws
 
+# rough memory used by an aggregate leaf (e.g. user -> pub -> del) and by an
+# object list entry, for --memory-budget
+AGG_LEAF_BYTES = 500
+OBJ_ENTRY_BYTES = 1000
+
 
 def _parseArgs():
     parser = ArgumentParser(description='Calculate workspace disk usage by ' +
@@ -119,6 +193,22 @@ def _parseArgs():
                         'does not exist it will be created.')
     parser.add_argument('--only-latest-ver', action='store_true',
                         help='only process the latest version of each object.')
+    instrument.add_arguments(parser)
+    throttle.add_arguments(parser)
+    replicas.add_arguments(parser)
+    timeseries.add_arguments(parser)
+    publish.add_arguments(parser)
+    shards.add_arguments(parser)
+    checkpoint.add_arguments(parser)
+    sampling.add_arguments(parser, 'windows of ' + str(LIMIT) +
+                           ' object ids')
+    parser.add_argument('--memory-budget', type=int, metavar='MB',
+                        help='spill the aggregates and object list to disk ' +
+                        'when they are estimated to take more than this ' +
+                        'many MB.')
+    parser.add_argument('--spill-dir',
+                        help='directory for the spill file. Defaults to ' +
+                        'the system temporary directory.')
     return parser.parse_args()
 
 
@@ -231,19 +321,22 @@ def convert_mongo_meta_to_dict(mongo_meta):
 
 
 # this might need to be batched at some point
-def process_workspaces(db):
+def process_workspaces(db, wsids=None):
     user = 'user'
     all_users = '*'
     acl_id = 'id'
     acl_perm = 'perm'
-    ws_cursor = db[COL_WS].find({}, [WS_ID, WS_OBJ_CNT, WS_OWNER, WS_DELETED,
-                                     NAME, WS_META])
+    query = {} if wsids is None else {WS_ID: {'$in': list(wsids)}}
+    ws_cursor = db[COL_WS].find(query, [WS_ID, WS_OBJ_CNT, WS_OWNER,
+                                        WS_DELETED, NAME, WS_META])
     workspaces = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
-    for ws in ws_cursor:
+    for ws in instrument.timed_iter(ws_cursor, 'query_wait'):
+        instrument.count('workspaces')
         # this could be faster via batching
         users = {}
         pub = PRIVATE
-        for aclrec in db[COL_ACLS].find({acl_id: ws[WS_ID]}):
+        for aclrec in instrument.timed_iter(
+                db[COL_ACLS].find({acl_id: ws[WS_ID]}), 'query_wait'):
             if aclrec[user] != ws[WS_OWNER] and aclrec[user] != all_users:
                 users[aclrec[user]] = aclrec[acl_perm]
             if aclrec[user] == all_users:
@@ -284,98 +377,476 @@ def update_object_list(objlist, obj, version):
         objlist[obj_kbid][META] = meta
 
 
+VERSION_FIELDS = [WS_ID, OBJ_ID, VER_SIZE, OBJ_TYPE, OBJ_VERSION,
+                  OBJ_SAVED_BY, OBJ_SAVE_DATE, OBJ_META]
+
+
+def new_state():
+    """Returns empty user, type and month aggregates, object list and
+    distinct saver sketches."""
+    # user -> pub -> del -> du or objs -> #
+    d = defaultdict(lambda: defaultdict(lambda: defaultdict(
+        lambda: defaultdict(int))))
+    # user -> type -> pub -> del -> du or objs -> #
+    types = defaultdict(lambda: defaultdict(lambda: defaultdict(
+        lambda: defaultdict(lambda: defaultdict(int)))))
+    # month (or day or week) -> pub -> del -> du or objs -> #
+    bymonth = defaultdict(lambda: defaultdict(lambda: defaultdict(
+        lambda: defaultdict(int))))
+    # objid -> obj
+    objlist = defaultdict(dict)
+    # day -> sketch of the users who saved versions
+    savers = defaultdict(hll.HyperLogLog)
+    return d, types, bymonth, objlist, savers
+
+
+def aggregate_version(userdata, typedata, bymonth, objlist, workspaces, o, v,
+                      incl_types, list_types, granularity, savers=None):
+    ws = v[WS_ID]
+    wsowner = workspaces[ws][OWNER]
+    wspub = workspaces[ws][PUBLIC]
+    size = v[VER_SIZE]
+    deleted = DELETED if o[DELETED] else NOT_DEL
+    userdata[wsowner][wspub][deleted][OBJ_CNT] += 1
+    userdata[wsowner][wspub][deleted][BYTES] += size
+    workspaces[ws][deleted][OBJ_CNT] += 1
+    workspaces[ws][deleted][BYTES] += size
+    t = v[OBJ_TYPE].split('-')[0]
+    month = timeseries.id_label(v['_id'], granularity)
+    bymonth[month][wspub][deleted][OBJ_CNT] += 1
+    bymonth[month][wspub][deleted][BYTES] += size
+    if savers is not None:
+        savers[timeseries.id_label(v['_id'], 'day')].add(v[OBJ_SAVED_BY])
+    if t in incl_types or '*' in incl_types:
+        typedata[wsowner][t][wspub][deleted][OBJ_CNT] += 1
+        typedata[wsowner][t][wspub][deleted][BYTES] += size
+    if t in list_types:
+        update_object_list(objlist, o, v)
+
+
+def batch_query(batch):
+    """The object and version query for a batch_planner.Batch."""
+    if batch.start is None:
+        return {WS_ID: {'$in': batch.workspaces}}
+    return {WS_ID: batch.workspaces[0],
+            OBJ_ID: {'$gt': batch.start, '$lte': batch.end}}
+
+
 # this method sig is way too big
 def process_object_versions(
         db, userdata, typedata, bymonth, objlist, objects, workspaces,
-        incl_types, list_types, start_id, end_id, only_latest_ver):
-    # note all objects are from the same workspace
-    size = 'size'
-
+        incl_types, list_types, query, only_latest_ver,
+        granularity=timeseries.GRANULARITY_DEFAULT, savers=None):
+    """Aggregates the versions matching query, which must select the same
+    objects as the query that returned objects. The objects may be from more
+    than one workspace. Returns the number of versions counted and the number
+    read."""
     id2obj = {}
     for o in objects:
-        id2obj[o[OBJ_ID]] = o
+        id2obj[(o[WS_ID], o[OBJ_ID])] = o
     if not id2obj:
-        return 0
-
-    ws = o[WS_ID]  # all objects in same ws
-    wsowner = workspaces[ws][OWNER]
-    wspub = workspaces[ws][PUBLIC]
+        return 0, 0
 
-    res = db[COL_VERS].find({WS_ID: ws,
-                             OBJ_ID: {'$gt': start_id, '$lte': end_id}},
-                            [WS_ID, OBJ_ID, size, OBJ_TYPE, OBJ_VERSION,
-                             OBJ_SAVED_BY, OBJ_SAVE_DATE, OBJ_META])
+    res = db[COL_VERS].find(query, VERSION_FIELDS)
     vers = 0
-    for v in res:
-        if v[OBJ_ID] not in id2obj:  # new object was made just now in ws
+    read = 0
+    for v in instrument.timed_iter(res, 'query_wait'):
+        instrument.count('versions_read')
+        read += 1
+        o = id2obj.get((v[WS_ID], v[OBJ_ID]))
+        if o is None:  # new object was made just now in ws
             continue
-        o = id2obj[v[OBJ_ID]]
         if only_latest_ver and v[OBJ_VERSION] != o[OBJ_NUMVER]:
             continue
         vers += 1
-        deleted = DELETED if o[DELETED] else NOT_DEL
-        userdata[wsowner][wspub][deleted][OBJ_CNT] += 1
-        userdata[wsowner][wspub][deleted][BYTES] += v[size]
-        workspaces[ws][deleted][OBJ_CNT] += 1
-        workspaces[ws][deleted][BYTES] += v[size]
-        t = v[OBJ_TYPE].split('-')[0]
-        o_str = str(v['_id'])
-        id_time = int(o_str[0:8], 16)
-        month = datetime.date.fromtimestamp(id_time).strftime('%Y%m')
-        bymonth[month][wspub][deleted][OBJ_CNT] += 1
-        bymonth[month][wspub][deleted][BYTES] += v[size]
-        if t in incl_types or '*' in incl_types:
-            typedata[wsowner][t][wspub][deleted][OBJ_CNT] += 1
-            typedata[wsowner][t][wspub][deleted][BYTES] += v[size]
-        if t in list_types:
-            update_object_list(objlist, o, v)
-    return vers
+        aggregate_version(userdata, typedata, bymonth, objlist, workspaces,
+                          o, v, incl_types, list_types, granularity, savers)
+    instrument.count('versions', vers)
+    return vers, read
+
+
+def process_time_window(db, workspaces, exclude_ws, incl_types, list_types,
+                        only_latest_ver, pacer, id_range, granularity,
+                        store=None, budget=None):
+    """Processes the versions whose _ids are in id_range, scanning them in
+    _id order so only the window is read, and looking up their objects
+    OR_QUERY_SIZE versions at a time."""
+    d, types, bymonth, objlist, savers = new_state()
+    res = db[COL_VERS].find({'_id': id_range}, VERSION_FIELDS)
+    batch = []
+    for v in pacer.paced(instrument.timed_iter(res, 'query_wait')):
+        instrument.count('versions_read')
+        if (v[WS_ID] not in workspaces or
+                (exclude_ws and v[WS_ID] in exclude_ws)):
+            continue
+        batch.append(v)
+        if len(batch) >= OR_QUERY_SIZE:
+            _process_version_batch(db, d, types, bymonth, objlist, batch,
+                                   workspaces, incl_types, list_types,
+                                   only_latest_ver, granularity, savers)
+            batch = []
+            if store and state_bytes(d, types, objlist) > budget:
+                with instrument.timer('spill'):
+                    spill_state(store, d, types, objlist)
+    _process_version_batch(db, d, types, bymonth, objlist, batch, workspaces,
+                           incl_types, list_types, only_latest_ver,
+                           granularity, savers)
+    return d, types, bymonth, objlist, savers
+
+
+def _process_version_batch(db, userdata, typedata, bymonth, objlist, batch,
+                           workspaces, incl_types, list_types,
+                           only_latest_ver, granularity, savers=None):
+    if not batch:
+        return
+    keys = set((v[WS_ID], v[OBJ_ID]) for v in batch)
+    objs = {}
+    with instrument.timer('object_lookup', excluding='query_wait'):
+        for o in instrument.timed_iter(db[COL_OBJ].find(
+                {'$or': [{WS_ID: ws, OBJ_ID: i} for ws, i in keys]},
+                [WS_ID, OBJ_ID, WS_DELETED, OBJ_NAME, OBJ_NUMVER]),
+                'query_wait'):
+            objs[(o[WS_ID], o[OBJ_ID])] = o
+    vers = 0
+    for v in batch:
+        o = objs.get((v[WS_ID], v[OBJ_ID]))
+        if o is None:  # new object was made just now
+            continue
+        if only_latest_ver and v[OBJ_VERSION] != o[OBJ_NUMVER]:
+            continue
+        vers += 1
+        aggregate_version(userdata, typedata, bymonth, objlist, workspaces,
+                          o, v, incl_types, list_types, granularity, savers)
+    instrument.count('versions', vers)
+
+
+def state_bytes(userdata, typedata, objlist):
+    leaves = (sum(len(p) for u in userdata.values() for p in u.values()) +
+              sum(len(p) for u in typedata.values() for t in u.values()
+                  for p in t.values()))
+    return leaves * AGG_LEAF_BYTES + len(objlist) * OBJ_ENTRY_BYTES
+
+
+def spill_state(store, userdata, typedata, objlist):
+    """Moves the user and type aggregates and object list to store. The
+    month aggregates have an entry per time bucket at most and stay in
+    memory."""
+    store.add_counts(('users',), userdata)
+    store.add_counts(('users',), dict((u, {TYPES: t})
+                                      for u, t in typedata.items()))
+    store.add_objects(objlist, OBJ_VERSION)
+    store.commit()
+    for state in (userdata, typedata, objlist):
+        state.clear()
+    instrument.count('spills')
+
+
+def process_batch(db, state, workspaces, batch, incl_types, list_types,
+                  only_latest_ver, granularity):
+    """Reads and aggregates one batch_planner.Batch into state, the tuple
+    returned by new_state(). Returns its timing for batch_done()."""
+    d, types, bymonth, objlist, savers = state
+    if batch.start is None:
+        print('\nProcessing {} small workspaces {} - {}, {} objects at {}'
+              .format(len(batch.workspaces), batch.workspaces[0],
+                      batch.workspaces[-1], batch.objects,
+                      datetime.datetime.now()))
+    else:
+        ws = batch.workspaces[0]
+        if batch.start == 0:
+            print('\nProcessing workspace {}, {} objects'.format(
+                ws, workspaces[ws][WS_OBJ_CNT]))
+        print('\tProcessing objects {} - {} at {}'.format(
+            batch.start + 1, batch.end, datetime.datetime.now()))
+        instrument.set_state('window_start', batch.start)
+    sys.stdout.flush()
+    instrument.set_state('workspace', batch.workspaces[-1])
+    wait = instrument.seconds('query_wait')
+    aggtime = instrument.seconds('aggregation')
+    query = batch_query(batch)
+    objs = db[COL_OBJ].find(query, [WS_ID, OBJ_ID, WS_DELETED,
+                                    OBJ_NAME, OBJ_NUMVER])
+    with instrument.timer('aggregation', excluding='query_wait'):
+        vers, read = process_object_versions(
+            db, d, types, bymonth, objlist,
+            instrument.timed_iter(objs, 'query_wait'), workspaces,
+            incl_types, list_types, query, only_latest_ver, granularity,
+            savers)
+    wait = instrument.seconds('query_wait') - wait
+    aggtime = instrument.seconds('aggregation') - aggtime
+    print(('\ttotal object versions: {}, query wait {} s, ' +
+           'aggregation {} s').format(vers, wait, aggtime))
+    sys.stdout.flush()
+    return read, wait, aggtime
+
+
+def batch_done(planner, pacer, batch, timing):
+    """Reports the timing of a batch that was read completely to planner
+    and pacer, and waits as long as pacer asks."""
+    read, wait, aggtime = timing
+    planner.done(batch, read, wait + aggtime)
+    pacer.batch_done(wait, read)
+    pacer.wait()
+
+
+def _local_workspaces(workspaces, wsids):
+    """Copies the owner, permission and object count of workspaces wsids,
+    so that a batch or partition counts per workspace into a copy of its
+    own. It can then be read again from zero after a failure, and never
+    touches shared state."""
+    local = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    for ws in wsids:
+        for key in (OWNER, PUBLIC, WS_OBJ_CNT):
+            local[ws][key] = workspaces[ws][key]
+    return local
+
+
+def _workspace_counts(workspaces):
+    counts = {}
+    for ws, w in workspaces.items():
+        c = dict((key, w[key]) for key in (DELETED, NOT_DEL) if key in w)
+        if c:
+            counts[ws] = c
+    return counts
+
+
+def merge_state(state, workspaces, part, counts):
+    """Adds the state and per workspace counts of a batch or partition, or
+    a checkpoint, to the totals."""
+    for into, c in zip(state[:3], part[:3]):
+        replicas.merge_counts(into, c)
+    # batches and partitions hold different objects, so no object is in two
+    state[3].update(part[3])
+    hll.merge_all(state[4], part[4])
+    for ws, c in counts.items():
+        if ws in workspaces:
+            replicas.merge_counts(workspaces[ws], c)
+
+
+def save_checkpoint(ckpt, state, workspaces, store, **position):
+    ckpt.save(dict(position, state=checkpoint.plain(state),
+                   workspaces=checkpoint.plain(_workspace_counts(workspaces)),
+                   spill=store.mark() if store else None))
+
+
+def read_batch(db, workspaces, batch, incl_types, list_types,
+               only_latest_ver, granularity, planner, pacer):
+    """Reads a batch into new state, retrying after transient errors, and
+    returns the state and per workspace counts. Only the read that
+    succeeds is reported to planner and pacer."""
+    def read():
+        local = _local_workspaces(workspaces, batch.workspaces)
+        part = new_state()
+        timing = process_batch(db, part, local, batch, incl_types,
+                               list_types, only_latest_ver, granularity)
+        return part, _workspace_counts(local), timing
+    part, counts, timing = checkpoint.retry(
+        read, 'Workspaces {} - {}'.format(batch.workspaces[0],
+                                          batch.workspaces[-1]))
+    batch_done(planner, pacer, batch, timing)
+    return part, counts
 
 
 def process_objects(db, workspaces, exclude_ws, incl_types, list_types,
-                    only_latest_ver):
-
-    # user -> pub -> del -> du or objs -> #
-    d = defaultdict(lambda: defaultdict(lambda: defaultdict(
-        lambda: defaultdict(int))))
-    # user -> type -> pub -> del -> du or objs -> #
-    types = defaultdict(lambda: defaultdict(lambda: defaultdict(
-        lambda: defaultdict(lambda: defaultdict(int)))))
-    # month -> pub -> del -> du or objs -> #
-    bymonth = defaultdict(lambda: defaultdict(lambda: defaultdict(
-        lambda: defaultdict(int))))
-    # objid -> obj
-    objlist = defaultdict(dict)
+                    only_latest_ver, pacer, store=None, budget=None,
+                    granularity=timeseries.GRANULARITY_DEFAULT, ckpt=None,
+                    resume=None):
+    """Scans the objects batch by batch. The checkpoint position is the
+    workspaces read completely and, for the one read part way, the last
+    object id read."""
+    state = new_state()
+    done = set()
+    partial = {}
+    if resume:
+        merge_state(state, workspaces, resume['state'],
+                    resume['workspaces'])
+        done = set(resume['done'])
+        partial = resume['partial']
+    planner = batch_planner.BatchPlanner(LIMIT, scale=pacer.batch_size)
+    instrument.set_state('workspaces_total', len(workspaces))
+    for batch in planner.plan(
+            ((ws, n) for ws, n in _workspaces_to_process(workspaces,
+                                                         exclude_ws)
+             if ws not in done), partial):
+        part, counts = read_batch(db, workspaces, batch, incl_types,
+                                  list_types, only_latest_ver, granularity,
+                                  planner, pacer)
+        merge_state(state, workspaces, part, counts)
+        # small workspaces are grouped, so batches don't finish workspaces
+        # in id order
+        ws = batch.workspaces[0]
+        if (batch.start is None or
+                batch.end >= workspaces[ws][WS_OBJ_CNT]):
+            done.update(batch.workspaces)
+            partial = {}
+        else:
+            partial = {ws: batch.end}
+        instrument.set_state('workspaces_done', len(done))
+        _check_memory(store, budget, state)
+        if ckpt and ckpt.due():
+            save_checkpoint(ckpt, state, workspaces, store, done=done,
+                            partial=partial)
+    return state
+
+
+def _check_memory(store, budget, state):
+    d, types, _, objlist, _ = state
+    if store and state_bytes(d, types, objlist) > budget:
+        print('\tSpilling aggregates and object list to ' + store.path)
+        with instrument.timer('spill'):
+            spill_state(store, d, types, objlist)
+
+
+def process_objects_partitioned(pool, workspaces, exclude_ws, incl_types,
+                                list_types, only_latest_ver, args,
+                                granularity=timeseries.GRANULARITY_DEFAULT,
+                                ckpt=None, resume=None):
+    """Like process_objects, but reads from every member in the
+    replicas.MemberPool pool. The workspaces are split into contiguous
+    partitions of about equal object counts, and each partition is
+    aggregated on a worker thread, with the worker's own batch planner and
+    throttle, into state of its own that is merged here. The checkpoint
+    holds the partitions and which of them are done. Each worker holds
+    its partition's state in memory, so this can't keep to a memory
+    budget."""
+    state = new_state()
+    done = set()
+    if resume:
+        merge_state(state, workspaces, resume['state'],
+                    resume['workspaces'])
+        parts = resume['partitions']
+        done = set(resume['done'])
+    else:
+        parts = replicas.split(
+            list(_workspaces_to_process(workspaces, exclude_ws)),
+            pool.partitions(), lambda w: w[1])
+    partitions = []
+    for i, part in enumerate(parts):
+        # counts from this run, as workspaces may have grown since the
+        # checkpoint
+        part = [(ws, workspaces[ws][WS_OBJ_CNT]) for ws, _ in part
+                if ws in workspaces]
+        if i in done or not part:
+            continue
+        # the workers count per workspace into workspaces of their own,
+        # so they never touch shared state
+        wsinfo = {}
+        for ws, _ in part:
+            wsinfo[ws] = dict((k, workspaces[ws][k])
+                              for k in (OWNER, PUBLIC, WS_OBJ_CNT))
+        partitions.append((i, part, wsinfo))
+
+    def context(member):
+        pacer = throttle.from_args(args, None)
+        planner = batch_planner.BatchPlanner(LIMIT, scale=pacer.batch_size)
+        return planner, pacer
+
+    def work(db, ctx, partition):
+        planner, pacer = ctx
+        pacer.db = db
+        _, part, wsinfo = partition
+        # made afresh each time, as a partition may be retried
+        local = _local_workspaces(wsinfo, wsinfo)
+        pstate = new_state()
+        for batch in planner.plan(part):
+            batch_done(planner, pacer, batch, process_batch(
+                db, pstate, local, batch, incl_types, list_types,
+                only_latest_ver, granularity))
+        return pstate, _workspace_counts(local)
+
+    print('Reading {} partitions from {} members'.format(
+        len(partitions), len(pool.members)))
+    instrument.set_state('workspaces_total', len(workspaces))
+    for (i, part, _), (pstate, counts) in pool.run(
+            partitions, work, context, checkpoint.is_transient):
+        merge_state(state, workspaces, pstate, counts)
+        done.add(i)
+        instrument.set_state('workspaces_done',
+                             sum(len(parts[j]) for j in done))
+        print('\nFinished workspaces {} - {}'.format(part[0][0], part[-1][0]))
+        if ckpt and ckpt.due():
+            save_checkpoint(ckpt, state, workspaces, None, partitions=parts,
+                            done=sorted(done))
+    return state
+
+
+def _workspaces_to_process(workspaces, exclude_ws):
+    """Yields (workspace id, object count) for the workspaces to scan."""
     wscount = 0
     for ws in workspaces:
         if MAX_WS > 0 and wscount > MAX_WS:
             break
         wscount += 1
-        wsobjcount = workspaces[ws][WS_OBJ_CNT]
-        print('\nProcessing workspace {}, {} objects'.format(
-            ws, wsobjcount))
-        if ws in exclude_ws:
-            print('\tIn exclude list, skipping')
+        if exclude_ws and ws in exclude_ws:
+            print('\nWorkspace {} in exclude list, skipping'.format(ws))
+            continue
+        yield ws, workspaces[ws][WS_OBJ_CNT]
+
+
+def size_stratum(objcount):
+    """Workspaces are stratified by the order of magnitude of their object
+    count."""
+    return len(str(objcount))
+
+
+def draw_sample(db, sample, exclude_ws):
+    """Returns the sampled (stratum, (ws, window start)) units."""
+    strata = defaultdict(list)
+    for ws in instrument.timed_iter(
+            db[COL_WS].find({}, [WS_ID, WS_OBJ_CNT]), 'query_wait'):
+        if exclude_ws and ws[WS_ID] in exclude_ws:
             continue
-        for lim in xrange(LIMIT, wsobjcount + LIMIT, LIMIT):
-            print('\tProcessing objects {} - {} at {}'.format(
-                lim - LIMIT + 1, wsobjcount if lim > wsobjcount else lim,
-                datetime.datetime.now()))
-            sys.stdout.flush()
-            objtime = time.time()
-            query = {WS_ID: ws, OBJ_ID: {'$gt': lim - LIMIT, '$lte': lim}}
-            objs = db[COL_OBJ].find(query, [WS_ID, OBJ_ID, WS_DELETED,
-                                            OBJ_NAME, OBJ_NUMVER])
-
-            print('\ttotal obj query time: ' + str(time.time() - objtime))
-#             ttlstart = time.time()
-            vers = process_object_versions(  # @UnusedVariable
-                db, d, types, bymonth, objlist, objs, workspaces, incl_types,
-                list_types, lim - LIMIT, lim, only_latest_ver)
-#             print('\ttotal ver query time: ' + str(time.time() - ttlstart))
-            print('\ttotal object versions: ' + str(vers))
-            sys.stdout.flush()
-    return d, types, bymonth, objlist
+        for start in xrange(0, ws[WS_OBJ_CNT], LIMIT):
+            strata[size_stratum(ws[WS_OBJ_CNT])].append((ws[WS_ID], start))
+    return sample.draw(strata)
+
+
+def sample_objects(db, sample, units, workspaces, incl_types,
+                   only_latest_ver, pacer, granularity):
+    """Scans the sampled windows, adding the totals for each to the
+    sample."""
+    instrument.set_state('windows_total', len(units))
+    for i, (stratum, (ws, start)) in enumerate(units):
+        instrument.set_state('windows_done', i)
+        instrument.set_state('workspace', ws)
+        print('\tSample {}/{}: workspace {} objects {} - {} at {}'.format(
+            i + 1, len(units), ws, start + 1, start + LIMIT,
+            datetime.datetime.now()))
+        sys.stdout.flush()
+        d, types, bymonth, _, _ = new_state()
+        wait = instrument.seconds('query_wait')
+        query = {WS_ID: ws, OBJ_ID: {'$gt': start, '$lte': start + LIMIT}}
+        objs = db[COL_OBJ].find(query, [WS_ID, OBJ_ID, WS_DELETED,
+                                        OBJ_NAME, OBJ_NUMVER])
+        with instrument.timer('aggregation', excluding='query_wait'):
+            _, read = process_object_versions(
+                db, d, types, bymonth, {},
+                instrument.timed_iter(objs, 'query_wait'), workspaces,
+                incl_types, (), query, only_latest_ver, granularity)
+            sample.add(stratum, {'users': d, 'types': types,
+                                 'bymonth': bymonth})
+        pacer.batch_done(instrument.seconds('query_wait') - wait, read)
+        pacer.wait()
+    instrument.set_state('windows_done', len(units))
+
+
+def write_sample_output(outdir, sample):
+    est = sampling.nest(sample.estimates())
+    users = est.get('users', {})
+    for u, t in est.get('types', {}).items():
+        users.setdefault(u, {})[TYPES] = t
+    meta = sample.meta()
+    with open(os.path.join(outdir, sampling.sample_file(USER_FILE)),
+              'w') as f:
+        f.write(json.dumps({'data': users, META: meta}, indent=2,
+                           sort_keys=True))
+    with open(os.path.join(outdir, sampling.sample_file(BYMONTH_FILE)),
+              'w') as f:
+        data = {'data': est.get('bymonth', {}),
+                META: dict(meta, author='Gavin Price, Shane Canon',
+                           description='Estimate of the amount of data ' +
+                           'stored in workspace by month')}
+        f.write(json.dumps(data, indent=2, sort_keys=True))
 
 
 # from https://gist.github.com/lonetwin/4721748
@@ -415,45 +886,215 @@ def make_and_check_output_dir(outdir):
             sys.exit(1)
 
 
+def bymonth_output(by_month, series):
+    return {'data': by_month,
+            META: dict(series,
+                       comments='This data comes from workspace. ' +
+                       'Dates are calculated from the Mongo ID',
+                       author='Gavin Price, Shane Canon',
+                       description='Summary of amount of data stored in ' +
+                       'workspace by ' + series['granularity'])}
+
+
+def write_output(outdir, objdata, ws, obj_list, by_month, series):
+    with open(os.path.join(outdir, USER_FILE), 'w') as f:
+        f.write(json.dumps(objdata, indent=2, sort_keys=True))
+    with open(os.path.join(outdir, WS_FILE), 'w') as f:
+        f.write(json.dumps(ws, indent=2, sort_keys=True))
+    with open(os.path.join(outdir, OBJECT_FILE), 'w') as f:
+        f.write(json.dumps(obj_list, indent=2, sort_keys=True))
+    with open(os.path.join(outdir, BYMONTH_FILE), 'w') as f:
+        f.write(json.dumps(bymonth_output(by_month, series), indent=2,
+                           sort_keys=True))
+
+
+def write_sharded_output(sharddir, users, ws, objects, by_month, series):
+    """Writes the output as shards (see shards.py): users by name prefix,
+    workspaces by owner name prefix, objects by save month and the time
+    buckets as one shard."""
+    def name(f):
+        return os.path.splitext(f)[0]
+    w = shards.ShardWriter(sharddir, name(USER_FILE))
+    w.add_all(lambda user, _: shards.user_shard(user), users)
+    w.close()
+    w = shards.ShardWriter(sharddir, name(WS_FILE))
+    w.add_all(lambda _, info: shards.user_shard(info[OWNER]), ws.items())
+    w.close()
+    w = shards.ShardWriter(sharddir, name(OBJECT_FILE))
+    w.add_all(lambda _, obj: shards.month_shard(
+        obj[OBJ_SAVE_DATE][:7].replace('-', '')), objects)
+    w.close()
+    w = shards.ShardWriter(sharddir, name(BYMONTH_FILE))
+    w.add_all(lambda *_: 'data', by_month.items())
+    w.close(bymonth_output({}, series)[META])
+
+
+def publish_output(publisher, users, ws, by_month, series):
+    """Publishes the per user, workspace and time bucket summaries."""
+    print('Publishing summaries')
+    publisher.users(users)
+    publisher.workspaces(ws.items())
+    publisher.periods(by_month.items(), series['granularity'])
+    publisher.finish(bymonth_output({}, series)[META])
+
+
+def write_spilled_output(outdir, store, ws, by_month, series):
+    """Writes the output, merging the spilled state in store."""
+    with open(os.path.join(outdir, WS_FILE), 'w') as f:
+        f.write(json.dumps(ws, indent=2, sort_keys=True))
+    with json_stream.open_json(os.path.join(outdir, USER_FILE), 'w') as f:
+        w = json_stream.ObjectWriter(f, indent=2)
+        spill.write_nested(w, store.counts(('users',)))
+        w.close()
+    with json_stream.open_json(os.path.join(outdir, OBJECT_FILE), 'w') as f:
+        w = json_stream.ObjectWriter(f, indent=2)
+        for objid, obj in store.objects():
+            w.write(objid, obj)
+        w.close()
+    with open(os.path.join(outdir, BYMONTH_FILE), 'w') as f:
+        f.write(json.dumps(bymonth_output(by_month, series), indent=2,
+                           sort_keys=True))
+
+
 def main():
     args = _parseArgs()
     outdir = args.output
     make_and_check_output_dir(outdir)
-    sourcecfg, targetcfg = get_config(args.config)  # @UnusedVariable
+    sourcecfg, targetcfg = get_config(args.config)
+    instrument.init('workspace_statistics')
+    instrument.start_from_args(args)
     starttime = time.time()
-    srcmongo = MongoClient(sourcecfg[CFG_HOST], sourcecfg[CFG_PORT],
-                           slaveOk=True, tz_aware=True)
-    srcdb = srcmongo[sourcecfg[CFG_DB]]
-    if sourcecfg[CFG_USER]:
-        srcdb.authenticate(sourcecfg[CFG_USER], sourcecfg[CFG_PWD])
+    pool = None
+    if len(replicas.members(sourcecfg[CFG_HOST], sourcecfg[CFG_PORT])) > 1:
+        pool = replicas.MemberPool(
+            sourcecfg[CFG_HOST], sourcecfg[CFG_PORT], sourcecfg[CFG_DB],
+            sourcecfg[CFG_USER], sourcecfg[CFG_PWD], args.max_lag,
+            args.workers_per_member, {'tz_aware': True})
+        srcdb = pool.db()
+    else:
+        srcmongo = MongoClient(sourcecfg[CFG_HOST], sourcecfg[CFG_PORT],
+                               slaveOk=True, tz_aware=True)
+        srcdb = srcmongo[sourcecfg[CFG_DB]]
+        if sourcecfg[CFG_USER]:
+            srcdb.authenticate(sourcecfg[CFG_USER], sourcecfg[CFG_PWD])
+    pacer = throttle.from_args(args, srcdb)
+    if args.sample and (args.since or args.until):
+        print('--sample can not be combined with --since or --until')
+        sys.exit(1)
+    if args.shard_dir and args.sample:
+        print('--shard-dir can not be combined with --sample')
+        sys.exit(1)
+    if args.publish and (args.sample or args.since or args.until):
+        print('--publish needs a full run, without --sample, --since or ' +
+              '--until')
+        sys.exit(1)
+    if args.checkpoint and (args.sample or args.since or args.until):
+        print('--checkpoint is only supported for a full run, without ' +
+              '--sample, --since or --until')
+        sys.exit(1)
+    if args.memory_budget and pool and not (args.since or args.until):
+        print('--memory-budget can not be combined with a full run over ' +
+              'several source members, as each worker holds its ' +
+              'partition in memory')
+        sys.exit(1)
+    ckpt, resume = checkpoint.from_args(args, {
+        'only_latest_ver': args.only_latest_ver,
+        'granularity': args.granularity,
+        'types': sourcecfg[CFG_TYPES],
+        'list_objects': sourcecfg[CFG_LIST_OBJS],
+        'exclude_ws': sourcecfg[CFG_EXCLUDE_WS],
+        'partitioned': pool is not None,
+        'memory_budget': args.memory_budget})
+    if args.sample:
+        print('Drawing sample')
+        instrument.set_state('phase', 'sample')
+        sample = sampling.StratifiedSample(args.sample, seed=args.seed)
+        units = draw_sample(srcdb, sample, sourcecfg[CFG_EXCLUDE_WS])
+        print('Sampled {} of {} windows of object ids'.format(
+            len(units), sample.units()[0]))
+        ws = process_workspaces(srcdb, set(u[1][0] for u in units))
+        instrument.set_state('phase', 'objects')
+        sample_objects(srcdb, sample, units, ws, sourcecfg[CFG_TYPES],
+                       args.only_latest_ver, pacer, args.granularity)
+        if outdir:
+            instrument.set_state('phase', 'output')
+            with instrument.timer('output'):
+                write_sample_output(outdir, sample)
+        print('\nElapsed time: ' + str(time.time() - starttime))
+        return
+
     print('Processing workspaces')
+    instrument.set_state('phase', 'workspaces')
     ws = process_workspaces(srcdb)
 
-    print('Processing objects')
-    objdata, typedata, by_month, obj_list = process_objects(
-        srcdb, ws, sourcecfg[CFG_EXCLUDE_WS], sourcecfg[CFG_TYPES],
-        sourcecfg[CFG_LIST_OBJS], args.only_latest_ver)
+    store = None
+    if args.memory_budget:
+        store = spill.SpillStore(args.spill_dir,
+                                 resume.get('spill') if resume else None)
+    budget = (args.memory_budget or 0) * spill.MB
+    id_range = timeseries.id_range(args.since, args.until)
+    instrument.set_state('phase', 'objects')
+    if id_range:
+        print('Processing object versions created from {} to {}'.format(
+            args.since or 'the start', args.until or 'now'))
+        state = process_time_window(
+            srcdb, ws, sourcecfg[CFG_EXCLUDE_WS], sourcecfg[CFG_TYPES],
+            sourcecfg[CFG_LIST_OBJS], args.only_latest_ver, pacer, id_range,
+            args.granularity, store, budget)
+    elif pool:
+        print('Processing objects')
+        state = process_objects_partitioned(
+            pool, ws, sourcecfg[CFG_EXCLUDE_WS], sourcecfg[CFG_TYPES],
+            sourcecfg[CFG_LIST_OBJS], args.only_latest_ver, args,
+            args.granularity, ckpt, resume)
+    else:
+        print('Processing objects')
+        state = process_objects(
+            srcdb, ws, sourcecfg[CFG_EXCLUDE_WS], sourcecfg[CFG_TYPES],
+            sourcecfg[CFG_LIST_OBJS], args.only_latest_ver, pacer, store,
+            budget, args.granularity, ckpt, resume)
+    objdata, typedata, by_month, obj_list, savers = state
+    lbls = timeseries.labels(list(by_month), args.granularity, args.since,
+                             args.until)
+    timeseries.add_cumulative(by_month, lbls)
+    hll.add_distinct(by_month, savers, SAVERS, args.granularity, lbls)
+    series = timeseries.meta(args)
 
     for wsid in ws:
         del ws[wsid][WS_OBJ_CNT]
-    for u in objdata:
-        objdata[u][TYPES] = typedata[u]
     if outdir:
-        with open(os.path.join(outdir, USER_FILE), 'w') as f:
-            f.write(json.dumps(objdata, indent=2, sort_keys=True))
-        with open(os.path.join(outdir, WS_FILE), 'w') as f:
-            f.write(json.dumps(ws, indent=2, sort_keys=True))
-        with open(os.path.join(outdir, OBJECT_FILE), 'w') as f:
-            f.write(json.dumps(obj_list, indent=2, sort_keys=True))
-        with open(os.path.join(outdir, BYMONTH_FILE), 'w') as f:
-            data = {'data': by_month,
-                    META: {'comments': 'This data comes from workspace. ' +
-                           'Dates are calculated from the Mongo ID',
-                           'author': 'Gavin Price, Shane Canon',
-                           'description': 'Summary of amount of data ' +
-                           'stored in workspace by month'}}
-            f.write(json.dumps(data, indent=2, sort_keys=True))
-
+        with open(os.path.join(outdir, SAVERS_FILE), 'w') as f:
+            hll.dump(savers, f)
+    if store and store.spills:
+        spill_state(store, objdata, typedata, obj_list)
+        users = lambda: spill.groups(store.counts(('users',)))
+        objects = store.objects
+        if outdir:
+            instrument.set_state('phase', 'output')
+            with instrument.timer('output'):
+                write_spilled_output(outdir, store, ws, by_month, series)
+    else:
+        for u in objdata:
+            objdata[u][TYPES] = typedata[u]
+        users = objdata.items
+        objects = obj_list.items
+        if outdir:
+            instrument.set_state('phase', 'output')
+            with instrument.timer('output'):
+                write_output(outdir, objdata, ws, obj_list, by_month,
+                             series)
+    if args.shard_dir:
+        instrument.set_state('phase', 'shards')
+        write_sharded_output(args.shard_dir, users(), ws, objects(),
+                             by_month, series)
+    if args.publish:
+        instrument.set_state('phase', 'publish')
+        publish_output(publish.from_config(targetcfg, 'workspace'), users(),
+                       ws, by_month, series)
+    if store:
+        store.close()
+    if ckpt:
+        ckpt.remove()
     print('\nElapsed time: ' + str(time.time() - starttime))
 
 if __name__ == '__main__':
@@ -0,0 +1,80 @@
+import batch_planner
+from batch_planner import Batch, BatchPlanner
+
+
+def covered(batches):
+    """workspace -> sorted list of the object id ranges read."""
+    out = {}
+    for b in batches:
+        for ws in b.workspaces:
+            out.setdefault(ws, []).append((b.start, b.end))
+    return out
+
+
+def test_empty():
+    assert list(BatchPlanner().plan([])) == []
+    assert list(BatchPlanner().plan([(1, 0), (2, 0)])) == []
+
+
+def test_windows_cover_large_workspace():
+    p = BatchPlanner(initial_docs=100)
+    batches = list(p.plan([(1, 250)]))
+    assert batches == [Batch([1], 0, 100, 100), Batch([1], 100, 200, 100),
+                       Batch([1], 200, 250, 50)]
+
+
+def test_small_workspaces_coalesced():
+    p = BatchPlanner(initial_docs=100)
+    batches = list(p.plan([(1, 10), (2, 500), (3, 30), (4, 40), (5, 45)]))
+    assert Batch([1, 3, 4, 5], None, None, 125) in batches
+    assert covered(batches)[2] == [(0, 100), (100, 200), (200, 300),
+                                   (300, 400), (400, 500)]
+
+
+def test_coalesce_limit(monkeypatch):
+    monkeypatch.setattr(batch_planner, 'MAX_COALESCE', 3)
+    batches = list(BatchPlanner().plan((i, 1) for i in range(7)))
+    assert [b.workspaces for b in batches] == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_resume_starts():
+    p = BatchPlanner(initial_docs=100)
+    batches = list(p.plan([(1, 10), (2, 250)], starts={2: 180, 1: 5}))
+    assert batches == [Batch([1], 5, 10, 5), Batch([2], 180, 250, 70)]
+
+
+def test_density_shrinks_windows():
+    p = BatchPlanner(initial_docs=100)
+    b = next(p.plan([(1, 1000)]))
+    p.done(b, 400, 1.0)
+    assert p.window(1) == 25
+    assert p.window(2) < 100
+
+
+def test_slow_batch_halves_target():
+    p = BatchPlanner(initial_docs=10000, max_seconds=5)
+    p.done(Batch([1], 0, 10000, 10000), 10000, 10)
+    assert p.target == 5000
+    for _ in range(20):
+        p.done(Batch([1], 0, 10, 10), 10, 100)
+    assert p.target == batch_planner.MIN_DOCS
+
+
+def test_target_follows_throughput():
+    p = BatchPlanner(initial_docs=10000)
+    targets = []
+    for _ in range(30):
+        docs = int(p.target)
+        # fastest around 20000 documents per batch
+        rate = 1000.0 - abs(docs - 20000) / 100.0
+        p.done(Batch([1], 0, docs, docs), docs, docs / rate)
+        targets.append(p.target)
+    assert 10000 < targets[-1] < 40000
+    assert max(targets) > 15000
+
+
+def test_scale():
+    p = BatchPlanner(initial_docs=100, scale=lambda n: n // 4)
+    assert p.window(1) == 25
+    p = BatchPlanner(initial_docs=100, scale=lambda n: 0)
+    assert p.window(1) == 1
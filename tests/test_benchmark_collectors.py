@@ -0,0 +1,69 @@
+import sys
+
+import pytest
+
+import benchmark_collectors
+
+
+class Collection(object):
+
+    def __init__(self):
+        self.docs = []
+
+    def insert_many(self, docs, ordered=True):
+        self.docs.extend(dict(d) for d in docs)
+
+    def insert_one(self, doc):
+        self.docs.append(dict(doc))
+
+    def create_index(self, keys, **kw):
+        pass
+
+
+class Database(dict):
+
+    def __getattr__(self, name):
+        return self.setdefault(name, Collection())
+
+
+class Client(dict):
+
+    def __init__(self, *args):
+        dict.__init__(self)
+
+    def drop_database(self, name):
+        self.pop(name, None)
+
+    def __getitem__(self, name):
+        return self.setdefault(name, Database())
+
+
+def generate(monkeypatch, *args):
+    client = Client()
+    monkeypatch.setattr(benchmark_collectors, 'MongoClient', lambda *a: client)
+    monkeypatch.setattr(sys, 'argv', ['benchmark_collectors.py', 'generate',
+                                      '--scale', '300', '--seed', '7'] +
+                        list(args))
+    benchmark_collectors.main()
+    return dict((db, dict((c, col.docs) for c, col in cols.items()))
+                for db, cols in client.items())
+
+
+@pytest.mark.parametrize('only,db', [
+    ('ws', benchmark_collectors.WS_DB),
+    ('shock', benchmark_collectors.SHOCK_DB),
+    ('awe', benchmark_collectors.AWE_DB)])
+def test_only_matches_full_run(monkeypatch, only, db):
+    full = generate(monkeypatch)
+    alone = generate(monkeypatch, '--only', only)
+    assert list(alone) == [db]
+    assert alone[db] == full[db]
+    assert alone[db]['bench_info'] == [{'scale': 300, 'seed': 7}]
+
+
+def test_seed_changes_data(monkeypatch):
+    a = generate(monkeypatch, '--only', 'shock')
+    b = generate(monkeypatch, '--only', 'shock', '--seed', '8')
+    db = benchmark_collectors.SHOCK_DB
+    assert a[db]['Nodes'] != b[db]['Nodes']
+    assert a[db]['Users'] != b[db]['Users']
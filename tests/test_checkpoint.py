@@ -0,0 +1,103 @@
+from collections import defaultdict
+
+import pytest
+from bson.objectid import ObjectId
+from pymongo.errors import AutoReconnect, OperationFailure
+
+import checkpoint
+from checkpoint import Checkpoint, CheckpointError
+
+
+class Args(object):
+
+    def __init__(self, path=None, resume=False, interval=0):
+        self.checkpoint = path
+        self.resume = resume
+        self.checkpoint_interval = interval
+
+
+def flaky(errors, result='ok'):
+    calls = []
+
+    def read():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return read, calls
+
+
+def test_is_transient():
+    assert checkpoint.is_transient(AutoReconnect('election'))
+    assert checkpoint.is_transient(OperationFailure('x', 43))
+    assert checkpoint.is_transient(OperationFailure('cursor id 5 not found'))
+    assert not checkpoint.is_transient(OperationFailure('auth failed', 18))
+    assert not checkpoint.is_transient(ValueError('x'))
+
+
+def test_retry_transient():
+    read, calls = flaky([AutoReconnect('a'), AutoReconnect('b')])
+    assert checkpoint.retry(read, 'test', wait=0) == 'ok'
+    assert len(calls) == 3
+
+
+def test_retry_gives_up():
+    read, calls = flaky([AutoReconnect('a')] * 5)
+    with pytest.raises(AutoReconnect):
+        checkpoint.retry(read, 'test', retries=2, wait=0)
+    assert len(calls) == 3
+
+
+def test_no_retry_for_other_errors():
+    read, calls = flaky([KeyError('x')])
+    with pytest.raises(KeyError):
+        checkpoint.retry(read, 'test', wait=0)
+    assert len(calls) == 1
+
+
+def test_plain():
+    d = defaultdict(lambda: defaultdict(int))
+    d['a']['b'] += 1
+    value = checkpoint.plain({'state': (d, [d]), 'n': 1})
+    assert value == {'state': [{'a': {'b': 1}}, [{'a': {'b': 1}}]], 'n': 1}
+    assert type(value['state'][0]['a']) is dict
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'ckpt')
+    ckpt = Checkpoint(path, 0, {'granularity': 'month'})
+    assert ckpt.load() is None
+    state = {'position': ObjectId(), 'state': {'a': [1, 2]}}
+    ckpt.save(state)
+    assert Checkpoint(path, 0, {'granularity': 'month'}).load() == state
+    assert not (tmp_path / 'ckpt.tmp').exists()
+    ckpt.remove()
+    assert not (tmp_path / 'ckpt').exists()
+    ckpt.remove()
+
+
+def test_settings_must_match(tmp_path):
+    path = str(tmp_path / 'ckpt')
+    Checkpoint(path, 0, {'granularity': 'month'}).save({})
+    with pytest.raises(CheckpointError):
+        Checkpoint(path, 0, {'granularity': 'day'}).load()
+
+
+def test_due():
+    assert Checkpoint('x', 0).due()
+    assert not Checkpoint('x', 3600).due()
+
+
+def test_from_args(tmp_path):
+    assert checkpoint.from_args(Args(), {}) == (None, None)
+    with pytest.raises(SystemExit):
+        checkpoint.from_args(Args(resume=True), {})
+    path = str(tmp_path / 'ckpt')
+    ckpt, resume = checkpoint.from_args(Args(path, resume=True), {'a': 1})
+    assert resume is None
+    ckpt.save({'done': [1]})
+    assert checkpoint.from_args(Args(path), {'a': 1})[1] is None
+    assert checkpoint.from_args(Args(path, True), {'a': 1})[1] == {
+        'done': [1]}
+    with pytest.raises(SystemExit):
+        checkpoint.from_args(Args(path, True), {'a': 2})
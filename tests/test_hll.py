@@ -0,0 +1,88 @@
+import io
+from collections import defaultdict
+
+import pytest
+
+import hll
+from hll import HyperLogLog
+
+
+def sketch(values, precision=hll.PRECISION_DEFAULT):
+    s = HyperLogLog(precision)
+    for v in values:
+        s.add(v)
+    return s
+
+
+def test_empty():
+    assert HyperLogLog().count() == 0
+    assert hll.union_by({}, 'month') == {}
+
+
+@pytest.mark.parametrize('n', [1, 10, 1000, 50000])
+def test_count_within_error(n):
+    est = sketch('user{}'.format(i) for i in range(n)).count()
+    assert abs(est - n) <= max(1, 0.05 * n)
+
+
+def test_duplicates_ignored():
+    assert sketch(['a', 'b', u'a', b'b'] * 100).count() == 2
+
+
+def test_merge_is_union():
+    a = sketch('u{}'.format(i) for i in range(0, 3000))
+    b = sketch('u{}'.format(i) for i in range(2000, 5000))
+    both = sketch('u{}'.format(i) for i in range(5000))
+    assert a.copy().merge(b).registers == both.registers
+    assert a.count() != both.count()
+
+
+def test_bad_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(3)
+    with pytest.raises(ValueError):
+        HyperLogLog(17)
+    with pytest.raises(ValueError):
+        HyperLogLog(4).merge(HyperLogLog(5))
+    with pytest.raises(ValueError):
+        HyperLogLog(4, bytearray(3))
+
+
+def test_string_round_trip():
+    s = sketch(['a', 'b', 'c'], 10)
+    t = HyperLogLog.from_string(s.to_string(), 10)
+    assert t.registers == s.registers
+
+
+def test_dump_and_load():
+    sketches = {'20150301': sketch(['a', 'b']), '20150302': sketch(['c'])}
+    f = io.StringIO()
+    hll.dump(sketches, f)
+    f.seek(0)
+    loaded = hll.load(f)
+    assert sorted(loaded) == sorted(sketches)
+    assert all(loaded[k].registers == sketches[k].registers
+               for k in sketches)
+
+
+def test_add_distinct():
+    days = {'20150130': sketch(['a', 'b']),
+            '20150131': sketch(['b', 'c']),
+            '20150305': sketch(['a', 'd'])}
+    series = defaultdict(dict)
+    hll.add_distinct(series, days, 'savers', 'month',
+                     ['201501', '201502', '201503'])
+    assert series == {
+        '201501': {'savers': 3, 'cumulative_savers': 3},
+        '201502': {'savers': 0, 'cumulative_savers': 3},
+        '201503': {'savers': 2, 'cumulative_savers': 4}}
+    # the day sketches are left as they were
+    assert days['20150130'].count() == 2
+
+
+def test_merge_all_copies():
+    a = sketch(['a'])
+    into = {}
+    hll.merge_all(into, {'x': a})
+    into['x'].add('b')
+    assert a.count() == 1
@@ -0,0 +1,149 @@
+import json
+import threading
+
+import pytest
+
+import instrument
+from instrument import Registry
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 100.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(instrument, 'time', c)
+    return c
+
+
+def test_timer_excluding(clock):
+    r = Registry()
+    with r.timer('aggregation', excluding='query_wait'):
+        clock.now += 1
+        with r.timer('query_wait'):
+            clock.now += 5
+        clock.now += 2
+        with r.timer('query_wait'):
+            clock.now += 3
+    with r.timer('outer', excluding=('aggregation', 'query_wait')):
+        clock.now += 4
+        with r.timer('aggregation'):
+            clock.now += 10
+    snap = r.snapshot()['timers']
+    assert snap['query_wait'] == {'calls': 2, 'seconds': 8.0,
+                                  'max_seconds': 5.0}
+    assert snap['aggregation'] == {'calls': 2, 'seconds': 13.0,
+                                   'max_seconds': 10.0}
+    assert snap['outer']['seconds'] == 4.0
+    assert r.seconds('query_wait') == 8.0
+
+
+def test_timer_exclusion_per_thread(clock):
+    r = Registry()
+    with r.timer('stage', excluding='wait'):
+        # another thread's waits don't come off this thread's stage
+        t = threading.Thread(target=lambda: r.add_time('wait', 50.0))
+        t.start()
+        t.join()
+        clock.now += 2
+    assert r.snapshot()['timers']['stage']['seconds'] == 2.0
+    assert r.snapshot()['timers']['wait']['seconds'] == 50.0
+    assert r.seconds('wait') == 0.0
+
+
+def test_timed_iter(clock):
+    r = Registry()
+
+    def items():
+        for i in range(3):
+            clock.now += 1
+            yield i
+    assert list(r.timed_iter(items(), 'query_wait')) == [0, 1, 2]
+    assert r.snapshot()['timers']['query_wait']['calls'] == 4
+    assert r.snapshot()['timers']['query_wait']['seconds'] == 3.0
+
+
+def test_counters_and_state(clock):
+    r = Registry('shock')
+    r.count('nodes')
+    r.count('nodes', 9)
+    r.count('users', 0)
+    r.set_state('node', 'abc')
+    clock.now += 7
+    snap = r.snapshot()
+    assert snap['collector'] == 'shock'
+    assert snap['elapsed'] == 7.0
+    assert snap['counters'] == {'nodes': 10, 'users': 0}
+    assert snap['state'] == {'node': 'abc'}
+    # a copy, not a view
+    r.count('nodes')
+    assert snap['counters']['nodes'] == 10
+
+
+def test_snapshot_while_counting():
+    r = Registry()
+    stop = threading.Event()
+
+    def work():
+        i = 0
+        while not stop.is_set():
+            r.count('c{}'.format(i % 5000))
+            r.set_state('s{}'.format(i % 5000), i)
+            i += 1
+    t = threading.Thread(target=work)
+    t.start()
+    try:
+        for _ in range(200):
+            snap = r.snapshot()
+            # each counter is added before its state key
+            assert len(snap['counters']) >= len(snap['state'])
+    finally:
+        stop.set()
+        t.join()
+
+
+def test_prometheus(clock):
+    r = Registry('ws')
+    r.count('versions', 3)
+    r.count('bad-name.x')
+    r.add_time('query_wait', 1.5)
+    r.add_time('query_wait', 0.5)
+    r.set_state('workspace', 12)
+    r.set_state('phase', 'objects')
+    r.set_state('done', True)
+    clock.now += 2
+    assert r.prometheus().split('\n') == [
+        '# TYPE collector_elapsed_seconds gauge',
+        'collector_elapsed_seconds{collector="ws"} 2.0',
+        '# TYPE collector_bad_name_x_total counter',
+        'collector_bad_name_x_total{collector="ws"} 1',
+        '# TYPE collector_versions_total counter',
+        'collector_versions_total{collector="ws"} 3',
+        '# TYPE collector_stage_seconds_total counter',
+        'collector_stage_seconds_total{collector="ws",stage="query_wait"} '
+        '2.0',
+        '# TYPE collector_stage_calls_total counter',
+        'collector_stage_calls_total{collector="ws",stage="query_wait"} 2',
+        '# TYPE collector_stage_max_seconds gauge',
+        'collector_stage_max_seconds{collector="ws",stage="query_wait"} 1.5',
+        '# TYPE collector_state gauge',
+        'collector_state{collector="ws",key="workspace"} 12',
+        '']
+
+
+def test_write(tmp_path, clock):
+    r = Registry('awe')
+    r.count('jobs', 2)
+    prefix = str(tmp_path / 'metrics')
+    r.write(prefix)
+    with open(prefix + '.json') as f:
+        assert json.load(f)['counters'] == {'jobs': 2}
+    with open(prefix + '.prom') as f:
+        assert 'collector_jobs_total{collector="awe"} 2\n' in f.read()
@@ -0,0 +1,88 @@
+import io
+import json
+
+import pytest
+
+import json_stream
+from json_stream import ObjectWriter, iter_object_items
+
+DOC = {'by_date': {'2015-03-01': {'n': 1}, '2015-03-02': {'n': 2}},
+       'by_workspace': {'1/2': {'name': 'a', 'tags': [1, 2.5, None]},
+                        '3/4': {'name': u'é', 'big': 12345678901234567890}},
+       'meta': {'x': True}}
+
+
+def items(text, path=()):
+    return list(iter_object_items(io.StringIO(text), path))
+
+
+def test_top_level_items():
+    assert dict(items(json.dumps(DOC))) == DOC
+
+
+def test_path():
+    assert dict(items(json.dumps(DOC, indent=2), ('by_workspace',))) == \
+        DOC['by_workspace']
+
+
+def test_missing_path():
+    assert items(json.dumps(DOC), ('nothing',)) == []
+    assert items(json.dumps(DOC), ('meta', 'x')) == []
+
+
+def test_empty_object():
+    assert items(u'{}') == []
+    assert items(u' { } ', ('a',)) == []
+
+
+def test_values_across_reads(monkeypatch):
+    monkeypatch.setattr(json_stream, 'READ_SIZE', 7)
+    doc = {'a': list(range(1000)), 'n': 1234567890123, 'b': {'x': 'y' * 50}}
+    assert dict(items(json.dumps(doc))) == doc
+    assert items(json.dumps(doc), ('b',)) == [('x', 'y' * 50)]
+
+
+def test_not_an_object():
+    with pytest.raises(ValueError):
+        items(u'[1, 2]')
+
+
+def test_empty_input():
+    with pytest.raises(ValueError):
+        items(u'')
+
+
+def test_truncated():
+    with pytest.raises(ValueError):
+        items(json.dumps(DOC)[:-20])
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+def test_writer_matches_dumps(indent):
+    f = io.StringIO()
+    w = ObjectWriter(f, indent=indent)
+    for k in sorted(DOC):
+        if k == 'by_workspace':
+            inner = w.object(k)
+            for ik in sorted(DOC[k]):
+                inner.write(ik, DOC[k][ik])
+            inner.close()
+        else:
+            w.write(k, DOC[k])
+    assert w.close() == len(DOC)
+    seps = (',', ': ') if indent else (', ', ': ')
+    assert f.getvalue() == json.dumps(DOC, indent=indent, sort_keys=True,
+                                      separators=seps)
+
+
+def test_writer_empty():
+    f = io.StringIO()
+    assert ObjectWriter(f, indent=2).close() == 0
+    assert f.getvalue() == u'{}'
+
+
+def test_load_object(tmp_path):
+    path = str(tmp_path / 'doc.json')
+    with json_stream.open_json(path, 'w') as f:
+        f.write(json_stream.dumps(DOC))
+    assert json_stream.load_object(path, ('by_date',)) == DOC['by_date']
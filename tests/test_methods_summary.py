@@ -0,0 +1,56 @@
+import io
+
+import methods_summary
+from methods_summary import MethodCounts
+
+HEADER = '_time,a,b,NULL,a_span\n'
+ROWS = ['2015-01-30T00:00:00.000-08:00,4,,7,1\n',
+        '2015-02-02T00:00:00.000-08:00,2,6,,1\n',
+        '2015-03-01T00:00:00.000-08:00,,3,,1\n']
+
+
+def counts(rows):
+    mc = MethodCounts()
+    mc.update(io.StringIO(u''.join([HEADER] + rows)))
+    return mc
+
+
+def test_description_has_window():
+    desc = methods_summary.summarize(counts(ROWS), 3)['meta']['description']
+    assert '{}' not in desc
+    assert 'over the 3 days up to the last day' in desc
+    assert 'over the 3 days up to the end of each month' in desc
+
+
+def test_summary():
+    s = methods_summary.summarize(counts(ROWS), 3)
+    assert sorted(s['by_method']) == ['a', 'b']
+    a = s['by_method']['a']
+    assert a['total_count'] == 6
+    assert a['accesses_by_month'] == {'2015-01': 4, '2015-02': 2}
+    # 02-02 falls out of the 3 day window well before 03-01
+    assert a['moving_average'] == 0.0
+    # 01-29 and 01-30 only: the first day of the CSV is 01-30
+    assert a['moving_average_by_month'] == {'2015-01': 2.0}
+    b = s['by_method']['b']
+    assert b['total_count'] == 9
+    assert b['moving_average'] == 1.0
+    # 02-26..02-28 have no calls
+    assert b['moving_average_by_month'] == {'2015-03': 1.0}
+    assert s['top_list'][:2] == ['b', 'a']
+    assert s['top_list'][2:] == [None] * (methods_summary.TOP_N - 2)
+
+
+def test_cache_reuse(tmp_path):
+    cache = str(tmp_path / 'methods.npz')
+    counts(ROWS[:2]).save(cache)
+    mc = MethodCounts.load(cache)
+    # the last cached day is parsed again, earlier days are not
+    changed = ROWS[1].replace(',2,6,', ',5,6,')
+    assert mc.update(io.StringIO(u''.join([HEADER, ROWS[0], changed,
+                                           ROWS[2]]))) == 2
+    assert mc.days == ['2015-01-30', '2015-02-02', '2015-03-01']
+    fresh = counts([ROWS[0], changed, ROWS[2]])
+    assert (methods_summary.summarize(mc, 3)['by_method'] ==
+            methods_summary.summarize(fresh, 3)['by_method'])
+    assert mc.update(io.StringIO(u''.join([HEADER] + ROWS[:2]))) == 0
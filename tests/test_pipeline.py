@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+import pipeline
+from pipeline import Pipeline, Stage, order_stages
+
+
+def stage(name, command, inputs=(), outputs=(), **kwargs):
+    return Stage(name, command, inputs, outputs, **kwargs)
+
+
+def run(stages, tmp_path, **kwargs):
+    p = Pipeline(stages, str(tmp_path), str(tmp_path), **kwargs)
+    return p.run(), p.status
+
+
+def test_order_stages(tmp_path):
+    a = str(tmp_path / 'a')
+    b = str(tmp_path / 'b')
+    deps = order_stages([stage('use', 'x', [a, b]), stage('make_a', 'x',
+                         outputs=[a]), stage('make_b', 'x', [a], [b])])
+    assert deps == {'use': set(['make_a', 'make_b']), 'make_a': set(),
+                    'make_b': set(['make_a'])}
+
+
+def test_cycle_and_duplicate_outputs(tmp_path):
+    a = str(tmp_path / 'a')
+    b = str(tmp_path / 'b')
+    with pytest.raises(ValueError):
+        order_stages([stage('x', 'x', [a], [b]), stage('y', 'y', [b], [a])])
+    with pytest.raises(ValueError):
+        order_stages([stage('x', 'x', outputs=[a]),
+                      stage('y', 'y', outputs=[a])])
+
+
+def test_no_stages(tmp_path):
+    assert run([], tmp_path) == (True, {})
+
+
+def test_outputs_staged_and_skipped_when_unchanged(tmp_path):
+    src = tmp_path / 'src.txt'
+    src.write_text(u'hello\n')
+    out = str(tmp_path / 'out' / 'copy.txt')
+    os.mkdir(str(tmp_path / 'out'))
+    copy = stage('copy', 'cp src.txt {out}/copy.txt', [str(src)], [out])
+    assert run([copy], tmp_path) == (True, {'copy': pipeline.OK})
+    with open(out) as f:
+        assert f.read() == 'hello\n'
+    assert run([copy], tmp_path)[1] == {'copy': pipeline.UNCHANGED}
+    src.write_text(u'changed\n')
+    assert run([copy], tmp_path)[1] == {'copy': pipeline.OK}
+    assert run([copy], tmp_path, force=True)[1] == {'copy': pipeline.OK}
+    # only the output is left in its directory
+    assert os.listdir(str(tmp_path / 'out')) == ['copy.txt']
+
+
+def test_failure_blocks_dependents(tmp_path):
+    os.mkdir(str(tmp_path / 'out'))
+    made = str(tmp_path / 'out' / 'made')
+    ok, status = run([stage('fail', 'exit 3', outputs=[made]),
+                      stage('after', 'true', [made]),
+                      stage('other', 'true')], tmp_path)
+    assert not ok
+    assert status == {'fail': pipeline.FAILED, 'after': pipeline.BLOCKED,
+                      'other': pipeline.OK}
+    assert not os.path.exists(made)
+
+
+def test_missing_output_fails(tmp_path):
+    os.mkdir(str(tmp_path / 'out'))
+    ok, status = run([stage('lazy', 'true',
+                            outputs=[str(tmp_path / 'out' / 'x')])],
+                     tmp_path)
+    assert status == {'lazy': pipeline.FAILED}
+
+
+def test_unreadable_input_fails(tmp_path, monkeypatch):
+    src = tmp_path / 'src.txt'
+    src.write_text(u'x')
+
+    def unreadable(path):
+        raise IOError('gone')
+    monkeypatch.setattr(pipeline, 'file_digest', unreadable)
+    ok, status = run([stage('read', 'true', [str(src)])], tmp_path)
+    assert status == {'read': pipeline.FAILED}
+
+
+def test_stdout_output(tmp_path):
+    os.mkdir(str(tmp_path / 'out'))
+    out = str(tmp_path / 'out' / 'echo.txt')
+    ok, _ = run([stage('echo', 'echo hi', outputs=[out], stdout=out)],
+                tmp_path)
+    assert ok
+    with open(out) as f:
+        assert f.read() == 'hi\n'
+
+
+def test_jobs_limit(tmp_path):
+    stages = [stage(str(i), 'sleep 0.1') for i in range(4)]
+    p = Pipeline(stages, str(tmp_path), str(tmp_path), jobs=1)
+    assert p.run()
+    spans = sorted((t['start'], t['start'] + t['seconds'])
+                   for t in p.timings.values())
+    assert all(a[1] <= b[0] + 0.05 for a, b in zip(spans, spans[1:]))
@@ -0,0 +1,95 @@
+import publish
+from publish import Publisher
+
+
+class ReplaceOne(object):
+
+    def __init__(self, filter, doc, upsert=False):
+        self.id = filter['_id']
+        self.doc = doc
+
+
+class DeleteMany(object):
+
+    def __init__(self, filter):
+        self.ids = filter['_id']['$in']
+
+
+class Collection(object):
+
+    def __init__(self):
+        self.docs = {}
+        self.writes = 0
+
+    def create_index(self, keys):
+        pass
+
+    def find(self, query, fields):
+        for d in self.docs.values():
+            if all(d.get(k) == v for k, v in query.items()):
+                yield dict((f, d[f]) for f in ['_id'] + fields)
+
+    def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            self.writes += 1
+            if isinstance(op, ReplaceOne):
+                self.docs[op.id] = op.doc
+            else:
+                for i in op.ids:
+                    del self.docs[i]
+
+
+def publisher(monkeypatch, source='shock'):
+    monkeypatch.setattr(publish, 'ReplaceOne', ReplaceOne)
+    monkeypatch.setattr(publish, 'DeleteMany', DeleteMany)
+    return Publisher({'usage_periods': Collection()}, source)
+
+
+def test_republish(monkeypatch):
+    p = publisher(monkeypatch)
+    coll = p.db['usage_periods']
+    items = [('2016-01', {'bytes': 10}), ('2016-02', {'bytes': 20})]
+    assert p.periods(items, 'month') == (2, 0, 0)
+    assert coll.writes == 2
+    doc = coll.docs['shock:month:2016-01']
+    assert doc['key'] == '2016-01'
+    assert doc['granularity'] == 'month'
+    assert doc['data'] == {'bytes': 10}
+
+    assert p.periods(items, 'month') == (0, 2, 0)
+    assert coll.writes == 2
+
+    assert p.periods([('2016-01', {'bytes': 10}),
+                      ('2016-02', {'bytes': 25})], 'month') == (1, 1, 0)
+    assert coll.writes == 3
+    assert coll.docs['shock:month:2016-02']['data'] == {'bytes': 25}
+
+
+def test_removed_key(monkeypatch):
+    p = publisher(monkeypatch)
+    coll = p.db['usage_periods']
+    p.periods([('2016-01', {'bytes': 10}), ('2016-02', {'bytes': 20})],
+              'month')
+    p.periods([('2016-01', {'bytes': 1})], 'day')
+    assert p.periods([('2016-02', {'bytes': 20})], 'month') == (0, 1, 1)
+    # only the last run of the same source and granularity is replaced
+    assert sorted(coll.docs) == ['shock:day:2016-01', 'shock:month:2016-02']
+    other = Publisher(p.db, 'awe')
+    assert other.periods([], 'month') == (0, 0, 0)
+    assert len(coll.docs) == 2
+
+
+def test_escaped_keys(monkeypatch):
+    p = publisher(monkeypatch)
+    coll = p.db['usage_periods']
+    data = {'KBaseGenomes.Genome': {'$count': 1, 'a.b.c': [{'$x.y': 2}]},
+            'in$side': 3, 4: 5}
+    assert p.periods([('2016-01', data)], 'month') == (1, 0, 0)
+    stored = coll.docs['shock:month:2016-01']['data']
+    dot, dollar = publish.DOT, publish.DOLLAR
+    assert stored == {
+        'KBaseGenomes' + dot + 'Genome': {
+            dollar + 'count': 1,
+            'a' + dot + 'b' + dot + 'c': [{dollar + 'x' + dot + 'y': 2}]},
+        'in$side': 3, '4': 5}
+    assert p.periods([('2016-01', data)], 'month') == (0, 1, 0)
@@ -0,0 +1,116 @@
+import pytest
+from pymongo.errors import AutoReconnect, OperationFailure
+
+import replicas
+from replicas import MemberPool, PartitionError
+
+
+class Admin(object):
+
+    def __init__(self, host, fail):
+        self.host = host
+        self.fail = fail
+
+    def command(self, name):
+        if self.fail:
+            raise self.fail
+        if name == 'replSetGetStatus':
+            raise OperationFailure('not a replica set')
+        return {}
+
+
+def fake_client(fail=None):
+    class Client(object):
+
+        def __init__(self, host, port, **kwargs):
+            self.admin = Admin(host, fail.get(host) if fail else None)
+            self.host = host
+
+        def __getitem__(self, name):
+            return self.host
+    return Client
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(replicas, 'MongoClient', fake_client())
+    return MemberPool(['a', 'b:2'], 1, 'db', workers_per_member=2)
+
+
+def test_members():
+    # configobj gives a list for a comma separated host setting
+    assert replicas.members(['a', ' b:27018'], 27017) == [('a', 27017),
+                                                          ('b', 27018)]
+    assert replicas.members('a', 27017) == [('a', 27017)]
+
+
+def test_split():
+    parts = replicas.split(list(range(10)), 3, lambda i: 1)
+    assert [i for p in parts for i in p] == list(range(10))
+    assert len(parts) == 3
+    assert replicas.split([], 3, lambda i: 1) == []
+
+
+def test_run_spreads_partitions(pool):
+    done = dict(pool.run(list(range(20)), lambda db, ctx, p: (db, p * 2)))
+    assert sorted(done) == list(range(20))
+    assert all(r == p * 2 for p, (_, r) in done.items())
+    assert set(db for db, _ in done.values()) <= set(['a', 'b'])
+
+
+def test_run_nothing(pool):
+    assert list(pool.run([], lambda db, ctx, p: p)) == []
+
+
+def test_lost_connection_moves_partition(pool):
+    def work(db, ctx, p):
+        if db == 'a':
+            raise AutoReconnect('a went away')
+        return db
+    assert set(r for _, r in pool.run(list(range(6)), work)) == set(['b'])
+    assert not pool.members[0].up
+
+
+def test_transient_error_retried(pool):
+    seen = set()
+
+    def work(db, ctx, p):
+        if p not in seen:
+            seen.add(p)
+            raise OperationFailure('cursor id 1 not found', 43)
+        return p
+    results = pool.run(list(range(4)), work,
+                       transient=lambda e: 'cursor' in str(e))
+    assert sorted(p for p, _ in results) == list(range(4))
+
+
+def test_work_error_raised(pool):
+    def work(db, ctx, p):
+        raise KeyError(p)
+    with pytest.raises(KeyError):
+        list(pool.run([1, 2], work))
+
+
+def test_context_error_raised(pool):
+    def context(member):
+        raise ValueError('no context')
+    with pytest.raises(ValueError):
+        list(pool.run([1, 2], lambda db, ctx, p: p, context))
+
+
+def test_member_check_error_raised(monkeypatch):
+    monkeypatch.setattr(replicas, 'MongoClient', fake_client(
+        {'a': OperationFailure('auth failed', 18),
+         'b': OperationFailure('auth failed', 18)}))
+    pool = MemberPool(['a', 'b'], 1, 'db')
+    with pytest.raises(OperationFailure):
+        list(pool.run([1, 2], lambda db, ctx, p: p))
+
+
+def test_all_members_down(monkeypatch):
+    monkeypatch.setattr(replicas, 'MAX_FAILURES', 1)
+    monkeypatch.setattr(replicas, 'MongoClient', fake_client(
+        {'a': AutoReconnect('down'), 'b': AutoReconnect('down')}))
+    pool = MemberPool(['a', 'b'], 1, 'db')
+    with pytest.raises(PartitionError):
+        list(pool.run([1], lambda db, ctx, p: p))
@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+import sampling
+from sampling import StratifiedSample
+
+
+def test_sample_file():
+    assert sampling.sample_file('user_data.json') == 'user_data_sample.json'
+
+
+def test_flatten_skips_non_numbers():
+    d = {'a': {'b': 1, 'c': True, 'd': 'x', 'e': {'f': 2.5}}, 'g': None}
+    assert sorted(sampling.flatten(d)) == [(('a', 'b'), 1),
+                                           (('a', 'e', 'f'), 2.5)]
+
+
+def test_nest():
+    assert sampling.nest({('u', 'cnt'): (9.6, 4.0)}) == {
+        'u': {'cnt': 10, 'cnt_ci95': 4}}
+
+
+@pytest.mark.parametrize('fraction', [0, -0.1, 1.5])
+def test_bad_fraction(fraction):
+    with pytest.raises(ValueError):
+        StratifiedSample(fraction)
+
+
+def test_empty():
+    s = StratifiedSample(0.5, seed=1)
+    assert s.draw({}) == []
+    assert s.estimates() == {}
+    assert s.units() == (0, 0)
+    assert s.meta()['strata'] == 0
+
+
+def test_full_sample_is_exact():
+    strata = {'a': list(range(10)), 'b': list(range(3))}
+    s = StratifiedSample(1.0, seed=1)
+    units = s.draw(strata)
+    assert units == sorted((h, u) for h in strata for u in strata[h])
+    for h, u in units:
+        s.add(h, {'x': {'cnt': u, 'big': 1000}})
+    assert s.estimates() == {('x', 'cnt'): (48.0, 0.0),
+                             ('x', 'big'): (13000.0, 0.0)}
+
+
+def test_min_units_and_seed():
+    strata = {'a': list(range(100)), 'b': list(range(5))}
+    draws = [StratifiedSample(0.01, seed=7).draw(strata) for _ in range(2)]
+    assert draws[0] == draws[1]
+    assert [h for h, _ in draws[0]].count('a') == 2
+    assert [h for h, _ in draws[0]].count('b') == 2
+
+
+def test_estimate_and_interval():
+    rng = random.Random(3)
+    values = dict((h, [rng.randint(0, 100) for _ in range(200)])
+                  for h in 'abc')
+    truth = sum(sum(v) for v in values.values())
+    s = StratifiedSample(0.2, seed=5)
+    for h, u in s.draw(dict((h, list(range(200))) for h in values)):
+        s.add(h, {'n': values[h][u]})
+    est, var = s.estimates()[('n',)]
+    assert var > 0
+    assert abs(est - truth) < 4 * var ** 0.5
+
+
+def test_units_without_data_count():
+    s = StratifiedSample(1.0, seed=1)
+    s.draw({'a': [1, 2, 3, 4]})
+    s.add('a', {'n': 8})
+    for _ in range(3):
+        s.add('a', {})
+    assert s.estimates() == {('n',): (8.0, 0.0)}
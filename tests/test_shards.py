@@ -0,0 +1,96 @@
+import gzip
+import json
+import os
+
+import pytest
+
+import shards
+from shards import ShardWriter
+
+
+def write(outdir, items, meta=None):
+    w = ShardWriter(str(outdir), 'user_data')
+    w.add_all(lambda k, v: shards.user_shard(k), items)
+    return w.close(meta)
+
+
+def read(outdir, shard):
+    path = os.path.join(str(outdir), 'user_data', shard + shards.SUFFIX)
+    with gzip.open(path) as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+def manifest(outdir):
+    with open(os.path.join(str(outdir), 'user_data',
+                           shards.MANIFEST)) as f:
+        return json.load(f)
+
+
+def test_shard_names():
+    assert shards.user_shard('Alice') == 'users/al'
+    assert shards.user_shard('a') == 'users/a'
+    assert shards.user_shard('') == 'users/_'
+    assert shards.user_shard(u'\xe9 x') == 'users/__'
+    assert shards.month_shard('201503') == 'months/201503'
+
+
+def test_write_and_read_back(tmp_path):
+    items = [('bob', {'n': 2}), ('alice', {'n': 1}), ('albert', {'n': 3})]
+    assert write(tmp_path, items, {'run': 1}) == (2, 0, 0)
+    assert read(tmp_path, 'users/al') == {'alice': {'n': 1},
+                                          'albert': {'n': 3}}
+    assert read(tmp_path, 'users/bo') == {'bob': {'n': 2}}
+    m = manifest(tmp_path)
+    assert m['meta'] == {'run': 1}
+    assert m['shards']['users/al']['keys'] == 2
+
+
+def test_only_changed_shards_written(tmp_path):
+    items = [('alice', {'n': 1}), ('bob', {'n': 2}), ('carol', {'n': 3})]
+    write(tmp_path, items)
+    bo = os.path.join(str(tmp_path), 'user_data', 'users', 'bo.json.gz')
+    mtime = os.path.getmtime(bo)
+    # the same content in another order is unchanged
+    assert write(tmp_path, list(reversed(items))) == (0, 3, 0)
+    assert write(tmp_path, [('alice', {'n': 5}), ('bob', {'n': 2})]) == (
+        1, 1, 1)
+    assert os.path.getmtime(bo) == mtime
+    assert not os.path.exists(os.path.join(str(tmp_path), 'user_data',
+                                           'users', 'ca.json.gz'))
+    assert sorted(manifest(tmp_path)['shards']) == ['users/al', 'users/bo']
+
+
+def test_same_bytes_for_same_content(tmp_path):
+    write(tmp_path / 'a', [('alice', {'n': 1})])
+    write(tmp_path / 'b', [('alice', {'n': 1})])
+    paths = [os.path.join(str(tmp_path / d), 'user_data', 'users',
+                          'al.json.gz') for d in 'ab']
+    with open(paths[0], 'rb') as f, open(paths[1], 'rb') as g:
+        assert f.read() == g.read()
+
+
+def test_buffer_flushes(tmp_path, monkeypatch):
+    monkeypatch.setattr(shards, 'BUFFER_BYTES', 50)
+    items = [('user{:03d}'.format(i), {'n': i}) for i in range(200)]
+    write(tmp_path, items)
+    assert read(tmp_path, 'users/us') == dict(items)
+
+
+def test_empty_output(tmp_path):
+    write(tmp_path, [('alice', {'n': 1})])
+    assert write(tmp_path, []) == (0, 0, 1)
+    assert manifest(tmp_path)['shards'] == {}
+    assert sorted(os.listdir(os.path.join(str(tmp_path), 'user_data'))) == [
+        shards.MANIFEST, 'users']
+
+
+def test_failed_close_removes_temporary_files(tmp_path, monkeypatch):
+    def fail(self, manifest):
+        raise IOError('disk full')
+    monkeypatch.setattr(ShardWriter, '_manifest', fail)
+    w = ShardWriter(str(tmp_path), 'user_data')
+    w.add('users/al', 'alice', {'n': 2})
+    with pytest.raises(IOError):
+        w.close()
+    assert [d for d in os.listdir(os.path.join(str(tmp_path), 'user_data'))
+            if d.startswith('.shards-')] == []
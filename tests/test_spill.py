@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+
+import pytest
+
+import json_stream
+import spill
+from spill import SpillStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = SpillStore(str(tmp_path))
+    yield s
+    s.close()
+
+
+def nested_text(rows):
+    f = io.StringIO()
+    w = json_stream.ObjectWriter(f, indent=2)
+    spill.write_nested(w, rows)
+    w.close()
+    return f.getvalue()
+
+
+def test_counts_summed_in_key_order(store):
+    users = {u'a b': {u'x': 1}, u'a': {u'b': 2, u'': 3, u'c!': 4, u'c': 5,
+                                       u'\x01': 6, u'\x00z': 7, u'é': 9},
+             u'a!': {u'q': 1}, u'ab': {u'r': 2}}
+    store.add_counts(('users',), users)
+    store.add_counts(('users',), {u'a': {u'b': 10}})
+    store.add_counts(('other',), {u'zz': 1})
+    store.commit()
+    users[u'a'][u'b'] = 12
+    assert nested_text(store.counts(('users',))) == json_stream.dumps(
+        users, indent=2, sort_keys=True, separators=(',', ': '))
+    assert list(store.counts(('other',))) == [([u'zz'], 1)]
+    assert len(list(store.counts(()))) == 11
+
+
+def test_empty(store):
+    assert list(store.counts(('users',))) == []
+    assert list(store.objects()) == []
+    assert nested_text(store.counts(('users',))) == u'{}'
+    assert list(spill.groups([])) == []
+
+
+def test_objects_keep_highest_version(store):
+    store.add_objects({'1/1': {'ver': 2, 'n': 'a'}, '1/2': {'ver': 1}},
+                      'ver')
+    store.add_objects({'1/1': {'ver': 3, 'n': 'b'}}, 'ver')
+    store.add_objects({'1/1': {'ver': 1, 'n': 'c'}}, 'ver')
+    store.commit()
+    assert list(store.objects()) == [('1/1', {'ver': 3, 'n': 'b'}),
+                                     ('1/2', {'ver': 1})]
+
+
+def test_groups(store):
+    store.add_counts(('users',), {'a': {'pub': {'cnt': 1}, 'priv': 2},
+                                  'b': {'pub': {'cnt': 3}}})
+    assert list(spill.groups(store.counts(('users',)))) == [
+        ('a', {'priv': 2, 'pub': {'cnt': 1}}), ('b', {'pub': {'cnt': 3}})]
+
+
+def test_resume_rolls_back_later_rows(tmp_path):
+    s = SpillStore(str(tmp_path))
+    s.add_counts(('users',), {'a': 1})
+    s.add_objects({'1/1': {'ver': 1}}, 'ver')
+    s.commit()
+    mark = json.loads(json.dumps(s.mark()))
+    s.add_counts(('users',), {'a': 5, 'b': 1})
+    s.add_objects({'1/2': {'ver': 1}}, 'ver')
+    s.commit()
+    s.conn.close()
+    resumed = SpillStore(resume=mark)
+    try:
+        assert resumed.spills == 1
+        assert list(resumed.counts(('users',))) == [(['a'], 1)]
+        assert [i for i, _ in resumed.objects()] == ['1/1']
+    finally:
+        resumed.close()
+    assert not (tmp_path / mark['path']).exists()
+
+
+def test_close_removes_file(tmp_path):
+    s = SpillStore(str(tmp_path))
+    s.close()
+    assert list(tmp_path.iterdir()) == []
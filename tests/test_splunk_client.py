@@ -0,0 +1,104 @@
+import csv
+import json
+
+import pytest
+
+import fake_splunk_server
+import splunk_client
+from splunk_client import SplunkClient, SplunkError
+
+SEARCH = 'search workspace'
+HEADER = ['_time', 'alice', 'bob']
+ROWS = [['2015-03-{:02d}T00:00:00'.format(d), str(d), str(d % 3)]
+        for d in range(1, 11)]
+
+
+def serve(tmp_path, rows, **kwargs):
+    path = tmp_path / 'results.csv'
+    with open(str(path), 'w') as f:
+        csv.writer(f, lineterminator='\n').writerows([HEADER] + rows)
+    server = fake_splunk_server.FakeSplunk(
+        ('localhost', 0), {SEARCH: str(path)}, polls_until_done=2, **kwargs)
+    server.start()
+    return server
+
+
+@pytest.fixture
+def server(tmp_path):
+    s = serve(tmp_path, ROWS, page_delay=0.05)
+    yield s
+    s.shutdown()
+    s.server_close()
+
+
+def client(server, password=fake_splunk_server.PASSWORD_DEFAULT, **kwargs):
+    kwargs.setdefault('page_size', 3)
+    kwargs.setdefault('workers', 3)
+    return SplunkClient(server.url, 'admin', password, poll_interval=0.01,
+                        **kwargs)
+
+
+def read_csv(path):
+    with open(str(path)) as f:
+        return list(csv.reader(f))
+
+
+def pages(server):
+    return [p for _, p in server.requests if '/results' in p]
+
+
+def test_csv_pages_joined_in_order(server, tmp_path):
+    out = tmp_path / 'out.csv'
+    client(server).export([(SEARCH, str(out))])
+    assert read_csv(out) == [HEADER] + ROWS
+    assert len(pages(server)) == 4
+    assert server.max_active_pages > 1
+    assert server.logins == 1
+
+
+def test_json_pages(server, tmp_path):
+    out = tmp_path / 'out.json'
+    client(server, workers=2).export([(SEARCH, str(out))],
+                                     splunk_client.JSON)
+    with open(str(out)) as f:
+        results = json.load(f)
+    assert results == [dict(zip(HEADER, r)) for r in ROWS]
+
+
+def test_one_login_for_several_exports(server, tmp_path):
+    outs = [tmp_path / 'a.csv', tmp_path / 'b.csv']
+    client(server).export([(SEARCH, str(o)) for o in outs])
+    assert [read_csv(o) for o in outs] == [[HEADER] + ROWS] * 2
+    assert server.logins == 1
+
+
+def test_no_results_keeps_header(tmp_path):
+    s = serve(tmp_path, [])
+    try:
+        out = tmp_path / 'out.csv'
+        client(s).export([(SEARCH, str(out))])
+        assert read_csv(out) == [HEADER]
+    finally:
+        s.shutdown()
+        s.server_close()
+
+
+def test_bad_password(server, tmp_path):
+    with pytest.raises(SplunkError):
+        client(server, password='wrong').export(
+            [(SEARCH, str(tmp_path / 'out.csv'))])
+    assert not (tmp_path / 'out.csv').exists()
+
+
+def test_unknown_search(server, tmp_path):
+    with pytest.raises(SplunkError):
+        client(server).export([('search nothing', str(tmp_path / 'x.csv'))])
+
+
+def test_failed_page_leaves_no_output(server, tmp_path):
+    # the pages of an unknown job are answered with 404
+    with pytest.raises(SplunkError):
+        client(server).fetch('nosuchjob', str(tmp_path / 'out.csv'),
+                             count=len(ROWS))
+    assert not (tmp_path / 'out.csv').exists()
+    assert [p.name for p in tmp_path.iterdir()] == ['results.csv']
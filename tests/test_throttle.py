@@ -0,0 +1,115 @@
+import time
+
+import pytest
+
+import throttle
+from throttle import Throttle
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+    def strftime(self, fmt):
+        return time.strftime(fmt, time.gmtime(self.now))
+
+
+class DB(object):
+    """Reports the queue lengths in queues, one per serverStatus call, then
+    the last one for ever."""
+
+    def __init__(self, *queues):
+        self.queues = list(queues)
+        self.calls = 0
+
+    def command(self, name):
+        assert name == 'serverStatus'
+        self.calls += 1
+        queue = self.queues.pop(0) if len(self.queues) > 1 else self.queues[0]
+        return {'globalLock': {'currentQueue': {'total': queue}},
+                'opcounters': {'query': 0}}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(throttle, 'time', c)
+    return c
+
+
+def pacer(db, **kw):
+    kw.setdefault('max_lag', 0)
+    kw.setdefault('sample_interval', 0)
+    return Throttle(db, **kw)
+
+
+def test_delay_and_batch_follow_load(clock):
+    # queue 15 of 10 is over budget but short of a pause
+    t = pacer(DB(*([15] * 12 + [0])), max_delay=1.0)
+    delays = []
+    sizes = []
+    for _ in range(20):
+        t.wait()
+        delays.append(t.delay)
+        sizes.append(t.batch_size(1000))
+    assert delays[:6] == [0.05, 0.1, 0.2, 0.4, 0.8, 1.0]
+    assert delays[6:12] == [1.0] * 6
+    assert sizes[:6] == [500, 250, 125, 62, 50, 50]
+    assert sizes[6:12] == [50] * 6
+    # back under budget the delay halves to nothing and the batch regrows
+    assert delays[12:] == [0.5, 0.25, 0.125, 0.0625, 0.03125, 0.0, 0.0, 0.0]
+    assert sizes[12:17] == [100, 200, 400, 800, 1000]
+    assert clock.slept == [d for d in delays if d]
+
+
+def test_latency_signal(clock):
+    t = pacer(DB(0), max_slowdown=3.0)
+    t.batch_done(1.0, 1000)
+    t.wait()
+    assert (t.delay, t.fraction) == (0.0, 1.0)
+    t.batch_done(2.5, 1000)
+    t.wait()
+    assert t.delay == 0.0
+    t.batch_done(4.0, 1000)
+    t.wait()
+    assert t.signals['latency'] == pytest.approx(4.0 / 3)
+    assert (t.delay, t.fraction) == (throttle.MIN_DELAY, 0.5)
+
+
+def test_pause_until_under_budget(clock):
+    # 25 of 10 is over the pause load; three samples later it has cleared
+    t = pacer(DB(25, 25, 25, 5), sample_interval=10.0, max_pause=300.0)
+    t.wait()
+    assert clock.slept == [10.0, 10.0, 10.0]
+    assert t.load == 0.5
+    assert (t.delay, t.fraction) == (0.0, 1.0)
+
+
+def test_pause_capped(clock):
+    db = DB(25)
+    t = pacer(db, sample_interval=10.0, max_pause=60.0, max_delay=30.0)
+    t.wait()
+    assert sum(clock.slept[:-1]) == 60.0
+    # the scan carries on at the max delay, still over budget
+    assert t.delay == 30.0
+    assert clock.slept[-1] == 30.0
+    assert db.calls == 7
+    assert t.batch_size(1000) == 500
+
+
+def test_disabled(clock):
+    t = pacer(DB(100), enabled=False)
+    t.batch_done(1.0, 10)
+    t.wait()
+    assert t.batch_size(1000) == 1000
+    assert clock.slept == []
+    assert list(t.paced(range(5), batch=2)) == list(range(5))
@@ -0,0 +1,75 @@
+import datetime
+import time
+
+from bson.objectid import ObjectId
+
+import timeseries
+from timeseries import label, label_date, labels
+
+D = datetime.date
+
+
+def test_labels_sort_and_round_trip():
+    for g, lbl in (('day', '20150302'), ('week', '2015W10'),
+                   ('month', '201503')):
+        assert label(D(2015, 3, 2), g) == lbl
+        assert label(label_date(lbl, g), g) == lbl
+    # ISO week 1 of 2015 starts in 2014
+    assert label(D(2014, 12, 29), 'week') == '2015W01'
+    assert label_date('2015W01', 'week') == D(2014, 12, 29)
+
+
+def test_labels_fill_gaps():
+    assert labels(['201501', '201504', 'cumulative_x'], 'month') == [
+        '201501', '201502', '201503', '201504']
+    assert labels(['2015W52', '2016W01'], 'week') == [
+        '2015W52', '2015W53', '2016W01']
+
+
+def test_labels_window():
+    assert labels([], 'day', D(2015, 2, 27), D(2015, 3, 2)) == [
+        '20150227', '20150228', '20150301']
+    assert labels(['201501'], 'month', until=D(2015, 3, 1)) == [
+        '201501', '201502']
+
+
+def test_labels_empty():
+    assert labels([], 'month') == []
+    assert labels(['cumulative_x'], 'day') == []
+
+
+def test_id_range_is_local_midnight():
+    assert timeseries.id_range() is None
+    r = timeseries.id_range(D(2015, 3, 1), D(2015, 3, 2))
+    start = time.mktime(D(2015, 3, 1).timetuple())
+    assert r['$gte'] == ObjectId.from_datetime(
+        datetime.datetime.utcfromtimestamp(start))
+    assert r['$lt'] == ObjectId.from_datetime(
+        datetime.datetime.utcfromtimestamp(start + 86400))
+    assert timeseries.id_date(r['$gte']) == D(2015, 3, 1)
+    assert timeseries.id_label(r['$lt'], 'day') == '20150302'
+
+
+def test_parse_until_clamped():
+    tomorrow = D.today() + datetime.timedelta(days=1)
+    assert timeseries.parse_until('2999-01-01') == tomorrow
+    assert timeseries.parse_until('2015-03-01') == D(2015, 3, 1)
+
+
+def test_add_cumulative():
+    series = {'201501': {'pub': {'cnt': 1}},
+              '201502': {},
+              '201503': {'pub': {'cnt': 2}, 'priv': {'cnt': 5}}}
+    timeseries.add_cumulative(series, ['201501', '201502', '201503'])
+    assert series['201502'] == {'cumulative_pub': {'cnt': 1}}
+    assert series['201503']['cumulative_pub'] == {'cnt': 3}
+    assert series['201503']['cumulative_priv'] == {'cnt': 5}
+    # the running totals are copies
+    series['201501']['cumulative_pub']['cnt'] = 100
+    assert series['201502']['cumulative_pub'] == {'cnt': 1}
+
+
+def test_add_cumulative_empty():
+    series = {}
+    timeseries.add_cumulative(series, [])
+    assert series == {}
@@ -0,0 +1,129 @@
+import json
+import sqlite3
+
+import pytest
+
+import user_index
+
+WS = {'alice': {'pub': {'del': {'cnt': 1, 'byte': 10},
+                        'std': {'cnt': 2, 'byte': 20}},
+                'priv': {'std': {'cnt': 3, 'byte': 30}}},
+      'bob': {'priv': {'del': {'cnt': 1, 'byte': 5}}}}
+SHOCK = {'by_user': {'alice': {'pub': {'cnt': 1, 'byte': 100}},
+                     'carol': {'priv': {'cnt': 2, 'byte': 1000}}},
+         'by_month': {}}
+AWE = {'bob': {'pub': {'cnt': 2, 'seconds': 3.7}}}
+
+
+class Args(object):
+
+    def __init__(self, **kwargs):
+        for k in ('workspace', 'shock', 'awe', 'narrative_db', 'staff'):
+            setattr(self, k, kwargs.get(k))
+        self.narrative_table = 'narrative'
+        self.force = kwargs.get('force', False)
+
+
+def write_json(tmp_path, name, value):
+    path = tmp_path / name
+    path.write_text(json.dumps(value))
+    return str(path)
+
+
+@pytest.fixture
+def sources(tmp_path):
+    narrative = str(tmp_path / 'narrative.sqlite')
+    conn = sqlite3.connect(narrative)
+    conn.execute('CREATE TABLE narrative (user TEXT, event TEXT, dur REAL)')
+    conn.executemany('INSERT INTO narrative VALUES (?, ?, ?)',
+                     [('alice', 'O', 0), ('alice', 'F', 2.5),
+                      ('dave', 'F', 1.0), ('dave', 'F', 1.0)])
+    conn.commit()
+    conn.close()
+    staff = tmp_path / 'staff.lst'
+    staff.write_text(u'erin\nalice\n\n')
+    return {'workspace': write_json(tmp_path, 'ws.json', WS),
+            'shock': write_json(tmp_path, 'shock.json', SHOCK),
+            'awe': write_json(tmp_path, 'awe.json', AWE),
+            'narrative_db': narrative, 'staff': str(staff)}
+
+
+@pytest.fixture
+def conn(tmp_path):
+    c = user_index.open_index(str(tmp_path / 'index.sqlite'))
+    yield c
+    c.close()
+
+
+def test_empty_index(conn):
+    assert user_index.lookup(conn, 'alice') is None
+    assert user_index.top(conn, 'bytes', 5) == []
+
+
+def test_join(conn, sources):
+    user_index.update_index(conn, Args(**sources))
+    alice = user_index.lookup(conn, 'alice')
+    assert alice['ws_objects'] == 6
+    assert alice['ws_bytes'] == 60
+    assert alice['shock_bytes'] == 100
+    assert alice['bytes'] == 160
+    assert alice['staff'] == 1
+    assert alice['narrative_opens'] == 1
+    assert alice['method_seconds'] == 2
+    assert user_index.lookup(conn, 'bob')['awe_seconds'] == 3
+    assert user_index.lookup(conn, 'dave')['method_calls'] == 2
+    # staff without any usage are kept for the flag
+    assert user_index.lookup(conn, 'erin')['staff'] == 1
+    assert [r['user'] for r in user_index.top(conn, 'bytes', 2)] == [
+        'carol', 'alice']
+
+
+def test_update_replaces_source(conn, sources, tmp_path):
+    user_index.update_index(conn, Args(**sources))
+    write_json(tmp_path, 'shock.json', {'by_user': {
+        'alice': {'priv': {'cnt': 1, 'byte': 7}}}})
+    user_index.update_index(conn, Args(shock=sources['shock']))
+    assert user_index.lookup(conn, 'alice')['bytes'] == 67
+    # carol had only Shock data
+    assert user_index.lookup(conn, 'carol') is None
+
+
+def test_unchanged_source_skipped(conn, sources):
+    assert user_index.update_source(
+        conn, 'awe', ['awe_jobs', 'awe_seconds'], sources['awe'],
+        user_index.awe_rows(sources['awe']), 'sig')
+    assert not user_index.update_source(
+        conn, 'awe', ['awe_jobs', 'awe_seconds'], sources['awe'], iter([]),
+        'sig')
+    assert user_index.update_source(
+        conn, 'awe', ['awe_jobs', 'awe_seconds'], sources['awe'], iter([]),
+        'sig', force=True)
+    assert user_index.lookup(conn, 'bob') is None
+
+
+def test_failed_source_rolled_back(tmp_path, sources):
+    path = str(tmp_path / 'index.sqlite')
+    conn = user_index.open_index(path)
+    user_index.update_index(conn, Args(**sources))
+    conn.close()
+    (tmp_path / 'shock.json').write_text(u'{"by_user": {"alice": {"pub": ')
+    conn = user_index.open_index(path)
+    with pytest.raises(ValueError):
+        user_index.update_index(conn, Args(shock=sources['shock']))
+    conn.close()
+    conn = user_index.open_index(path)
+    try:
+        assert user_index.lookup(conn, 'carol')['shock_bytes'] == 1000
+    finally:
+        conn.close()
+
+
+def test_empty_source(conn, tmp_path):
+    path = write_json(tmp_path, 'ws.json', {})
+    user_index.update_index(conn, Args(workspace=path))
+    assert user_index.top(conn, 'ws_bytes', 5) == []
+
+
+def test_top_unknown_column(conn):
+    with pytest.raises(ValueError):
+        user_index.top(conn, 'user; DROP TABLE users', 1)
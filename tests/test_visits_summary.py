@@ -0,0 +1,128 @@
+import io
+
+import numpy as np
+import pytest
+
+import visits_summary
+from visits_summary import Visits
+
+# Expected outputs are what user_visits_histogram.pl, user_counts.pl and
+# recent.pl gave for this CSV and staff list, less the meta sections.
+HEADER = '_time,alice,bob,staff1,NULL,"-",carol,frank,dave'
+ROWS = ['2015-01-30T00:00:00.000-08:00,1,2,1,5,3,,,',
+        '2015-01-31T00:00:00.000-08:00,1,,,,,1,,',
+        '2015-02-01T00:00:00.000-08:00,1,1,1,2,,,0,',
+        '2015-02-02T00:00:00.000-08:00,,,,,1,,,1',
+        '2015-03-01T00:00:00.000-08:00,1,0,1,4,,1,,']
+STAFF = set(['staff1', 'erin'])
+
+
+def visits(header=HEADER, rows=ROWS):
+    return Visits(io.StringIO(u'\n'.join([header] + rows) + u'\n'))
+
+
+def strip_meta(d):
+    return dict((k, v) for k, v in d.items() if k != 'meta')
+
+
+def test_histogram():
+    h = visits_summary.histogram(visits(), STAFF)
+    assert h['by_user'] == {
+        'alice': {'staff': False, 'visits': 4, 'first': '2015-01-30',
+                  'last': '2015-03-01', 'span': 31,
+                  'visitation_rate': 4 / 31.0},
+        'bob': {'staff': False, 'visits': 2, 'first': '2015-01-30',
+                'last': '2015-02-01', 'span': 31,
+                'visitation_rate': 2 / 31.0},
+        'carol': {'staff': False, 'visits': 2, 'first': '2015-01-31',
+                  'last': '2015-03-01', 'span': 30,
+                  'visitation_rate': 2 / 30.0},
+        'dave': {'staff': False, 'visits': 1, 'first': '2015-02-02',
+                 'last': '2015-02-02', 'span': 28,
+                 'visitation_rate': 1 / 28.0},
+        # never visited; staff who never visited are left out
+        'frank': {'staff': False},
+        'staff1': {'staff': True, 'visits': 3, 'first': '2015-01-30',
+                   'last': '2015-03-01', 'span': 31,
+                   'visitation_rate': 3 / 31.0}}
+    assert h['counts_by_visits'] == {
+        'visitors_by_date_all': {'2015-01-30': 3, '2015-01-31': 2,
+                                 '2015-02-01': 3, '2015-02-02': 1,
+                                 '2015-03-01': 3},
+        'visitors_by_date_ext': {'2015-01-30': 2, '2015-01-31': 2,
+                                 '2015-02-01': 2, '2015-02-02': 1,
+                                 '2015-03-01': 2},
+        'all': {'2': 2, '3': 1, '4': 1},
+        'nonkbase': {'2': 2, '4': 1}}
+    assert h['histogram'] == [
+        {'label': '2 visits', 'range': {'start': 2, 'end': 2},
+         'counts': {'all': 2, 'nonkbase': 2}},
+        {'label': '3 visits', 'range': {'start': 3, 'end': 3},
+         'counts': {'all': 1, 'nonkbase': 0}},
+        {'label': '4 visits', 'range': {'start': 4, 'end': 4},
+         'counts': {'all': 1, 'nonkbase': 1}}]
+    assert h['range'] == {'start': '2015-01-30', 'end': '2015-03-01'}
+
+
+def test_visit_buckets():
+    # 8 repeat visitors, so a bucket closes once it holds more than 8 / 6.
+    # As in the perl, a bucket starts at the first count after the last
+    # one closed, whether or not anyone made that many visits.
+    nvisits = np.array([1, 1, 2, 2, 2, 3, 5, 5, 7, 9])
+    is_staff = np.array([False] * 6 + [True] + [False] * 3)
+    assert visits_summary.visit_buckets(nvisits, is_staff) == [
+        {'label': '2 visits', 'range': {'start': 2, 'end': 2},
+         'counts': {'all': 3, 'nonkbase': 3}},
+        {'label': '3 to 5 visits', 'range': {'start': 3, 'end': 5},
+         'counts': {'all': 3, 'nonkbase': 2}},
+        {'label': '6 to 9 visits', 'range': {'start': 6, 'end': 9},
+         'counts': {'all': 2, 'nonkbase': 2}}]
+    assert visits_summary.visit_buckets(np.array([0, 1]),
+                                        np.array([False, True])) is None
+
+
+@pytest.mark.parametrize('monthly,window,months', [
+    (False, '> 1 day', [
+        # (cumulative, cumulative returning, new, returning, total)
+        (3, 1, 3, 1, 3),
+        (4, 2, 1, 1, 3),
+        (4, 3, 0, 1, 2)]),
+    (True, '> 1 month', [
+        (3, 0, 3, 0, 3),
+        (4, 2, 1, 2, 3),
+        (4, 3, 0, 1, 2)])])
+def test_user_counts(monthly, window, months):
+    c = visits_summary.user_counts(visits(), STAFF, monthly)
+    assert strip_meta(c) == {
+        'excludes_internal_kbase': True,
+        'return_user_window': window,
+        'start': '2015-01',
+        'end': '2015-03',
+        'cumulative_users': 4,
+        'cummulative_return_users': 3,
+        'by_month': [
+            {'year': 2015, 'month': m, 'cummulative_users': cu,
+             'cummulative_return_users': cr, 'new_users': n,
+             'return_users': r, 'total_users': t}
+            for m, (cu, cr, n, r, t) in zip([1, 2, 3], months)]}
+
+
+def test_recent():
+    r = visits_summary.recent(visits(), STAFF)
+    assert strip_meta(r) == {
+        'users': [{'userid': 'alice', 'staff': False},
+                  {'userid': 'staff1', 'staff': True},
+                  {'userid': 'carol', 'staff': False}],
+        'data': {'timerange': {'below': '2015-03-01T00:00:00.000-08:00',
+                               'from': '2015-02-02T00:00:00.000-08:00'}}}
+
+
+def test_span_columns_skipped():
+    spans = visits(HEADER + ',_span,_spandays',
+                   [r + ',86400,1' for r in ROWS])
+    plain = visits()
+    for summarize in (visits_summary.histogram, visits_summary.user_counts,
+                      visits_summary.recent):
+        assert (strip_meta(summarize(spans, STAFF)) ==
+                strip_meta(summarize(plain, STAFF)))
+    assert '_span' not in visits_summary.histogram(spans, STAFF)['by_user']